@@ -2,27 +2,22 @@ import argparse
 import datetime
 import json
 import os
-from typing import List, Set
+from typing import List, Optional, Set
 
-from orca.lib.apk import get_apk
-from orca.lib.ascii_checkers import parse_gemspec
 from orca.lib.bin_checkers import check_binaries
-from orca.lib.composer import get_composer
 from orca.lib.cpe2cve import cpe2cve
-from orca.lib.dnf import get_dnf
-from orca.lib.dpkg import get_dpkg
-from orca.lib.golang import extract_go_dependencies, get_gomod
-from orca.lib.jar import get_jar
-from orca.lib.package_json import get_package_json
+from orca.lib.golang import extract_go_dependencies
+from orca.lib.layerfs import as_layerfs
 from orca.lib.path import get_filepaths
-from orca.lib.perl import get_perl
-from orca.lib.pkgconfig import get_pkgconfig
-from orca.lib.python import extract_python_dependencies
-from orca.lib.rpm_packages import get_rpm
+from orca.lib.registry import PathIndex, get_analyzers
+from orca.lib.sniff import sniff_files
 from orca.lib.logger import logger
+from orca.lib.pathtable import PathTable
 from orca.lib.types import VulnerabilityReport
+from orca.lib.verify import verify_packages
 
 unuseful_extensions = [".php",".h",".c",".xml",".png",".csv",".js",".css",".jar"]
+OS_INFOS = ["etc/os-release","etc-release","usr/lib/os-release","etc/debian_version"]
 
 
 
@@ -31,37 +26,39 @@ def is_executable(file_path):
 
 
 def get_executables(files,directory) -> List[str]:
+    fs = as_layerfs(directory)
     no_ext = filter(lambda x: "." not in x.split("/")[-1],files) # First no extension.
-    no_ext_executable = filter(lambda x: is_executable(os.path.join(directory,x)),no_ext)
+    no_ext_executable = filter(fs.is_executable,no_ext)
 
-    no_ext_binary = list(filter(lambda x: is_binary_executable(os.path.join(directory,x)),no_ext_executable))
+    no_ext_binary = list(filter(lambda x: is_binary_executable(x,fs),no_ext_executable))
     libs = list(filter(lambda x:  x.endswith(".so"),files))
     return no_ext_binary + libs
 
 def split_executable_files(files, directory):
+    fs = as_layerfs(directory)
     executables = []
     non_executables = []
     for path in files:
        file = path.split("/")[-1]
-       real_path = os.path.join(directory, path)
        if any([file.endswith(ext) for ext in unuseful_extensions]):
            non_executables.append(path)
        elif file.startswith("lib")  and ".so" in file:
            continue
-       elif is_binary_executable(real_path):
+       elif is_binary_executable(path,fs):
         executables.append(path)
-       elif os.path.isdir(real_path):
+       elif fs.isdir(path):
            continue
        else:
             non_executables.append(path)
     return executables, non_executables
 
 
-def is_binary_executable(file_path):
-    if not os.path.isfile(file_path):
+def is_binary_executable(path,directory):
+    fs = as_layerfs(directory)
+    if not fs.isfile(path):
         return False
     try:
-        with open(file_path, "rb") as f:
+        with fs.open(path, "rb") as f:
             magic = f.read(4)
     except Exception:
         return False
@@ -69,16 +66,15 @@ def is_binary_executable(file_path):
     return magic == b"\x7fELF"  # Check for ELF magic number
 
 def add_duplicate_links(directory,paths,files):
+    fs = as_layerfs(directory)
     fcopy = set()
     for file in paths.union(files):
         if len(file) < 2:
             # paths.remove(file)
             continue
-        orig_path = directory + "/" + file
-        realpath = os.path.realpath(orig_path)
-        cleanpath = realpath.replace(directory + "/", "")
+        cleanpath = fs.realpath(file)
 
-        if orig_path != realpath and (
+        if file != cleanpath and (
             (cleanpath in files and file not in files)
             or (cleanpath in paths and file in files)
         ):
@@ -87,16 +83,15 @@ def add_duplicate_links(directory,paths,files):
     return fcopy
 
 def remove_links(directory,paths):
+    fs = as_layerfs(directory)
     real_paths = set()
     for file in paths:
         if len(file) < 2:
             # paths.remove(file)
             continue
-        orig_path = directory + "/" + file
-        realpath = os.path.realpath(orig_path)
-        cleanpath = realpath.replace(directory + "/", "")
+        cleanpath = fs.realpath(file)
 
-        if orig_path != realpath:
+        if file != cleanpath:
             real_paths.add(cleanpath)
         else:
             real_paths.add(file)
@@ -106,15 +101,15 @@ def maybe_binary(file: str):
     end = file.split("/")[-1]
     return ("." not in file or ".so" in file) and end.lower() == end
 
-def scan_os(paths: List[str],directory: str)-> None:
-    OS_INFOS = ["etc/os-release","etc-release","usr/lib/os-release","etc/debian_version"]
+def scan_os(paths: List[str],directory)-> None:
+    fs = as_layerfs(directory)
     os_relevant_paths = [path for path in paths if path in OS_INFOS ]
     if len(os_relevant_paths) == 0:
         logger.warning("Could not find os information")
     else:
         osinfo = {}
         for path in os_relevant_paths:
-            content = open(os.path.join(directory,path)).read()
+            content = fs.open(path).read()
             if "debian_version" in path:
                 osinfo["version"] =  content.strip().split("/")[0]
             data = {}
@@ -142,71 +137,90 @@ def scan_os(paths: List[str],directory: str)-> None:
         return osinfo 
     return None
 
-def scan_filesystem(directory: str,files,analyze_binaries=False,accurate=False) -> VulnerabilityReport:
+def scan_filesystem(directory,files,analyze_binaries=False,accurate=False,package_state=None,all_binaries=False,verify=False,table: Optional[PathTable]=None) -> VulnerabilityReport:
     """
         Scans the filesystem to identify and analyze files, extract dependencies, and generate a vulnerability report.
         Args:
-            directory (str): The root directory to scan for files. This directory does not contain links or devices.
+            directory (str | LayerFS): The root directory to scan for files, or a layer filesystem (e.g., backed by the layer tar). It does not contain links or devices.
             files (list): A list of files to analyze. This includes also links and devices.
             analyze_binaries (bool, optional): Whether to analyze binary files for dependencies. Defaults to False.
             accurate (bool, optional): Whether to perform additional steps to remove duplicate files for more accurate results. Defaults to False.
+            package_state (PackageState, optional): State of the lower layers for incremental scans: only new files and package database changes are analyzed. Files unchanged since a lower layer are accounted for in its report and are not in `remaining_files`. Defaults to None.
+            all_binaries (bool, optional): Whether to analyze also the binaries already owned by a package, instead of only the ones left in `remaining_files`. Defaults to False.
+            verify (bool, optional): Whether to check the files of the packages against the digests of their package manager (dpkg md5sums, rpmdb, apk installed db, Python RECORD). Mismatches are stored in `report.tampered`. Defaults to False.
+            table (PathTable, optional): Path table shared by the reports of the layers of an image. Defaults to a new table.
         Returns:
             VulnerabilityReport: A report containing information about identified vulnerabilities, packages, and remaining files.
        
     """
+    directory = as_layerfs(directory)
     paths: Set[str] = get_filepaths(directory)
+    # SHA1/SHA256 of every regular file, for the SPDX report, --verify and the file cache.
+    # Archive layers hash their members while they are indexed, folders are read once here
+    directory.hash_files()
 
 
-    report: VulnerabilityReport = VulnerabilityReport(paths,files)
+    report: VulnerabilityReport = VulnerabilityReport(paths,files,table)
     
     osinfo = scan_os(report.remaining_files,directory)
     if osinfo is not None:
         report.os = osinfo
+
+    if package_state is not None:
+        # Files unchanged since the lower layers are attributed there already
+        new_paths = package_state.new_paths(directory,paths)
+        logger.info(f"New files in layer {len(new_paths)}")
+        report.remaining_files = new_paths
+        paths = new_paths
     
     # OS-packages
     logger.info(f"Initial files {len(paths)}")
     
-    logger.info("Parsing executables")
-    executable = get_executables(report.remaining_files, directory)
-    logger.info(f"Found {len(executable)} executables")
-
-    # assume go
-    go = extract_go_dependencies(executable, directory)
-    report.add_package_files(go)
-    
+    logger.info("Sniffing file contents")
+    sniffed = sniff_files(directory,report.remaining_files)
+    logger.info(f"Found {len(sniffed.elf())} executables")
     
     # Try to remove duplicates probably could be removed
     if accurate:
         logger.info("Removing duplicates")
         duplicates = add_duplicate_links(directory,paths,report.analyzed_files)
-        report.analyzed_files.update(duplicates)
+        report.analyzed_files = report.analyzed_files.union(duplicates)
         report.remaining_files = report.remaining_files.difference(duplicates)
 
 
-    logger.info("Parsing language-specific packages")
- 
-    report.add_package_files(extract_python_dependencies(paths,directory))
-    report.add_package_files(get_jar(report.remaining_files,directory))
-    report.add_package_files(get_package_json(report.remaining_files,directory))
-    report.add_package_files(get_composer(report.remaining_files, directory))
-    report.add_package_files(get_perl(report.remaining_files,directory))
-    report.add_package_files(parse_gemspec(report.remaining_files,directory))
-    report.add_package_files(get_gomod(report.remaining_files,directory))
-    
+    logger.info("Parsing packages")
+    analyzers = get_analyzers()
+    index = PathIndex(analyzers,report.remaining_files,sniffed)
+    for analyzer in analyzers:
+        scanner = package_state.scanner(analyzer.name) if package_state is not None else None
+        if scanner is None:
+            report.add_package_files(analyzer.run(index,report.remaining_files,directory))
+        else:
+            package_files,changes = scanner(report.initial_files,directory,directory.root)
+            report.add_package_files(package_files)
+            report.package_changes.update(changes)
 
+    # Binaries listed by a package manager are attributed already: only the unowned ones are analyzed
+    if all_binaries:
+        go_binaries,executable = sniffed.elf(go=True),sniffed.elf()
+    else:
+        remaining = report.remaining_files
+        go_binaries = [path for path in sniffed.elf(go=True) if path in remaining]
+        executable = [path for path in sniffed.elf() if path in remaining]
+        logger.info(f"Unowned executables {len(executable)}")
 
-    logger.info("Parsing OS package managers")
-    report.add_package_files(get_dpkg(report.remaining_files, directory))
-    report.add_package_files(get_rpm(report.remaining_files, directory))
-    report.add_package_files(get_apk(report.remaining_files,directory))
-    report.add_package_files(get_dnf(report.remaining_files,directory))
-    report.add_package_files(get_pkgconfig(report.remaining_files,directory))
+    go = extract_go_dependencies(go_binaries, directory, sniffed.elves)
+    report.add_package_files(go)
 
     if analyze_binaries:
-        binaries = check_binaries(directory,executable) 
+        binaries = check_binaries(directory,executable,sniffed.elves)
         report.add_package_files(binaries)
 
+    if verify:
+        report.tampered = verify_packages(directory,report)
+        logger.info(f"Tampered files {sum(len(files) for files in report.tampered.values())}")
 
+    report.digests = directory.digests()
     logger.info(f"Files not indexed {len(report.remaining_files)}")
     logger.info(f"Total Packages {len(report.packages)}")
     return report
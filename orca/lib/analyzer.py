@@ -1,9 +1,9 @@
-from.utils import calculate_sha256
+from.layerfs import as_layerfs, path_exists
 from.logger import logger
-import base64
 import os
 import requests
 from.types import PackageRecord, to_record
+from.verify import file_digest, record_digest
 import re
 from packaging.version import Version
 
@@ -63,27 +63,26 @@ def search_vulnerabilities(name: str,version: str):
 
 
 
-def analyze_record(directory: str, record: PackageRecord) -> bool:
+def analyze_record(directory, record: PackageRecord) -> bool:
+    """
+    Checks one `RECORD` entry against the file, relative to `directory` (a folder or a layer filesystem).
+    """
     #logger.info(f"Analysing record {directory}/{record.path}")
-    if not os.path.exists(f"{directory}/{record.path}") and record.nlines is not None:
-        logger.error(f"Path does not exist {directory}/{record.path}")
-        print(record)
-    if record.nlines is not None:
-        fp = open(f"{directory}/{record.path}","rb")
-        content = fp.read()
-        if len(content) != record.nlines:
-            logger.error(f"File {directory}/{record.path} has incorrect number of bytes: expected {record.nlines}, actual {len(content)}")
-            return False
-        assert record.hashtype == "sha256"
-        hash = calculate_sha256(f"{directory}/{record.path}")
-        digest = base64.urlsafe_b64encode(hash).decode()
-        if digest[-1] == "=":
-            digest = digest[:-1]
-        if digest != record.hash:
-            logger.error(f"Hash value does not match for file: {directory}/{record.path}")
-            return False
-
-
+    expected = record_digest(record)
+    if record.hashtype is None or expected is None:
+        return True
+    fs = as_layerfs(directory)
+    if not path_exists(fs.join(record.path)):
+        logger.error(f"Path does not exist {fs.root}/{record.path}")
+        return False
+    try:
+        digest = file_digest(fs, record.path, record.hashtype)
+    except ValueError as e:
+        logger.error(f"Cannot check {fs.root}/{record.path}: {e}")
+        return False
+    if digest != expected:
+        logger.error(f"Hash value does not match for file: {fs.root}/{record.path}")
+        return False
     return True
 
 def get_package_version(directory: str, package: str) -> str:
@@ -1,39 +1,136 @@
 
-import os
-from typing import Dict, List
+import base64
+import binascii
+import io
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from . import logger
-from .types import PackageInfo,PackageInfoType
+from .layerfs import as_layerfs, open_file
+from .types import FileGroups, PackageInfo,PackageInfoType
 
 
+@dataclass
+class ApkDirectory:
+    """
+    An `F:` record and the `R:` files listed under it, with their `Z:` checksums.
+    The path is interned by the parser: every package with files in a directory
+    shares the same string.
+    """
+    path: str
+    names: List[str] = field(default_factory=list)
+    checksums: List[Optional[str]] = field(default_factory=list)
 
-def read_apk_db(db_path,path) -> Dict[PackageInfo,List[str]]:
-    fs = open(db_path).read()
-    cpeMap = {}
-    for entry in fs.split("\n\n"):
-        print(entry)
-        package = ""
-        version = ""
-        last_folder = ""
-        files = set()
-        for line in entry.split():
-            if line.startswith("P:"):
-                package = line[2:]
-            elif line.startswith("V:"):
-                version = line[2:]
-            elif line.startswith("F:"):
-                last_folder = line[2:]
-            elif line.startswith("R:"):
-                files.add(last_folder + "/"+ line[2:])
-        if package == "":
+    def join(self, name: str) -> str:
+        return f"{self.path}/{name}" if self.path else name
+
+@dataclass
+class ApkPackage:
+    name: str = ""
+    version: str = ""
+    arch: Optional[str] = None
+    origin: Optional[str] = None
+    directories: List[ApkDirectory] = field(default_factory=list)
+
+    def info(self) -> PackageInfo:
+        return PackageInfo(self.name,self.version,None,PackageInfoType.APK)
+
+class ApkFiles(FileGroups):
+    """
+    Files of an apk package, kept as the directories of the installed db:
+    paths are only built when the files are read.
+    """
+    def __init__(self, directories: List[ApkDirectory], groups: Iterable[List[str]] = ()):
+        self.directories = directories
+        self.groups = list(groups)
+
+    @cached_property
+    def files(self) -> List[str]:
+        return [directory.join(name) for directory in self.directories for name in directory.names]
+
+    def checksums(self) -> Dict[str, str]:
+        """
+        `Z:` checksums of the files of the package, by path: `Q1`/`Q2` followed by
+        the base64 SHA1/SHA256 digest, or the hex MD5 digest for old databases.
+        """
+        return {directory.join(name): checksum for directory in self.directories
+                for name, checksum in zip(directory.names, directory.checksums) if checksum}
+
+def apk_digest(checksum: str) -> Optional[Tuple[str, bytes]]:
+    """
+    Hash algorithm and digest of a `Z:` checksum.
+    """
+    try:
+        if checksum.startswith("Q1"):
+            return "sha1", base64.b64decode(checksum[2:], validate=True)
+        if checksum.startswith("Q2"):
+            return "sha256", base64.b64decode(checksum[2:], validate=True)
+        return "md5", bytes.fromhex(checksum)
+    except (binascii.Error, ValueError):
+        return None
+
+def iter_apk_db(lines: Iterable[str]) -> Iterator[ApkPackage]:
+    """
+    Streams the packages of an apk installed db, one `key:value` record per line
+    and a blank line between packages. Values are taken whole, so paths may hold spaces.
+    """
+    directories: Dict[str, str] = {}
+    package = None
+    directory = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line == "":
+            if package is not None and package.name:
+                yield package
+            package, directory = None, None
             continue
-        files.add(path)
-        package = PackageInfo(package,version,None,PackageInfoType.APK)
-        cpeMap[package] = files
-    return cpeMap
+        if len(line) < 2 or line[1] != ":":
+            continue
+        key, value = line[0], line[2:]
+        if package is None:
+            package = ApkPackage()
+        # Most of the lines are file records
+        if key == "R":
+            if directory is None:
+                # Files listed before any F: record are at the root
+                directory = ApkDirectory("")
+                package.directories.append(directory)
+            directory.names.append(value)
+            directory.checksums.append(None)
+        elif key == "Z":
+            if directory is not None and len(directory.names):
+                directory.checksums[-1] = value
+        elif key == "F":
+            directory = ApkDirectory(directories.setdefault(value, value))
+            package.directories.append(directory)
+        elif key == "P":
+            package.name = value
+        elif key == "V":
+            package.version = value
+        elif key == "A":
+            package.arch = value
+        elif key == "o":
+            package.origin = value
+    if package is not None and package.name:
+        yield package
+
+def read_apk_db(db_path,path) -> Dict[PackageInfo,ApkFiles]:
+    with open_file(db_path) as fp:
+        return parse_apk_db(fp,path)
+
+def parse_apk_db(content,path) -> Dict[PackageInfo,ApkFiles]:
+    """
+    Packages of an installed db given as a string or an iterable of lines. The
+    database path is one group shared by the files of every package.
+    """
+    if isinstance(content, str):
+        content = io.StringIO(content)
+    database = [path]
+    return {package.info(): ApkFiles(package.directories,[database]) for package in iter_apk_db(content)}
 
 def read_world_file(db_path,path) -> Dict[PackageInfo,List[str]]:
-    lines = open(db_path).readlines()
+    lines = open_file(db_path).readlines()
     cpeMap = {}
     files = set()
     files.add(path)
@@ -43,15 +140,17 @@ def read_world_file(db_path,path) -> Dict[PackageInfo,List[str]]:
     return cpeMap
 
 # 1549 65
-def get_apk(paths: List[str],directory: str)-> Dict[PackageInfo,List[str]]:
-    apks = [p for p in paths if "apk/db/installed" in p or "apk/world" in p]# or "apk/db/names" in p ]
+def get_apk(paths: List[str],directory,candidates: Optional[List[str]] = None)-> Dict[PackageInfo,List[str]]:
+    fs = as_layerfs(directory)
+    candidates = paths if candidates is None else candidates
+    apks = [p for p in candidates if "apk/db/installed" in p or "apk/world" in p]# or "apk/db/names" in p ]
     total_pkgs = {}
     for path in apks:
         if "installed" in path:
-            packages = read_apk_db(os.path.join(directory,path),path)
+            packages = read_apk_db(fs.join(path),path)
             total_pkgs.update(packages)
         elif "world" in path:
-            packages = read_world_file(os.path.join(directory,path),path)
+            packages = read_world_file(fs.join(path),path)
             total_pkgs.update(packages)
 
  
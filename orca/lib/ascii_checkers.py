@@ -1,16 +1,18 @@
 
 
-import os
 import re
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from . import logger
+from .layerfs import as_layerfs
 from.types import PackageInfo, PackageInfoType
 
 GOSUM = re.compile(r'(\S+)\s+(\S+)\s+h1:(\S+)')
 
-def parse_gemspec(paths: List[str],directory: str) -> Dict[PackageInfo, List[str]]:
-   files = [f for f in paths if f.endswith(".gemspec")]
+def parse_gemspec(paths: List[str],directory,candidates: Optional[List[str]] = None) -> Dict[PackageInfo, List[str]]:
+   fs = as_layerfs(directory)
+   candidates = paths if candidates is None else candidates
+   files = [f for f in candidates if f.endswith(".gemspec")]
 
    patterns = {
         'name': r'\.name\s*=\s*["\']([^"\']+)["\']',
@@ -19,7 +21,7 @@ def parse_gemspec(paths: List[str],directory: str) -> Dict[PackageInfo, List[str
    packages: Dict[PackageInfo, List[str]] = {}
    for filename in files: 
          try:
-            file = open(os.path.join(directory,filename), 'r')
+            file = fs.open(filename, 'r')
          except Exception as e:
              logger.logger.error(f"[GEM] could not open file {filename} - {e}")
              continue
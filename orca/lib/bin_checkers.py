@@ -1,59 +1,54 @@
-
-
+import atexit
+import mmap
+import multiprocessing
 import os
 import re
-from typing import List
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
 from . import logger
+from .elf import STRING_SECTIONS, ELFCache, ELFError, printable_strings
+from .layerfs import DirectoryFS, as_layerfs, open_file
+from .filecache import FileProbe, get_file_cache
+from .signatures import SignatureScanner, default_scanner
 from.types import PackageInfo
 
-zlib = re.compile(r'inflate\s\(.*\)\s([0-9]+\.[0-9]+\.[0-9]+)')
-GCC_re = re.compile(r'GCC:\s\(.*\)\s([0-9]+\.[0-9]+\.[0-9]+)')
-GCC2_re = re.compile(r'gcc\s([0-9]+\.[0-9]+\.[0-9]+)')
-openssl_re = re.compile(r'.*OpenSSL\s([0-9]+\.[0-9]+\.[0-9]+)')
-pg_re = re.compile(r'.*\(PostgreSQL\)\s([0-9]+\.[0-9]+\.[0-9]+)')
+BINARY_WORKERS = os.cpu_count() or 1
+# Below this number of binaries, starting worker processes costs more than it saves
+POOL_MIN_BINARIES = 8
+# Budget of every binary: bytes scanned and seconds spent on it
+MAX_SCAN_SIZE = 256 * 1024 * 1024
+SCAN_TIME_BUDGET = 60
+# Content of archive members read ahead for the workers, in bytes
+MAX_PENDING_SIZE = 2 * MAX_SCAN_SIZE
 
-def check_gcc(strings: List[str]):
-   
+def check_signature(signature_id: str, strings: List[str]):
+   """
+   Version of the signature `signature_id` found in already extracted strings.
+   """
+   signature = next(s for s in default_scanner().signatures if s.id == signature_id)
    for string in strings:
-      match = GCC_re.search(string)
+      match = signature.regex.search(string.encode())
       if match:
-         version = match.group(1)
-         return PackageInfo("gcc",version,"gnu",None)
+         return signature.package(match.group(1))
    return None
 
+def check_gcc(strings: List[str]):
+   return check_signature("gcc", strings)
+
 def check_gcc2(strings: List[str]):
-   for string in strings:
-      match = GCC2_re.search(string)
-      if match:
-         version = match.group(1)
-         return PackageInfo("gcc",version,"gnu",None)
-   return None
+   return check_signature("gcc-version", strings)
 
 def check_openssl(strings: List[str]):
-   for string in strings:
-      match = openssl_re.search(string)
-      if match:
-         version = match.group(1)
-         return  PackageInfo("openssl",version,"openssl",None)
-   return None
+   return check_signature("openssl", strings)
 
 def check_postgres(strings: List[str]):
-   for string in strings:
-      match = pg_re.search(string)
-      if match:
-         version = match.group(1)
-         return PackageInfo("postgresql",version,"postgresql",None) 
-   return None
+   return check_signature("postgresql", strings)
 
 def check_zlib(strings: List[str]):
-   
-   for string in strings:
-      match = zlib.search(string)
-      if match:
-         version = match.group(1)
-         return PackageInfo("zlib",version,"zlib",None) 
-   return None
+   return check_signature("zlib", strings)
 
 def check_self(strings: List[str],binary_name):
    if len(binary_name) == 1:
@@ -73,22 +68,181 @@ def check_self(strings: List[str],binary_name):
 
 
 def extract_strings(filename, min_length=4):
-   thestrings = []
-   with open(filename, 'rb') as file:
+   with open_file(filename, 'rb') as file:
         data = file.read()
     
-   # Use a regex to find sequences of printable characters of at least `min_length`
-   pattern = re.compile(b'[\x20-\x7E]{' + str(min_length).encode() + b',}')
-   strings = pattern.findall(data)
-    
-   for s in strings:
-        thestrings.append(s.decode('ascii')) 
-   return thestrings
+   # Sequences of printable characters of at least `min_length`
+   return printable_strings(data, min_length)
+
+@dataclass
+class BinaryTask:
+   """
+   Work item of a binary scan: files on disk are memory mapped by the worker,
+   the content of files inside layer archives is read by the parent.
+   """
+   path: str
+   name: str
+   file: Optional[str] = None
+   data: Optional[bytes] = None
+   ranges: Optional[List[Tuple[int, int]]] = None
+
+def limit_ranges(ranges: List[Tuple[int, int]], max_size: int) -> List[Tuple[int, int]]:
+   limited = []
+   for start, end in ranges:
+      if max_size <= 0:
+         break
+      limited.append((start, min(end, start + max_size)))
+      max_size -= end - start
+   return limited
+
+def binary_task(fs, elves: ELFCache, path: str, max_size: int = MAX_SCAN_SIZE) -> BinaryTask:
+   """
+   Only the data sections of ELF files are scanned; the whole file for other
+   files and for binaries without section headers. At most `max_size` bytes are scanned.
+   """
+   ranges = None
+   try:
+      with elves.open(path) as elf:
+         ranges = elf.section_ranges(STRING_SECTIONS)
+   except (ELFError, OSError) as e:
+      logger.logger.debug(f"Could not parse ELF {path}: {e}")
+   if ranges is None:
+      ranges = [(0, fs.size(path))]
+   ranges = limit_ranges(ranges, max_size)
+   name = path.split("/")[-1].strip()
+   if isinstance(fs, DirectoryFS):
+      return BinaryTask(path, name, file=fs.join(path), ranges=ranges)
+   chunks = []
+   with fs.open(path, "rb") as fp:
+      for start, end in ranges:
+         fp.seek(start)
+         chunks.append(fp.read(end - start))
+   return BinaryTask(path, name, data=b"\x00".join(chunks))
+
+def scan_task(task: BinaryTask, time_budget: Optional[float] = SCAN_TIME_BUDGET) -> Tuple[List[PackageInfo], bool]:
+   """
+   Packages found in the binary, and whether it was scanned within the time budget.
+   """
+   scanner = default_scanner()
+   deadline = time.monotonic() + time_budget if time_budget else None
+   if task.data is not None:
+      packages = scanner.scan(task.data, binary_name=task.name, deadline=deadline)
+   else:
+      with open(task.file, "rb") as fp:
+         if os.fstat(fp.fileno()).st_size == 0:
+            return [], True
+         with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            packages = scanner.scan(data, task.ranges, task.name, deadline)
+   return packages, deadline is None or time.monotonic() <= deadline
+
+def binary_size(fs, path: str) -> int:
+   try:
+      return fs.size(path)
+   except OSError:
+      return 0
+
+def task_size(fs, path: str, max_size: int) -> int:
+   """
+   Bytes of a task sent to the workers: files on disk are read by the worker itself.
+   """
+   if isinstance(fs, DirectoryFS):
+      return 0
+   return min(binary_size(fs, path), max_size)
+
+_binary_pool: Optional[ProcessPoolExecutor] = None
+_binary_pool_workers = 0
+
+def get_binary_pool(workers: int) -> ProcessPoolExecutor:
+   """
+   Worker processes of the binary scans, started on first use and shared by the
+   scans of every layer and image of the process.
+   """
+   global _binary_pool, _binary_pool_workers
+   if _binary_pool is not None and (_binary_pool_workers != workers or getattr(_binary_pool, "_broken", False)):
+      close_binary_pool()
+   if _binary_pool is None:
+      _binary_pool = ProcessPoolExecutor(max_workers=workers)
+      _binary_pool_workers = workers
+   return _binary_pool
+
+def close_binary_pool() -> None:
+   global _binary_pool
+   pool, _binary_pool = _binary_pool, None
+   if pool is not None:
+      pool.shutdown(cancel_futures=True)
+
+atexit.register(close_binary_pool)
+
+def check_binaries(directory,executables,elves: Optional[ELFCache] = None,workers: int = BINARY_WORKERS,
+                   max_size: int = MAX_SCAN_SIZE,time_budget: Optional[float] = SCAN_TIME_BUDGET,
+                   pool: Optional[ProcessPoolExecutor] = None):
+   """
+   Scans executables for known signatures. Large sets of binaries are scanned
+   by a pool of worker processes, `pool` or the one of the process, largest first
+   so that a huge binary does not end the scan alone; layers already analyzed in
+   a worker process scan inline.
+   """
+   fs = as_layerfs(directory)
+   elves = elves if elves is not None else ELFCache(fs)
+   paths = sorted(executables, key=lambda path: binary_size(fs, path), reverse=True)
+   found: Dict[str, List[PackageInfo]] = {}
+
+   # Binaries already scanned, in this process or an earlier scan, are not scanned again
+   cache = get_file_cache()
+   context = f"{default_scanner().fingerprint}|{max_size}"
+   probes: Dict[str, Optional[FileProbe]] = {}
+   for path in paths:
+      probe = cache.probe(fs.join(path), "binary", f"{path.split('/')[-1].strip()}|{context}")
+      if probe is not None and probe.found:
+         found[path] = probe.result
+      else:
+         probes[path] = probe
+   paths = [path for path in paths if path not in found]
+
+   def collect(path: str, result: Tuple[List[PackageInfo], bool]):
+      packages, complete = result
+      found[path] = packages
+      # Results cut by the time budget are not reused
+      if complete:
+         cache.store(probes.get(path), packages)
+
+   def collect_future(path: str, future: Future):
+      try:
+         collect(path, future.result())
+      except Exception as e:
+         logger.logger.warning(f"Could not scan binary {path}: {e}")
+
+   if workers > 1 and len(paths) >= POOL_MIN_BINARIES and multiprocessing.parent_process() is None:
+      executor = pool if pool is not None else get_binary_pool(workers)
+      # Tasks are created as workers free up: the content read ahead from archives
+      # stays under MAX_PENDING_SIZE, whatever the number of workers
+      pending: Dict[Future, Tuple[str, int]] = {}
+      pending_size = 0
+      for path in paths:
+         size = task_size(fs, path, max_size)
+         while len(pending) and (len(pending) > workers or pending_size + size > MAX_PENDING_SIZE):
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+               done_path, done_size = pending.pop(future)
+               pending_size -= done_size
+               collect_future(done_path, future)
+         try:
+            pending[executor.submit(scan_task, binary_task(fs, elves, path, max_size), time_budget)] = (path, size)
+            pending_size += size
+         except OSError as e:
+            logger.logger.warning(f"Could not read binary {path}: {e}")
+      for future in as_completed(pending):
+         collect_future(pending[future][0], future)
+   else:
+      for path in paths:
+         try:
+            collect(path, scan_task(binary_task(fs, elves, path, max_size), time_budget))
+         except Exception as e:
+            logger.logger.warning(f"Could not scan binary {path}: {e}")
 
-def check_binaries(directory,executables):
    results = {}
    for exec_file in executables:
-        cpes = static_check_cpes(os.path.join(directory,exec_file))
+        cpes = found.get(exec_file, [])
         if len(cpes):
            for cpe in cpes:
               if cpe in results:
@@ -99,33 +253,16 @@ def check_binaries(directory,executables):
       logger.logger.info(f"Binaries {len(results)}")
    return results 
 
-def static_check_cpes(filepath):
+def static_check_cpes(filepath, scanner: Optional[SignatureScanner] = None):
    """
-   This function extracts strings from a file and
-   applies regex to fing known applications and versions
+   This function scans the bytes of a file in one pass for the
+   signatures of known applications and versions, and for its own name
+   followed by a version
    
    ---
    Returns: List of CPEs 
    """
-   strings = set(extract_strings(filepath,4))
-   cpes = []
-   gcc_ver = check_gcc(strings)
-   if gcc_ver is not None:
-      cpes.append(gcc_ver)
-   gcc_ver2 = check_gcc2(strings)
-   if gcc_ver2 is not None:
-      cpes.append(gcc_ver2)
-   ssl_ver = check_openssl(strings)
-   if ssl_ver is not None:
-      cpes.append(ssl_ver)
-   zlib_ver = check_zlib(strings)
-   if zlib_ver is not None:
-      cpes.append(zlib_ver)
-   pg = check_postgres(strings)
-   if pg is not None:
-      cpes.append(pg)
-   self_ver = check_self(strings,filepath.split("/")[-1].strip())
-   if self_ver is not None:
-      cpes.append(self_ver)
-   return cpes
- 
\ No newline at end of file
+   scanner = scanner if scanner is not None else default_scanner()
+   with open_file(filepath, 'rb') as file:
+      data = file.read()
+   return scanner.scan(data, binary_name=str(filepath).split("/")[-1].strip())
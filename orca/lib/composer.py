@@ -1,14 +1,16 @@
 
 import os
-from typing import List
+from typing import List, Optional
 import json
 
 from . import logger
+from .layerfs import as_layerfs
+from .path import PathTree
 from .types import PackageInfo, PackageInfoType
 
 
 def parse_composer_lock(paths,directory,filename):
-    composer_lock = json.load(open(directory +"/" + filename))
+    composer_lock = json.load(as_layerfs(directory).open(filename))
     packages = []
     accessed_paths = []
     files = [filename]
@@ -35,17 +37,17 @@ def parse_composer_lock(paths,directory,filename):
                     accessed_paths.extend(v[0])
                 else:
                     accessed_paths.extend(v)
+    tree = PathTree.of(paths)
     for path in accessed_paths:
         baseinfo = os.path.join(basepath,path)
-        for imagepath in paths:
-            if baseinfo in imagepath:
-                files.append(baseinfo)
+        if tree.has_under(baseinfo):
+            files.append(baseinfo)
 
     return {pkg: files for pkg in packages}
 
 def parse_composer(paths,directory,filename):
     try:
-        composer = json.load(open(directory +"/" + filename))
+        composer = json.load(as_layerfs(directory).open(filename))
     except Exception as e:
         logger.logger.error(f"[COMPOSER] Could not open file {filename} -- {e}")
         return {}
@@ -75,28 +77,30 @@ def parse_composer(paths,directory,filename):
                             accessed_paths.extend(v)
                         else:
                             accessed_paths.append(v)
+        tree = PathTree.of(paths)
         for path in accessed_paths:
             baseinfo = os.path.join(basepath,path)
-            for imagepath in paths:
-                if baseinfo in imagepath:
-                    files.append(baseinfo)
+            if tree.has_under(baseinfo):
+                files.append(baseinfo)
 
         return {pkg: files}
     return {}
 
 
-def get_composer(paths: List[str],directory: str): # Assuming only one composer per container
+def get_composer(paths: List[str],directory,candidates: Optional[List[str]] = None): # Assuming only one composer per container
+    fs = as_layerfs(directory)
+    candidates = paths if candidates is None else candidates
     packages = {}
     files = set()
-    composer_lock = sorted([path for path in paths if "composer.lock" in path ],key=len)
-    composer_json = sorted([path for path in paths if "composer.json" in path ],key=len)
+    composer_lock = sorted([path for path in candidates if "composer.lock" in path ],key=len)
+    composer_json = sorted([path for path in candidates if "composer.json" in path ],key=len)
     if len(composer_lock) == 0:
         return {}
     files.update(composer_json)
     files.update(composer_lock)
     raw_packages = []
     # Start by root composer.lock
-    root_composer_lock = json.load(open(directory +"/" + composer_lock[0]))
+    root_composer_lock = json.load(fs.open(composer_lock[0]))
     #root_composer_json = json.load(open(directory +"/" + composer_json[0]))
     for package in root_composer_lock["packages"]:
                 name = package["name"]
@@ -126,22 +130,17 @@ def get_composer(paths: List[str],directory: str): # Assuming only one composer
                     accessed_paths.extend(v[0])
                 else:
                     accessed_paths.extend(v)
-    for path in paths:
-        for accessed_path in accessed_paths:
-            if f"{basepath}/{accessed_path}" in path:
-                files.add(path)
-        if "vendor" in path:
-            upath = path.replace(f"{basepath}/vendor/","")
-            try:
-                upathsplit = upath.split("/")
-                final_package = f"{upathsplit[0]}/{upathsplit[1]}"
-                if final_package in raw_packages:
-                    files.add(path)
-                else:
-                    pass
-                    #print(path)
-            except Exception:
-                 pass # probably a folder
+    paths = PathTree.of(paths)
+    for accessed_path in accessed_paths:
+        files.update(paths.under(os.path.join(basepath,accessed_path)))
+    vendor = os.path.join(basepath,"vendor")
+    for path in paths.under(vendor):
+        upathsplit = path[len(vendor) + 1:].split("/")
+        if len(upathsplit) < 2:
+            continue # probably a folder
+        final_package = f"{upathsplit[0]}/{upathsplit[1]}"
+        if final_package in raw_packages:
+            files.add(path)
 
 
              
@@ -149,7 +148,7 @@ def get_composer(paths: List[str],directory: str): # Assuming only one composer
         packages[package] = files
 
     for composer in composer_json:
-        packages.update(parse_composer(paths,directory,composer))
+        packages.update(parse_composer(paths,fs,composer))
     if len(packages):
         logger.logger.info(f"PHP composer: {len(packages)}")
     return packages
\ No newline at end of file
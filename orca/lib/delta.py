@@ -0,0 +1,226 @@
+import hashlib
+import os
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+
+import debian.deb822
+
+from .apk import ApkFiles, iter_apk_db, read_world_file
+from .dpkg import DpkgFormatError, dpkg_info_index, dpkg_package_files, dpkg_packages, iter_dpkg_fields
+from .layerfs import OPAQUE_WHITEOUT, WHITEOUT_PREFIX, as_layerfs
+from .logger import logger
+from .rpm_packages import parent_directories, read_rpm_headers
+from .types import FileGroups, LayerAction, LayerChangeRecord, PackageInfo
+
+DPKG_STATUS = "var/lib/dpkg/status"
+
+PackageFiles = Dict[PackageInfo, List[str]]
+PackageChanges = Dict[PackageInfo, LayerChangeRecord]
+
+
+class ParagraphDigests:
+    """
+    Passes the lines of a database through to a streaming parser and fingerprints
+    them paragraph by paragraph. `last` is the fingerprint of the paragraph that
+    ended last: it is set when the parser reads the blank line (or the end of the
+    file) after it, so before the parser yields the entry of that paragraph.
+    """
+    def __init__(self, lines: Iterable[str]):
+        self.lines = lines
+        self.last = ""
+        self.hash = hashlib.sha1()
+        self.started = False
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.lines:
+            if line.strip():
+                self.hash.update(line.rstrip("\r\n").encode())
+                self.hash.update(b"\n")
+                self.started = True
+            else:
+                self.end()
+            yield line
+        self.end()
+
+    def end(self):
+        if self.started:
+            self.last = self.hash.hexdigest()
+            self.hash = hashlib.sha1()
+            self.started = False
+
+
+def deb822_fields(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    return (dict(paragraph) for paragraph in debian.deb822.Deb822.iter_paragraphs(lines))
+
+
+class PackageState:
+    """
+    Package manager state of the layers scanned so far, for incremental scans.
+
+    Layers are given in order. For every database (dpkg status, apk installed,
+    rpmdb) only the entries that differ from the lower layers are resolved to
+    packages and files, and package additions and removals are returned as
+    `LayerChangeRecord`. Files are fingerprinted by size and SHA256 (size and
+    mtime when the layer has no digests) so that the other analyzers only look
+    at what is new in a layer.
+    """
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, str]] = {}                   # database -> entry -> fingerprint
+        self.packages: Dict[str, Dict[str, List[PackageInfo]]] = {}    # database -> entry -> packages
+        self.files: Dict[str, Tuple[int, Union[bytes, float]]] = {}     # path -> size, sha256 (or mtime)
+
+    def new_paths(self, directory, paths: Set[str]) -> Set[str]:
+        """
+        Files that are not in the lower layers (or were modified) and the folders containing them.
+        """
+        fs = as_layerfs(directory)
+        self.remove_whiteouts(paths)
+        new_files = set()
+        for path in paths:
+            if not fs.isfile(path):
+                continue
+            # mtimes are often normalised (SOURCE_DATE_EPOCH): the content decides when it is known
+            digests = fs.digest(path)
+            stat = (fs.size(path), digests.sha256 if digests is not None else fs.mtime(path))
+            if self.files.get(path) != stat:
+                new_files.add(path)
+            self.files[path] = stat
+        folders = set()
+        for path in new_files:
+            parts = path.split("/")
+            folders.update("/".join(parts[:i]) for i in range(1, len(parts)))
+        return new_files | (folders & paths)
+
+    def remove_whiteouts(self, paths: Set[str]):
+        """
+        Forgets the files of the lower layers deleted by the `.wh.<name>` and
+        `.wh..wh..opq` markers in `paths`, so that they are new again if re-added.
+        """
+        deleted = set()
+        for path in paths:
+            dirname, basename = os.path.split(path)
+            if basename == OPAQUE_WHITEOUT:
+                deleted.add(dirname)
+            elif basename.startswith(WHITEOUT_PREFIX):
+                deleted.add(os.path.join(dirname, basename[len(WHITEOUT_PREFIX):]))
+        if not len(deleted):
+            return
+        for path in list(self.files):
+            parts = path.split("/")
+            if any("/".join(parts[:i]) in deleted for i in range(len(parts) + 1)):
+                del self.files[path]
+
+    def update(self, database: str, entries: Dict[str, Tuple[str, List[PackageInfo]]], layer: str) -> PackageChanges:
+        """
+        Diffs the entries of `database` against the lower layers. `entries` maps the
+        key of every entry to its fingerprint and the packages it describes.
+        """
+        previous = self.entries.get(database, {})
+        known = self.packages.setdefault(database, {})
+        changes: PackageChanges = {}
+        for key in previous:
+            if key not in entries:
+                for package in known.pop(key, []):
+                    changes[package] = LayerChangeRecord(LayerAction.DELETED, layer)
+        for key, (entry_fingerprint, packages) in entries.items():
+            if previous.get(key) == entry_fingerprint:
+                continue
+            old = known.get(key, [])
+            for package in old:
+                if package not in packages:
+                    changes[package] = LayerChangeRecord(LayerAction.DELETED, layer)
+            for package in packages:
+                if package not in old:
+                    changes[package] = LayerChangeRecord(LayerAction.REPLACED if len(old) else LayerAction.ADDED, layer)
+            known[key] = packages
+        self.entries[database] = {key: entry_fingerprint for key, (entry_fingerprint, _) in entries.items()}
+        return changes
+
+    def scanner(self, analyzer: str):
+        """
+        Incremental replacement of the OS package analyzer named `analyzer`, if any.
+        """
+        return {"dpkg": self.get_dpkg, "rpm": self.get_rpm, "apk": self.get_apk}.get(analyzer)
+
+    def get_dpkg(self, paths: Set[str], directory, layer: str) -> Tuple[PackageFiles, PackageChanges]:
+        fs = as_layerfs(directory)
+        if DPKG_STATUS not in paths:
+            return {}, {}
+        with fs.open(DPKG_STATUS) as status:
+            try:
+                entries = self.dpkg_entries(iter_dpkg_fields, status)
+            except DpkgFormatError as e:
+                logger.debug(f"Parsing dpkg status with deb822: {e}")
+                status.seek(0)
+                entries = self.dpkg_entries(deb822_fields, status)
+        changes = self.update(DPKG_STATUS, entries, layer)
+        added = [package for package, record in changes.items() if record.action != LayerAction.DELETED]
+        others = [path for path in paths if "var/lib/dpkg" in path]
+        package_files = {package: FileGroups(files, [others])
+                         for package, files in dpkg_package_files(paths, fs, added, dpkg_info_index(others)).items()}
+        if len(changes):
+            logger.info(f"DPKG changes: {len(changes)}")
+        return package_files, changes
+
+    def dpkg_entries(self, parser, status) -> Dict[str, Tuple[str, List[PackageInfo]]]:
+        """
+        Fingerprints the paragraphs of the status file as `parser` streams them;
+        only the paragraphs that changed are turned into packages.
+        """
+        known = self.entries.get(DPKG_STATUS, {})
+        lines = ParagraphDigests(status)
+        entries = {}
+        for fields in parser(lines):
+            key = f"{fields.get('Package', '')}:{fields.get('Architecture', '')}"
+            if known.get(key) == lines.last:
+                # Unchanged paragraphs are not parsed again
+                entries[key] = (lines.last, self.packages[DPKG_STATUS][key])
+            else:
+                entries[key] = (lines.last, dpkg_packages([fields]))
+        return entries
+
+    def get_apk(self, paths: Set[str], directory, layer: str) -> Tuple[PackageFiles, PackageChanges]:
+        fs = as_layerfs(directory)
+        package_files: PackageFiles = {}
+        changes: PackageChanges = {}
+        for path in paths:
+            if "apk/db/installed" in path:
+                entries = {}
+                files_by_package = {}
+                database = [path]
+                with fs.open(path) as db:
+                    lines = ParagraphDigests(db)
+                    for package in iter_apk_db(lines):
+                        info = package.info()
+                        entries[package.name] = (lines.last, [info])
+                        files_by_package[info] = ApkFiles(package.directories, [database])
+                layer_changes = self.update(path, entries, layer)
+            elif "apk/world" in path:
+                files_by_package = read_world_file(fs.join(path), path)
+                entries = {package.name: (package.name, [package]) for package in files_by_package}
+                layer_changes = self.update(path, entries, layer)
+            else:
+                continue
+            changes.update(layer_changes)
+            for package, record in layer_changes.items():
+                if record.action != LayerAction.DELETED:
+                    package_files[package] = files_by_package[package]
+        return package_files, changes
+
+    def get_rpm(self, paths: Set[str], directory, layer: str) -> Tuple[PackageFiles, PackageChanges]:
+        additional_files = [file for file in paths if "var/lib/yum" in file or "var/cache/yum/" in file or "etc/yum.repos.d/" in file or "var/log/yum" in file]
+        package_files: PackageFiles = {}
+        changes: PackageChanges = {}
+        for path in paths:
+            if not ("rpm/Packages" in path or path.endswith("rpmdb.sqlite")):
+                continue
+            # The rpmdb is a binary database: it is read whole, but only the file lists of new rows with files in the layer are decoded
+            rows = read_rpm_headers(directory, path, parent_directories(paths))
+            if not rows:
+                continue
+            entries = {f"{package.type}|{package.name}|{package.version}|{package.author}": ("", [package]) for package in rows}
+            layer_changes = self.update(path, entries, layer)
+            changes.update(layer_changes)
+            for package, record in layer_changes.items():
+                if record.action != LayerAction.DELETED:
+                    package_files[package] = FileGroups(rows[package](), [additional_files])
+        return package_files, changes
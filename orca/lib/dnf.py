@@ -1,8 +1,8 @@
 
-import os
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from . import logger
+from .layerfs import as_layerfs
 from .types import PackageInfo, PackageInfoType
 import sqlite3
 
@@ -18,9 +18,11 @@ def read_dnf_db(db_path,path) -> Dict[PackageInfo,List[str]]:
     return packagesMap
 
 
-def get_dnf(paths: List[str],directory: str)-> Dict[PackageInfo,List[str]]:
-    if "var/lib/dnf/history.sqlite" in paths:
-            packages = read_dnf_db(os.path.join(directory,"var/lib/dnf/history.sqlite"),"var/lib/dnf/history.sqlite")
+def get_dnf(paths: List[str],directory,candidates: Optional[List[str]] = None)-> Dict[PackageInfo,List[str]]:
+    candidates = paths if candidates is None else candidates
+    if "var/lib/dnf/history.sqlite" in candidates:
+            with as_layerfs(directory).materialize("var/lib/dnf/history.sqlite") as db_path:
+                packages = read_dnf_db(db_path,"var/lib/dnf/history.sqlite")
 
             if len(packages.keys()):
                 logger.logger.info(f"DNFs: {len(packages.keys())}")
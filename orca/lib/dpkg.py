@@ -1,29 +1,101 @@
 
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional
 import debian.deb822
 from .logger import logger
-import os
-from .types import PackageInfo, PackageInfoType
+from .layerfs import as_layerfs, open_file
+from .types import FileGroups, PackageInfo, PackageInfoType
+
+# Fields of a status paragraph used by the analyzer, the others are not looked at
+DPKG_FIELDS = frozenset(["Package", "Version", "Architecture", "Source"])
+DPKG_REQUIRED_FIELDS = ("Package", "Version", "Architecture")
+
+class DpkgFormatError(ValueError):
+    pass
 
 def parse_dpkg_status(file_path):
-    with open(file_path, "r", encoding="utf-8") as file:
-        status_file = debian.deb822.Deb822.iter_paragraphs(file)
-        packages = [dict(pkg) for pkg in status_file]
-        pp = []
-        for package in packages:
-            version = package["Version"]
-            epoch = None
-                
-            if len(version.split(":")) > 1:
-                epoch = version.split(":")[0] 
-                version = version.split(":")[1] 
-            pp.append(PackageInfo(package["Package"],version,None,PackageInfoType.DEBIAN,package["Architecture"],epoch))
-            if "python-" in package["Package"]:
-                pp.append(PackageInfo(package["Package"].replace("python-",""),version,None,PackageInfoType.PYPI,package["Architecture"],epoch))
-            elif "python3-" in package["Package"]:
-                pp.append(PackageInfo(package["Package"].replace("python3-",""),version,None,PackageInfoType.PYPI,package["Architecture"],epoch))
-            if "Source" in package:
-                pp.append(PackageInfo(package["Source"].split(" ")[0],version,None,PackageInfoType.DEBIAN,package["Architecture"],epoch))
+    with open_file(file_path, "r") as file:
+        return parse_dpkg_paragraphs(file)
+
+def parse_dpkg_paragraphs(content) -> List[PackageInfo]:
+    """
+    Parses the paragraphs of a dpkg status file, from a seekable file or a list of lines.
+    Input the streaming parser does not expect is parsed again with deb822.
+    """
+    try:
+        return dpkg_packages(iter_dpkg_fields(content))
+    except DpkgFormatError as e:
+        logger.debug(f"Parsing dpkg status with deb822: {e}")
+        if hasattr(content, "seek"):
+            content.seek(0)
+        return parse_deb822_paragraphs(content)
+
+def parse_deb822_paragraphs(content) -> List[PackageInfo]:
+    status_file = debian.deb822.Deb822.iter_paragraphs(content)
+    return dpkg_packages(dict(pkg) for pkg in status_file)
+
+def iter_dpkg_fields(lines) -> Iterator[Dict[str, str]]:
+    """
+    Streams the status paragraphs as dicts of the `DPKG_FIELDS` they contain. Raises
+    `DpkgFormatError` on anything else than plain single line fields: signed input,
+    lines without a field name, continued or missing required fields.
+    """
+    fields: Dict[str, str] = {}
+    started = False
+    wanted = False
+    for line in lines:
+        first = line[:1]
+        if first == " " or first == "\t":
+            if line.isspace():
+                pass
+            elif wanted:
+                raise DpkgFormatError(f"Multi-line field: {line.strip()}")
+            else:
+                continue
+        elif first == "#":
+            continue
+        elif first == "-":
+            raise DpkgFormatError(f"Unexpected line: {line.strip()}")
+        elif first != "" and first != "\n" and first != "\r":
+            colon = line.find(":")
+            if colon <= 0:
+                raise DpkgFormatError(f"Not a field: {line.strip()}")
+            started = True
+            key = line[:colon]
+            wanted = key in DPKG_FIELDS
+            if wanted:
+                fields[key] = line[colon + 1:].strip()
+            continue
+        # Empty or whitespace only line: end of the paragraph
+        if started:
+            yield check_dpkg_fields(fields)
+        fields = {}
+        started = False
+        wanted = False
+    if started:
+        yield check_dpkg_fields(fields)
+
+def check_dpkg_fields(fields: Dict[str, str]) -> Dict[str, str]:
+    for field in DPKG_REQUIRED_FIELDS:
+        if field not in fields:
+            raise DpkgFormatError(f"Paragraph without {field}: {fields}")
+    return fields
+
+def dpkg_packages(packages: Iterable[Dict[str, str]]) -> List[PackageInfo]:
+    pp = []
+    for package in packages:
+        version = package["Version"]
+        epoch = None
+            
+        if len(version.split(":")) > 1:
+            epoch = version.split(":")[0] 
+            version = version.split(":")[1] 
+        pp.append(PackageInfo(package["Package"],version,None,PackageInfoType.DEBIAN,package["Architecture"],epoch))
+        if "python-" in package["Package"]:
+            pp.append(PackageInfo(package["Package"].replace("python-",""),version,None,PackageInfoType.PYPI,package["Architecture"],epoch))
+        elif "python3-" in package["Package"]:
+            pp.append(PackageInfo(package["Package"].replace("python3-",""),version,None,PackageInfoType.PYPI,package["Architecture"],epoch))
+        if "Source" in package:
+            pp.append(PackageInfo(package["Source"].split(" ")[0],version,None,PackageInfoType.DEBIAN,package["Architecture"],epoch))
     return pp
 
 installed_bins = {"coreutils": 
@@ -39,46 +111,98 @@ installed_bins = {"coreutils":
 
 additional_files = [".preinst",".prerm",".postrm",".postinst",".list",".md5sums",".shlibs",".symbols",".triggers",".conffiles",".templates",".config"]
 
+DPKG_INFO = "var/lib/dpkg/info/"
+DPKG_INFO_SUFFIXES = frozenset(suffix[1:] for suffix in additional_files)
+
 
-def find_individual_packages(paths: List[str],directory: str)-> Dict[PackageInfo,List[str]]:
+def find_individual_packages(paths: List[str],directory)-> Dict[PackageInfo,List[str]]:
+    fs = as_layerfs(directory)
     packagesMap = {}
     for path in paths:
         if "var/lib/dpkg/status.d/" in path and "." not in path.split("/")[-1]:
-            packages = parse_dpkg_status(directory + "/" +path)
+            packages = parse_dpkg_status(fs.join(path))
             for package in packages:
                 packagesMap[package] = [path]
-        elif "var/lib/dpkg/status.d/" in path and os.path.isfile(path):
+        elif "var/lib/dpkg/status.d/" in path and fs.isfile(path):
            for package in packages:
                packagesMap[package].add(path)
     return packagesMap
 
-def parse_dpkg_from_status(paths,directory,status) -> Dict[PackageInfo,List[str]]:
+def dpkg_info_index(paths: Iterable[str]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Files of the dpkg info folder grouped by package name and multiarch qualifier,
+    "" for files without one: `libc6:amd64.md5sums` is in index["libc6"]["amd64"].
+    The `.list` file comes first in its group.
+    """
+    index: Dict[str, Dict[str, List[str]]] = {}
+    for path in paths:
+        if not path.startswith(DPKG_INFO):
+            continue
+        name, dot, suffix = path[len(DPKG_INFO):].rpartition(".")
+        if not dot or suffix not in DPKG_INFO_SUFFIXES or "/" in name:
+            continue
+        package, _, qualifier = name.partition(":")
+        group = index.setdefault(package, {}).setdefault(qualifier, [])
+        if suffix == "list":
+            group.insert(0, path)
+        else:
+            group.append(path)
+    return index
+
+def dpkg_info_files(index: Dict[str, Dict[str, List[str]]], package: PackageInfo) -> Optional[List[str]]:
+    groups = index.get(package.name, {})
+    for qualifier in ("", package.arch):
+        group = groups.get(qualifier)
+        if group is not None and group[0].endswith(".list"):
+            return group
+    # e.g. the source package of a multiarch binary package
+    listed = [group for group in groups.values() if group[0].endswith(".list")]
+    return listed[0] if len(listed) == 1 else None
+
+def read_dpkg_list(fs, path: str) -> List[str]:
+    try:
+        content = fs.open(path).readlines()
+    except OSError as e:
+        logger.debug(f"DPKG file list not readable: {path} {e}")
+        return []
+    return [ c.replace("\n","")[1:] if c[0] == "/" else c.replace("\n","") for c in content]
+
+def read_dpkg_md5sums(fs, path: str) -> Dict[str, str]:
+    """
+    Hex MD5 digests of the files of a package, from its `.md5sums` info file.
+    Conffiles are not listed there: dpkg keeps their digests in the status file.
+    """
+    digests = {}
+    try:
+        lines = fs.open(path).readlines()
+    except OSError as e:
+        logger.debug(f"DPKG md5sums not readable: {path} {e}")
+        return digests
+    for line in lines:
+        digest, _, file = line.rstrip("\n").partition("  ")
+        if len(digest) == 32 and file:
+            digests[file.lstrip("/")] = digest
+    return digests
+
+def parse_dpkg_from_status(paths,directory,status,index=None) -> Dict[PackageInfo,List[str]]:
+    fs = as_layerfs(directory)
+    os_pkgs = parse_dpkg_status(fs.join(status))
+    return dpkg_package_files(paths,fs,os_pkgs,index)
+
+def dpkg_package_files(paths,directory,os_pkgs: List[PackageInfo],index=None) -> Dict[PackageInfo,List[str]]:
+    fs = as_layerfs(directory)
+    index = dpkg_info_index(paths) if index is None else index
+    # File lists shared by several packages, e.g. a binary package and its source, are read once
+    lists: Dict[str, List[str]] = {}
     package_dict = dict()
-    os_pkgs = parse_dpkg_status(directory + "/" + status)
     for package in os_pkgs:
         files_checked = []
-        target_file = "var/lib/dpkg/info/" + package.name + ".list"
-        if target_file in paths:
-            content = open(directory + "/" + target_file).readlines()
-            content = [ c.replace("\n","")[1:] if c[0] == "/" else c.replace("\n","") for c in content]
-            files_checked.extend(content)
-            for f in additional_files:
-                fname = "var/lib/dpkg/info/" + package.name + f
-                if fname in paths:
-                    files_checked.append(fname)
-        else:
-            target_file = "var/lib/dpkg/info/" + package.name + ":amd64.list"
-            try:
-                content = open(directory + "/" + target_file).readlines()
-                content = [ c.replace("\n","")[1:] if c[0] == "/" else c.replace("\n","") for c in content]
-                files_checked.extend(content)
-                for f in additional_files:
-                    fname = "var/lib/dpkg/info/" + package.name + ":amd64" + f
-                    if fname in paths:
-                        files_checked.append(fname)
-            except Exception:
-                #logger.debug(f"DPKG indexed file not found: {target_file}")
-                pass
+        info = dpkg_info_files(index,package)
+        if info is not None:
+            if info[0] not in lists:
+                lists[info[0]] = read_dpkg_list(fs,info[0])
+            files_checked.extend(lists[info[0]])
+            files_checked.extend(info[1:])
         # Check binaries
         if package.name in installed_bins:
             for f in installed_bins[package.name]:
@@ -91,29 +215,22 @@ def parse_dpkg_from_status(paths,directory,status) -> Dict[PackageInfo,List[str]
             package_dict[package] = files_checked
     return package_dict
 
-def get_dpkg(paths: List[str],directory: str)-> Dict[PackageInfo,List[str]]:
-    status = [path for path in paths if path.endswith("dpkg/status")]
-    others = [path for path in paths if "var/lib/dpkg" in path]
+def get_dpkg(paths: List[str],directory,candidates: Optional[List[str]] = None)-> Dict[PackageInfo,List[str]]:
+    candidates = paths if candidates is None else candidates
+    status = [path for path in candidates if path.endswith("dpkg/status")]
+    others = [path for path in candidates if "var/lib/dpkg" in path]
    
     assert len(status) < 2
     packages = {}
    
     if len(status) == 1:
-        packages.update(parse_dpkg_from_status(paths, directory, status[0]))
+        packages.update(parse_dpkg_from_status(paths, directory, status[0], dpkg_info_index(others)))
         if len(packages.keys()):
             logger.info(f"DPKGS: {len(packages.keys())}")
-            for package in packages.keys():
-                packages[package].extend(others)
  
-    packages.update(find_individual_packages(paths,directory))
+    packages.update(find_individual_packages(candidates,directory))
     if len(packages.keys()):
         logger.info(f"DPKGS: {len(packages.keys())}")
-        for package in packages.keys():
-            packages[package].extend(others)
-
-    return packages
-
-       
-
 
-    
\ No newline at end of file
+    # Every package references the same list of database files
+    return {package: FileGroups(files,[others]) for package,files in packages.items()}
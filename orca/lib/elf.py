@@ -0,0 +1,383 @@
+import mmap
+import os
+import re
+import struct
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import cached_property
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from .layerfs import DirectoryFS, as_layerfs
+
+ELF_MAGIC = b"\x7fELF"
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+PF_X = 1
+PF_W = 2
+SHT_NOBITS = 8
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SONAME = 14
+DT_VERNEED = 0x6ffffffe
+DT_VERNEEDNUM = 0x6fffffff
+NT_GNU_BUILD_ID = 3
+MAX_HEADERS_SIZE = 4 * 1024 * 1024
+GO_SECTIONS = (".go.buildinfo", ".note.go.buildid")
+# Build info header of Go binaries, aligned at the start of its section or of the first writable segment
+GO_BUILDINFO_MAGIC = b"\xff Go buildinf:"
+GO_BUILDINFO_ALIGN = 16
+# Bytes searched for the header; the strings that follow it are read up to their length
+GO_BUILDINFO_SEARCH_SIZE = 64 * 1024
+# Sections where compilers place string literals and the toolchain identification
+STRING_SECTIONS = (".rodata", ".data", ".comment", ".gnu.build.attributes")
+
+
+class ELFError(Exception):
+    pass
+
+
+@dataclass
+class Section:
+    name: str
+    type: int
+    flags: int
+    addr: int
+    offset: int
+    size: int
+
+
+@dataclass
+class Segment:
+    type: int
+    flags: int
+    offset: int
+    vaddr: int
+    filesz: int
+
+
+def printable_strings(data: bytes, min_length: int = 4) -> List[str]:
+    """
+    Sequences of at least `min_length` printable ASCII characters, like `strings`.
+    """
+    pattern = re.compile(b'[\x20-\x7E]{' + str(min_length).encode() + b',}')
+    return [s.decode("ascii") for s in pattern.findall(data)]
+
+
+def find_aligned(data: bytes, magic: bytes, align: int) -> int:
+    pos = data.find(magic)
+    while pos >= 0 and pos % align != 0:
+        pos = data.find(magic, pos + 1)
+    return pos
+
+def _cstring(data: bytes, offset: int) -> str:
+    end = data.find(b"\x00", offset)
+    return data[offset:end if end >= 0 else len(data)].decode("utf-8", errors="replace")
+
+
+class ELFFile:
+    """
+    ELF headers of a binary, parsed on first use. Only the ranges that are
+    asked for are read: files on disk are memory mapped, files inside a layer
+    archive are read with seeks on their file object.
+
+    Parsed metadata is kept after the file is closed, so an `ELFCache` can hand
+    the same object to every analyzer of a scan and each one only reads what
+    was not parsed yet.
+    """
+    def __init__(self, fp: BinaryIO, use_mmap: bool = False):
+        self.attach(fp, use_mmap)
+        head = self.read(0, 64)
+        if len(head) < 52 or not head.startswith(ELF_MAGIC) or head[4] not in (1, 2) or head[5] not in (1, 2):
+            self.close()
+            raise ELFError("Not an ELF file")
+        self.is64 = head[4] == 2
+        self.endian = "<" if head[5] == 1 else ">"
+        if self.is64:
+            self.phoff, self.shoff = struct.unpack_from(self.endian + "QQ", head, 32)
+            self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx = struct.unpack_from(self.endian + "HHHHH", head, 54)
+        else:
+            self.phoff, self.shoff = struct.unpack_from(self.endian + "II", head, 28)
+            self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx = struct.unpack_from(self.endian + "HHHHH", head, 42)
+
+    def attach(self, fp: BinaryIO, use_mmap: bool = False):
+        self.fp: Optional[BinaryIO] = fp
+        self.data: Optional[mmap.mmap] = None
+        if use_mmap:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, offset: int, size: int) -> bytes:
+        if self.data is not None:
+            return self.data[offset:offset + size]
+        if self.fp is None:
+            raise ELFError("ELF file is closed")
+        self.fp.seek(offset)
+        return self.fp.read(size)
+
+    @property
+    def pointer_size(self) -> int:
+        return 8 if self.is64 else 4
+
+    @cached_property
+    def segments(self) -> List[Segment]:
+        segments = []
+        if self.phoff and 0 < self.phentsize * self.phnum <= MAX_HEADERS_SIZE:
+            table = self.read(self.phoff, self.phentsize * self.phnum)
+            for idx in range(len(table) // self.phentsize):
+                if self.is64:
+                    p_type, p_flags, p_offset, p_vaddr, _, p_filesz = struct.unpack_from(self.endian + "IIQQQQ", table, idx * self.phentsize)
+                else:
+                    p_type, p_offset, p_vaddr, _, p_filesz, _, p_flags = struct.unpack_from(self.endian + "IIIIIII", table, idx * self.phentsize)
+                segments.append(Segment(p_type, p_flags, p_offset, p_vaddr, p_filesz))
+        return segments
+
+    @cached_property
+    def sections(self) -> Dict[str, Section]:
+        sections = {}
+        if self.shoff and 0 < self.shentsize * self.shnum <= MAX_HEADERS_SIZE and self.shstrndx < self.shnum:
+            table = self.read(self.shoff, self.shentsize * self.shnum)
+            fmt = self.endian + ("IIQQQQ" if self.is64 else "IIIIII")
+            headers = [struct.unpack_from(fmt, table, idx * self.shentsize) for idx in range(len(table) // self.shentsize)]
+            if self.shstrndx < len(headers):
+                names = self.read(headers[self.shstrndx][4], min(headers[self.shstrndx][5], MAX_HEADERS_SIZE))
+                for name_offset, sh_type, sh_flags, sh_addr, sh_offset, sh_size in headers:
+                    name = _cstring(names, name_offset)
+                    if name and name not in sections:
+                        sections[name] = Section(name, sh_type, sh_flags, sh_addr, sh_offset, sh_size)
+        return sections
+
+    def section_data(self, name: str, max_size: Optional[int] = None) -> Optional[bytes]:
+        section = self.sections.get(name)
+        if section is None or section.type == SHT_NOBITS:
+            return None
+        return self.read(section.offset, section.size if max_size is None else min(section.size, max_size))
+
+    def read_vaddr(self, addr: int, size: int) -> Optional[bytes]:
+        """
+        Reads `size` bytes at the virtual address `addr` of a loaded segment.
+        """
+        for segment in self.segments:
+            if segment.type == PT_LOAD and segment.vaddr <= addr < segment.vaddr + segment.filesz:
+                size = min(size, segment.vaddr + segment.filesz - addr)
+                return self.read(segment.offset + addr - segment.vaddr, size)
+        return None
+
+    @cached_property
+    def is_dynamic(self) -> bool:
+        return any(segment.type in (PT_DYNAMIC, PT_INTERP) for segment in self.segments)
+
+    @cached_property
+    def data_segment(self) -> Optional[Segment]:
+        """
+        First writable, not executable, loadable segment.
+        """
+        return next((s for s in self.segments if s.type == PT_LOAD and s.flags & (PF_X | PF_W) == PF_W), None)
+
+    @cached_property
+    def is_go(self) -> bool:
+        if len(self.sections):
+            return any(name in self.sections for name in GO_SECTIONS)
+        # Without section headers, the build info header is searched in the first writable segment
+        segment = self.data_segment
+        if segment is None:
+            return False
+        data = self.read(segment.offset, min(segment.filesz, GO_BUILDINFO_SEARCH_SIZE))
+        return find_aligned(data, GO_BUILDINFO_MAGIC, GO_BUILDINFO_ALIGN) >= 0
+
+    @cached_property
+    def comment(self) -> List[str]:
+        """
+        Compiler and toolchain identification strings of the `.comment` section.
+        """
+        data = self.section_data(".comment", MAX_HEADERS_SIZE) or b""
+        return [item.decode("utf-8", errors="replace") for item in data.split(b"\x00") if item]
+
+    @cached_property
+    def dynamic(self) -> Dict[int, List[int]]:
+        """
+        Entries of the dynamic segment by tag. The segment is used rather than the
+        `.dynamic` section so that binaries without section headers are handled too.
+        """
+        entries: Dict[int, List[int]] = {}
+        segment = next((s for s in self.segments if s.type == PT_DYNAMIC), None)
+        if segment is None or segment.filesz > MAX_HEADERS_SIZE:
+            return entries
+        data = self.read(segment.offset, segment.filesz)
+        fmt = self.endian + ("qQ" if self.is64 else "iI")
+        for tag, value in struct.iter_unpack(fmt, data[:len(data) // struct.calcsize(fmt) * struct.calcsize(fmt)]):
+            if tag == DT_NULL:
+                break
+            entries.setdefault(tag, []).append(value)
+        return entries
+
+    def dynamic_string(self, offset: int) -> str:
+        """
+        String at `offset` of the dynamic string table, which is read piecewise
+        since it holds every exported symbol name and can be large.
+        """
+        strtab = self.dynamic.get(DT_STRTAB)
+        section = self.sections.get(".dynstr")
+        value = b""
+        for _ in range(16):
+            if strtab is not None:
+                chunk = self.read_vaddr(strtab[0] + offset + len(value), 256)
+            elif section is not None and offset + len(value) < section.size:
+                chunk = self.read(section.offset + offset + len(value), min(256, section.size - offset - len(value)))
+            else:
+                chunk = None
+            if not chunk:
+                break
+            end = chunk.find(b"\x00")
+            if end >= 0:
+                value += chunk[:end]
+                break
+            value += chunk
+        return value.decode("utf-8", errors="replace")
+
+    @cached_property
+    def needed(self) -> List[str]:
+        return [self.dynamic_string(offset) for offset in self.dynamic.get(DT_NEEDED, [])]
+
+    @cached_property
+    def soname(self) -> Optional[str]:
+        offsets = self.dynamic.get(DT_SONAME)
+        return self.dynamic_string(offsets[0]) if offsets else None
+
+    @cached_property
+    def version_needs(self) -> Dict[str, List[str]]:
+        """
+        Symbol versions required from every shared library, e.g. `{"libc.so.6": ["GLIBC_2.34"]}`.
+        """
+        needs: Dict[str, List[str]] = {}
+        verneed, count = self.dynamic.get(DT_VERNEED), self.dynamic.get(DT_VERNEEDNUM)
+        if verneed is None or count is None:
+            return needs
+        addr = verneed[0]
+        for _ in range(min(count[0], 1024)):
+            entry = self.read_vaddr(addr, 16)
+            if entry is None or len(entry) < 16:
+                break
+            _, aux_count, file_offset, aux, following = struct.unpack(self.endian + "HHIII", entry)
+            versions = needs.setdefault(self.dynamic_string(file_offset), [])
+            aux_addr = addr + aux
+            for _ in range(min(aux_count, 1024)):
+                entry = self.read_vaddr(aux_addr, 16)
+                if entry is None or len(entry) < 16:
+                    break
+                _, _, _, name_offset, aux_following = struct.unpack(self.endian + "IHHII", entry)
+                versions.append(self.dynamic_string(name_offset))
+                if aux_following == 0:
+                    break
+                aux_addr += aux_following
+            if following == 0:
+                break
+            addr += following
+        return needs
+
+    @cached_property
+    def build_id(self) -> Optional[str]:
+        """
+        GNU build-id note as a hex string.
+        """
+        section = self.sections.get(".note.gnu.build-id")
+        if section is not None:
+            notes = [(section.offset, section.size)]
+        else:
+            notes = [(s.offset, s.filesz) for s in self.segments if s.type == PT_NOTE]
+        for offset, size in notes:
+            data = self.read(offset, min(size, MAX_HEADERS_SIZE))
+            pos = 0
+            while pos + 12 <= len(data):
+                namesz, descsz, note_type = struct.unpack_from(self.endian + "III", data, pos)
+                name_start = pos + 12
+                desc_start = name_start + (namesz + 3) // 4 * 4
+                if note_type == NT_GNU_BUILD_ID and data[name_start:name_start + namesz] == b"GNU\x00":
+                    return data[desc_start:desc_start + descsz].hex()
+                pos = desc_start + (descsz + 3) // 4 * 4
+        return None
+
+    def section_ranges(self, names: Iterable[str]) -> Optional[List[Tuple[int, int]]]:
+        """
+        `(start, end)` file offsets of the given sections that have content, or
+        None when the binary has no section headers and they cannot be located.
+        """
+        if not self.sections:
+            return None
+        ranges = []
+        for name in names:
+            section = self.sections.get(name)
+            if section is not None and section.type != SHT_NOBITS:
+                ranges.append((section.offset, section.offset + section.size))
+        return ranges
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.fp = None
+
+
+def _open_layer_file(fs, path: str):
+    on_disk = isinstance(fs, DirectoryFS)
+    fp = open(fs.join(path), "rb") if on_disk else fs.open(path, "rb")
+    return fp, on_disk and os.fstat(fp.fileno()).st_size > 0
+
+
+@contextmanager
+def open_elf(directory, path: str):
+    """
+    Opens `path` of a layer as an `ELFFile`, raising `ELFError` if it is not an ELF binary.
+    """
+    fp, use_mmap = _open_layer_file(as_layerfs(directory), path)
+    with fp:
+        elf = ELFFile(fp, use_mmap=use_mmap)
+        try:
+            yield elf
+        finally:
+            elf.close()
+
+
+class ELFCache:
+    """
+    ELF models of the files of a layer, parsed once and shared by the analyzers of a scan.
+    """
+    def __init__(self, directory):
+        self.fs = as_layerfs(directory)
+        self.files: Dict[str, Optional[ELFFile]] = {}
+
+    def get(self, path: str) -> Optional[ELFFile]:
+        return self.files.get(path)
+
+    @contextmanager
+    def open(self, path: str, fp: Optional[BinaryIO] = None):
+        """
+        Yields the cached `ELFFile` of `path` attached to an open file, so that
+        metadata not parsed yet can be read. `fp` is an already open file object
+        of `path`, which is left open. Raises `ELFError` if it is not an ELF binary.
+        """
+        if path in self.files and self.files[path] is None:
+            raise ELFError(f"Not an ELF file: {path}")
+        owned = fp is None
+        use_mmap = False
+        if owned:
+            fp, use_mmap = _open_layer_file(self.fs, path)
+        try:
+            elf = self.files.get(path)
+            if elf is None:
+                try:
+                    elf = ELFFile(fp, use_mmap=use_mmap)
+                except ELFError:
+                    self.files[path] = None
+                    raise
+                self.files[path] = elf
+            else:
+                elf.attach(fp, use_mmap)
+            try:
+                yield elf
+            finally:
+                elf.close()
+        finally:
+            if owned:
+                fp.close()
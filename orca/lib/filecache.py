@@ -0,0 +1,282 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from orca import __version__
+from .layerfs import known_digests, open_file
+from .logger import logger
+
+DEFAULT_FILE_CACHE_SIZE = 512 * 1024 * 1024  # 512MB
+# Bump when a cached analyzer changes the results it returns
+FILE_ANALYZER_VERSION = 1
+# Head and tail hashed for the prefilter; smaller files are hashed whole by it
+QUICK_HASH_SIZE = 64 * 1024
+MEMORY_ENTRIES = 4096
+# Rows stored between two checks of the cache size
+EVICT_INTERVAL = 256
+ROW_OVERHEAD = 256
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    analyzer TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    quick TEXT NOT NULL,
+    result BLOB NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (analyzer, digest)
+);
+CREATE INDEX IF NOT EXISTS prefilter ON results (analyzer, size, quick);
+CREATE INDEX IF NOT EXISTS lru ON results (accessed);
+"""
+
+
+@dataclass
+class FileProbe:
+    source: Any
+    key: str
+    size: int = 0
+    quick: str = ""
+    digest: Optional[str] = None
+    found: bool = False
+    result: Any = None
+
+
+def quick_hash(fp, size: int) -> str:
+    """
+    Hash of the size, the head and the tail of a file. It is the content hash
+    of files of up to twice `QUICK_HASH_SIZE` bytes.
+    """
+    digest = hashlib.sha256(str(size).encode())
+    digest.update(fp.read(QUICK_HASH_SIZE))
+    if size > 2 * QUICK_HASH_SIZE:
+        fp.seek(size - QUICK_HASH_SIZE)
+    digest.update(fp.read(QUICK_HASH_SIZE))
+    return digest.hexdigest()
+
+
+def content_hash(fp) -> str:
+    fp.seek(0)
+    return hashlib.file_digest(fp, "sha256").hexdigest()
+
+
+class FileCache:
+    """
+    Results of the expensive per-file analyzers (binary signatures, Go build
+    info, jar properties, lockfiles), keyed by file content and analyzer version.
+
+    Identical files met again in the same process, e.g. copied into several
+    layers, are served from memory. With a `path`, results are also stored in
+    a SQLite database shared by scans and worker processes, bounded to `max_size`
+    bytes by evicting the least recently used rows.
+
+    Lookups hash the size, head and tail of a file first: the whole content is
+    only hashed when that prefilter matches an entry, or to store a new one.
+    """
+    def __init__(self, path: Optional[str] = None, max_size: int = DEFAULT_FILE_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.memory: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self.quick: "OrderedDict[Tuple[str, int, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._stored = 0
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __getstate__(self):
+        # Worker processes start with their own connection and an empty memory
+        return {"path": self.path, "max_size": self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["max_size"])
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if self.path is None:
+            return None
+        if self._connection is None or self._pid != os.getpid():
+            try:
+                self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.executescript(SCHEMA)
+                self._pid = os.getpid()
+            except sqlite3.Error as e:
+                logger.warning(f"File cache {self.path} disabled: {e}")
+                self.path = None
+                self._connection = None
+        return self._connection
+
+    def key(self, analyzer: str, context: str = "") -> str:
+        return f"{analyzer}|{context}|orca={__version__}|files={FILE_ANALYZER_VERSION}"
+
+    def probe(self, source, analyzer: str, context: str = "") -> Optional[FileProbe]:
+        """
+        Looks up the result of `analyzer` for the content of `source`, a path or a
+        `LayerPath`. `context` holds whatever else the result depends on. Returns
+        None if the file cannot be read.
+        """
+        probe = FileProbe(source, self.key(analyzer, context))
+        known = known_digests(source)
+        if known is not None and known.size > 2 * QUICK_HASH_SIZE:
+            # The content hash of the file is in the layer index: it is not read again
+            probe.size = known.size
+            probe.digest = known.sha256.hex()
+        else:
+            try:
+                with open_file(source, "rb") as fp:
+                    probe.size = fp.seek(0, os.SEEK_END)
+                    fp.seek(0)
+                    probe.quick = quick_hash(fp, probe.size)
+                    if probe.size <= 2 * QUICK_HASH_SIZE:
+                        probe.digest = probe.quick
+                    elif self._seen(probe.key, probe.size, probe.quick):
+                        probe.digest = content_hash(fp)
+            except OSError as e:
+                logger.debug(f"Could not hash {source}: {e}")
+                return None
+        if probe.digest is not None:
+            probe.found, probe.result = self._lookup(probe.key, probe.digest)
+        if probe.found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return probe
+
+    def store(self, probe: Optional[FileProbe], result: Any) -> None:
+        if probe is None:
+            return
+        if probe.digest is None or probe.quick == "":
+            try:
+                with open_file(probe.source, "rb") as fp:
+                    if probe.quick == "":
+                        # Prefilter of the sources without known digests
+                        probe.quick = quick_hash(fp, probe.size)
+                    if probe.digest is None:
+                        probe.digest = content_hash(fp)
+            except OSError as e:
+                logger.debug(f"Could not hash {probe.source}: {e}")
+                return
+        self._store(probe.key, probe.digest, probe.size, probe.quick, result)
+
+    def get_or_compute(self, source, analyzer: str, compute: Callable[[], T], context: str = "") -> T:
+        probe = self.probe(source, analyzer, context)
+        if probe is not None and probe.found:
+            return probe.result
+        result = compute()
+        self.store(probe, result)
+        return result
+
+    def _seen(self, key: str, size: int, quick: str) -> bool:
+        if (key, size, quick) in self.quick:
+            return True
+        db = self._db()
+        if db is None:
+            return False
+        with self._lock:
+            row = db.execute("SELECT 1 FROM results WHERE analyzer = ? AND size = ? AND quick = ? LIMIT 1", (key, size, quick)).fetchone()
+        return row is not None
+
+    def _lookup(self, key: str, digest: str) -> Tuple[bool, Any]:
+        with self._lock:
+            if (key, digest) in self.memory:
+                self.memory.move_to_end((key, digest))
+                return True, self.memory[(key, digest)]
+        db = self._db()
+        if db is None:
+            return False, None
+        with self._lock:
+            row = db.execute("SELECT result FROM results WHERE analyzer = ? AND digest = ?", (key, digest)).fetchone()
+            if row is None:
+                return False, None
+            db.execute("UPDATE results SET accessed = ? WHERE analyzer = ? AND digest = ?", (time.time(), key, digest))
+        try:
+            result = pickle.loads(row[0])
+        except Exception as e:
+            logger.warning(f"Discarding corrupted file cache entry {digest}: {e}")
+            return False, None
+        self._remember(key, digest, result)
+        return True, result
+
+    def _remember(self, key: str, digest: str, result: Any) -> None:
+        with self._lock:
+            self.memory[(key, digest)] = result
+            while len(self.memory) > MEMORY_ENTRIES:
+                self.memory.popitem(last=False)
+
+    def _store(self, key: str, digest: str, size: int, quick: str, result: Any) -> None:
+        self._remember(key, digest, result)
+        with self._lock:
+            self.quick[(key, size, quick)] = digest
+            while len(self.quick) > MEMORY_ENTRIES:
+                self.quick.popitem(last=False)
+        db = self._db()
+        if db is None:
+            return
+        try:
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", (key, digest, size, quick, blob, time.time()))
+                self._stored += 1
+                evict = self._stored % EVICT_INTERVAL == 0
+        except (sqlite3.Error, pickle.PicklingError) as e:
+            logger.warning(f"Could not store file result in cache: {e}")
+            return
+        if evict:
+            self.evict()
+
+    def evict(self) -> None:
+        db = self._db()
+        if db is None:
+            return
+        with self._lock:
+            total = db.execute(f"SELECT COALESCE(SUM(LENGTH(result) + {ROW_OVERHEAD}), 0) FROM results").fetchone()[0]
+            if total <= self.max_size:
+                return
+            removed = 0
+            rows = db.execute(f"SELECT analyzer, digest, LENGTH(result) + {ROW_OVERHEAD} FROM results ORDER BY accessed").fetchall()
+            stale = []
+            for analyzer, digest, size in rows:
+                if total - removed <= self.max_size:
+                    break
+                stale.append((analyzer, digest))
+                removed += size
+            db.executemany("DELETE FROM results WHERE analyzer = ? AND digest = ?", stale)
+
+    def close(self) -> None:
+        if self._connection is not None and self._pid == os.getpid():
+            self.evict()
+            self._connection.close()
+        self._connection = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_file_cache: Optional[FileCache] = None
+
+
+def get_file_cache() -> FileCache:
+    """
+    The file cache of the process; without a configured one, results are only
+    shared in memory by the scans of the process.
+    """
+    global _file_cache
+    if _file_cache is None:
+        _file_cache = FileCache()
+    return _file_cache
+
+
+def set_file_cache(cache: Optional[FileCache]) -> None:
+    global _file_cache
+    _file_cache = cache
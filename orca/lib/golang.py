@@ -1,33 +1,140 @@
 import re
-import subprocess
-import os
-from typing import Dict, List
+import struct
+from typing import Dict, List, Optional, Tuple
+from .elf import GO_BUILDINFO_ALIGN, GO_BUILDINFO_MAGIC, GO_BUILDINFO_SEARCH_SIZE, SHT_NOBITS, ELFCache, ELFFile, find_aligned
+from .filecache import get_file_cache
 from .types import PackageInfo, PackageInfoType
 from .logger import logger
-def extract_go_dependencies(go_binary_path,directory: str):
+from .layerfs import as_layerfs
+
+BUILDINFO_HEADER_SIZE = 32
+
+
+def extract_go_dependencies(go_binary_path,directory,elves: Optional[ELFCache] = None):
+    fs = as_layerfs(directory)
+    elves = elves if elves is not None else ELFCache(fs)
     results = {}
+    cache = get_file_cache()
     for path in go_binary_path:
-        result = extract_dependency(os.path.join(directory,path))
+        result = cache.get_or_compute(fs.join(path),"go",lambda: extract_dependency(path,fs,elves))
         for res in result:
             results[res] = [path]
     if len(results):
              logger.info(f"GO executables {len(results)}")
     return results
-          
-def extract_dependency(go_binary_path):
+
+
+def read_uvarint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while pos < len(data):
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+    raise ValueError("Truncated varint")
+
+
+def find_buildinfo(elf: ELFFile) -> Optional[Tuple[int, int, bytes]]:
+    """
+    Finds the build info header: at the start of the `.go.buildinfo` section,
+    or searched at the beginning of the first writable segment like the Go linker
+    and `debug/buildinfo` do for binaries without section headers.
+
+    Returns the file offset of the header, the end offset of the section or
+    segment holding it, and the bytes read from the header on.
+    """
+    section = elf.sections.get(".go.buildinfo")
+    if section is not None and section.type != SHT_NOBITS:
+        start, end = section.offset, section.offset + section.size
+    else:
+        segment = elf.data_segment
+        if segment is None:
+            return None
+        start, end = segment.offset, segment.offset + segment.filesz
+    data = elf.read(start, min(end - start, GO_BUILDINFO_SEARCH_SIZE))
+    pos = find_aligned(data, GO_BUILDINFO_MAGIC, GO_BUILDINFO_ALIGN)
+    if pos < 0 or len(data) < pos + BUILDINFO_HEADER_SIZE:
+        return None
+    return start + pos, end, data[pos:]
+
+
+def read_buildinfo(elf: ELFFile) -> Optional[Tuple[str, str]]:
+    """
+    Decodes the Go version and the module information that the Go linker embeds
+    in every binary, like `go version -m` does.
+    """
+    found = find_buildinfo(elf)
+    if found is None:
+        return None
+    offset, end, data = found
+    pointer_size = data[14]
+    flags = data[15]
+    if flags & 2:
+        # Go 1.18+: both strings follow the header, prefixed by their length
+        def read_inline(pos: int) -> Tuple[bytes, int]:
+            nonlocal data
+            length, pos = read_uvarint(data, pos)
+            if pos + length > len(data):
+                # Longer than the searched bytes, e.g. a large module list
+                data = elf.read(offset, min(end - offset, pos + length))
+            value = data[pos:pos + length]
+            if len(value) < length:
+                logger.warning(f"[GO] Build info truncated: {length} bytes expected at offset {offset + pos}, {len(value)} available")
+            return value, pos + length
+
+        version, pos = read_inline(BUILDINFO_HEADER_SIZE)
+        modinfo, _ = read_inline(pos)
+    else:
+        # Older binaries: the header points to Go string headers (data pointer, length)
+        if pointer_size not in (4, 8):
+            return None
+        pointer = (">" if flags & 1 else "<") + ("Q" if pointer_size == 8 else "I")
+
+        def read_string(addr: int) -> bytes:
+            header = elf.read_vaddr(addr, 2 * pointer_size)
+            if header is None or len(header) < 2 * pointer_size:
+                return b""
+            data_addr, length = struct.unpack_from(pointer, header, 0)[0], struct.unpack_from(pointer, header, pointer_size)[0]
+            return elf.read_vaddr(data_addr, length) or b""
+
+        version = read_string(struct.unpack_from(pointer, data, 16)[0])
+        modinfo = read_string(struct.unpack_from(pointer, data, 16 + pointer_size)[0])
+    if len(version) == 0:
+        return None
+    # The module information is wrapped in 16 bytes sentinels
+    if len(modinfo) >= 33 and modinfo[-17] == ord("\n"):
+        modinfo = modinfo[16:-16]
+    else:
+        modinfo = b""
+    return version.decode("utf-8", errors="replace"), modinfo.decode("utf-8", errors="replace")
+
+
+def version_lines(go_binary_path: str, version: str, modinfo: str) -> List[str]:
+    """
+    Formats the build info as the output of `go version -m`.
+    """
+    lines = [f"{go_binary_path}: {version}"]
+    if len(modinfo):
+        lines.extend("\t" + line for line in modinfo[:-1].split("\n"))
+    return lines
+
+
+def extract_dependency(go_binary_path,directory,elves: Optional[ELFCache] = None):
         packages = []
-        # Use go list to get package dependencies
-        deps_process = subprocess.Popen(['go', 'version',"-m" ,go_binary_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        deps_output, deps_error = deps_process.communicate()
-        
-        if deps_process.returncode != 0 or len(deps_error) > 1:
-            return []
-        lines = deps_output.decode('utf-8').splitlines()
+        elves = elves if elves is not None else ELFCache(directory)
         try:
-            version = lines[0].split(" ")[1]
+            with elves.open(go_binary_path) as elf:
+                buildinfo = read_buildinfo(elf)
         except Exception as e:
-             logger.warning(f"Go binary {go_binary_path} is too old to be analyzed {e}")
-             return packages
+            logger.debug(f"[GO] Could not read {go_binary_path}: {e}")
+            return []
+        if buildinfo is None:
+            return []
+        lines = version_lines(go_binary_path,*buildinfo)
+        version = buildinfo[0].split(" ")[0]
         pkg = PackageInfo("stdlib", version[2:],None,PackageInfoType.GOLANG)
         packages.append(pkg)
         
@@ -72,12 +179,14 @@ require_pattern = r'require\s+\(\s*([^)]*)\s*\)'  # for multiline `require`
 single_require_pattern = r'require\s+([^\s]+)\s+([^\s]+)'  # for single line `require`
     
 
-def get_gomod(paths: List[str],directory: str) -> Dict[PackageInfo,List[str]]:
-    gomods = [path for path in paths if path.endswith("/go.mod")]
+def get_gomod(paths: List[str],directory,candidates: Optional[List[str]] = None) -> Dict[PackageInfo,List[str]]:
+    fs = as_layerfs(directory)
+    candidates = paths if candidates is None else candidates
+    gomods = [path for path in candidates if path.endswith("/go.mod")]
 
     packages = {}
     for gomod in gomods:
-        file_content = open(os.path.join(directory,gomod)).read()
+        file_content = fs.open(gomod).read()
         
         match = re.search(go_version_pattern, file_content, re.MULTILINE)
         if match:
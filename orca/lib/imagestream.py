@@ -0,0 +1,141 @@
+import hashlib
+import io
+import os
+import queue
+import tarfile
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Tuple
+
+from .layerfs import normalize_member_name
+
+# Layers smaller than this are kept in memory, bigger ones spill to a temporary file
+SPOOL_SIZE = 256 * 1024 * 1024
+# Upper bound for the JSON documents (manifest, config, index) kept in memory
+METADATA_MAX_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+METADATA_FILES = ["manifest.json", "index.json", "oci-layout", "repositories"]
+
+_END = object()
+
+
+class IterStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of byte chunks (e.g. `image.save()`).
+
+    A background thread keeps pulling chunks into a bounded queue, so the
+    transfer from the docker daemon continues while the consumer is busy
+    analyzing the previous layer.
+    """
+    def __init__(self, chunks: Iterable[bytes], prefetch: int = 16):
+        self._queue: queue.Queue = queue.Queue(maxsize=prefetch)
+        self._buffer = b""
+        self._done = False
+        self._closed_event = threading.Event()
+        self._thread = threading.Thread(target=self._fill, args=(iter(chunks),), daemon=True)
+        self._thread.start()
+
+    def _fill(self, chunks: Iterator[bytes]):
+        try:
+            for chunk in chunks:
+                while not self._closed_event.is_set():
+                    try:
+                        self._queue.put(chunk, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if self._closed_event.is_set():
+                    return
+            self._queue.put(_END)
+        except Exception as e:
+            self._queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._done:
+            item = self._queue.get()
+            if item is _END:
+                self._done = True
+            elif isinstance(item, Exception):
+                self._done = True
+                raise item
+            else:
+                self._buffer = item
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        self._closed_event.set()
+        super().close()
+
+
+def is_metadata(name: str, head: bytes, size: int) -> bool:
+    if os.path.basename(name) in METADATA_FILES:
+        return True
+    return size <= METADATA_MAX_SIZE and head.lstrip()[:1] in (b"{", b"[")
+
+
+def is_layer(head: bytes) -> bool:
+    return (head[257:262] == b"ustar"          # tar
+            or head[:2] == b"\x1f\x8b"          # gzip
+            or head[:4] == b"\x28\xb5\x2f\xfd")  # zstd
+
+
+def iter_layers(fileobj: BinaryIO, metadata: Dict[str, bytes], links: Dict[str, str],
+                should_read: Callable[[str], bool] = lambda name: True) -> Iterator[Tuple[str, BinaryIO, str]]:
+    """
+    Reads an image archive (docker save or OCI) sequentially and yields every
+    layer as soon as it has been received, as a seekable file object together
+    with the sha256 digest of its content.
+
+    Layers for which `should_read` returns False are skipped without being
+    stored. Only one layer is held at a time. The small JSON entries (manifest, config,
+    index) are collected into `metadata` and links between members (docker
+    deduplicates identical layers with symlinks) into `links`, since they are
+    usually found at the end of the archive.
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|") as archive:
+        for member in archive:
+            name = normalize_member_name(member.name)
+            if member.issym() or member.islnk():
+                target = member.linkname if member.islnk() else os.path.join(os.path.dirname(name), member.linkname)
+                links[name] = os.path.normpath(target)
+                continue
+            if not member.isreg():
+                continue
+            src = archive.extractfile(member)
+            head = src.read(512)
+            if is_metadata(name, head, member.size):
+                metadata[name] = head + src.read()
+                continue
+            if not is_layer(head) or not should_read(name):
+                continue
+            digest = hashlib.sha256(head)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+                spool.write(head)
+                while chunk := src.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    spool.write(chunk)
+                spool.seek(0)
+                yield name, spool, f"sha256:{digest.hexdigest()}"
+
+
+def resolve_link(name: str, links: Dict[str, str]) -> str:
+    """
+    Follows the links recorded by `iter_layers`, both on the member itself
+    and on its parent folders (e.g. `<id>/layer.tar` with `<id>` a link).
+    """
+    for _ in range(32):
+        parts = name.split("/")
+        for idx in range(len(parts), 0, -1):
+            prefix = "/".join(parts[:idx])
+            if prefix in links:
+                name = "/".join([links[prefix], *parts[idx:]])
+                break
+        else:
+            return name
+    return name
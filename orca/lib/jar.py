@@ -1,9 +1,12 @@
 
 import os
 import re
-from typing import List
+from typing import List, Optional
 import zipfile
 from . import logger
+from .filecache import get_file_cache
+from .layerfs import as_layerfs
+from .path import PathTree
 from.types import PackageInfo, PackageInfoType
 
 # TODO: fix this
@@ -30,7 +33,7 @@ def parse_pom_properties(jar: zipfile.ZipFile,content: str):
 def list_jar_props(jar_path,directory):
     packages = []
     try:
-        with zipfile.ZipFile(os.path.join(directory,jar_path), 'r') as jar:
+        with zipfile.ZipFile(as_layerfs(directory).open(jar_path,"rb"), 'r') as jar:
             contents = jar.namelist()
             real_contents =  [content for content in contents if content.endswith("pom.properties") ]
             nested_jars = [content for content in contents if content.endswith(".jar")]
@@ -62,8 +65,10 @@ def extract_jar(input_string: str):
             return {"author": author,"name": name, "version": version}
     return None
 
-def get_jar(paths: List[str],directory: str):
-    jars = [path for path in paths if path.endswith(".jar") ]
+def get_jar(paths: List[str],directory: str,candidates: Optional[List[str]] = None):
+    jars = [path for path in (paths if candidates is None else candidates) if path.endswith(".jar") ]
+    # Zip archives found by content, e.g. renamed jars. Only their content can identify them
+    archives = [path for path in candidates or [] if not path.endswith(".jar")]
     packages = {}
     for jar in jars:
         basename = os.path.basename(jar).split(".jar")[0]
@@ -92,10 +97,13 @@ def get_jar(paths: List[str],directory: str):
 
 
 
-    for jar in jars:
-        pkgs = list_jar_props(jar,directory)
+    tree = PathTree.of(paths)
+    fs = as_layerfs(directory)
+    cache = get_file_cache()
+    for jar in jars + archives:
+        pkgs = cache.get_or_compute(fs.join(jar),"jar",lambda: list_jar_props(jar,directory))
         basepath = os.path.dirname(jar) 
-        files = list(filter(lambda x: basepath in x, paths))
+        files = tree.under(basepath)
         for pkg in pkgs:
             packages[pkg] = files
     if len(packages):
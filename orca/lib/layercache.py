@@ -0,0 +1,127 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+from typing import Dict, List, Optional
+
+from orca import __version__
+from .logger import logger
+from .types import VulnerabilityReport
+
+CACHE_DIR = os.getenv("ORCA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "orca"))
+DEFAULT_CACHE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
+
+# Bump when the analyzers change in a way that makes cached reports stale
+ANALYZER_VERSION = 4
+
+BLOB_DIGEST = re.compile(r'blobs/(sha256|sha512)/([0-9a-f]+)$')
+
+
+def layer_digests(layers: List[str], config: Dict) -> List[Optional[str]]:
+    """
+    Maps every layer of the manifest to the digest of its content.
+    OCI-style archives name layers after their blob digest, older docker archives
+    only have the layer ids, so the uncompressed digests from the config rootfs are used.
+    """
+    diff_ids = config.get("rootfs", {}).get("diff_ids", []) if isinstance(config, dict) else []
+    digests = []
+    for idx, layer in enumerate(layers):
+        match = BLOB_DIGEST.search(layer)
+        if match:
+            digests.append(f"{match.group(1)}:{match.group(2)}")
+        elif idx < len(diff_ids) and len(diff_ids) == len(layers):
+            digests.append(diff_ids[idx])
+        else:
+            digests.append(None)
+    return digests
+
+
+class LayerCache:
+    """
+    Persistent cache of layer reports, content-addressed by layer digest.
+
+    Entries are pickled VulnerabilityReport objects stored one per file. The
+    modification time of an entry is refreshed on every hit, so evicting the
+    oldest files first gives a LRU policy bounded by `max_size` bytes.
+    """
+    def __init__(self, directory: str = CACHE_DIR, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory = os.path.join(directory, "layers")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, digest: str, **options) -> str:
+        settings = ",".join(f"{k}={v}" for k, v in sorted(options.items()))
+        raw = f"{digest}|orca={__version__}|analyzers={ANALYZER_VERSION}|{settings}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def get(self, digest: Optional[str], **options) -> Optional[VulnerabilityReport]:
+        if digest is None:
+            self.misses += 1
+            return None
+        entry = self._entry(self.key(digest, **options))
+        try:
+            with open(entry, "rb") as fp:
+                report = pickle.load(fp)
+            os.utime(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding corrupted cache entry {entry}: {e}")
+            self._remove(entry)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return report
+
+    def put(self, digest: Optional[str], report: VulnerabilityReport, **options) -> None:
+        if digest is None:
+            return
+        entry = self._entry(self.key(digest, **options))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                pickle.dump(report, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry)
+        except Exception as e:
+            logger.warning(f"Could not store layer {digest} in cache: {e}")
+            self._remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".pickle"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return
+        for _mtime, size, path in sorted(entries):
+            self._remove(path)
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
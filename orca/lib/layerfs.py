@@ -0,0 +1,546 @@
+import hashlib
+import io
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+from .logger import logger
+from .path import FileEntry, build_file_index, is_excluded
+from .types import FileDigests, LayerAction, LayerChangeRecord
+
+WHITEOUT_PREFIX = ".wh."
+OPAQUE_WHITEOUT = ".wh..wh..opq"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def normalize_member_name(name: str) -> str:
+    while name.startswith("./"):
+        name = name[2:]
+    return name.lstrip("/").rstrip("/")
+
+
+def hash_content(fp) -> FileDigests:
+    """
+    SHA1 and SHA256 of the content of `fp`, both updated from the same reads.
+    """
+    sha1, sha256 = hashlib.sha1(), hashlib.sha256()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    size = 0
+    while True:
+        read = fp.readinto(buffer)
+        if not read:
+            break
+        sha1.update(view[:read])
+        sha256.update(view[:read])
+        size += read
+    return FileDigests(sha1.digest(), sha256.digest(), size)
+
+
+class LayerPath:
+    """
+    Handle to a file that lives inside a layer filesystem which is not on disk.
+    It is what `LayerFS.join` returns for archive-backed layers and can be
+    passed to `open_file` wherever a filesystem path was expected.
+    """
+    def __init__(self, fs: "LayerFS", path: str):
+        self.fs = fs
+        self.path = path
+
+    def open(self, mode: str = "r"):
+        return self.fs.open(self.path, mode)
+
+    def __str__(self):
+        return f"{self.fs.root}/{self.path}"
+
+    def __repr__(self):
+        return f"LayerPath({self.fs.root!r}, {self.path!r})"
+
+
+def open_file(source, mode: str = "r"):
+    """
+    Opens either a filesystem path or a `LayerPath` handle.
+    """
+    if isinstance(source, LayerPath):
+        return source.open(mode)
+    return open(source, mode)
+
+
+def known_digests(source) -> Optional[FileDigests]:
+    """
+    Digests of a `LayerPath` from the index of its layer, if it was hashed.
+    """
+    if isinstance(source, LayerPath):
+        return source.fs.digest(source.path)
+    return None
+
+
+def path_exists(source) -> bool:
+    if isinstance(source, LayerPath):
+        return source.fs.isfile(source.path)
+    return os.path.exists(source)
+
+
+class LayerFS:
+    """
+    Read-only view over the files of a single layer.
+
+    Analyzers only need a handful of operations (list, stat, open, read), so
+    every layer source (an extracted directory or a tar archive) implements
+    this same interface and the analyzers do not care where the bytes live.
+    """
+    root: str
+    _index: Optional[Dict[str, FileEntry]] = None
+    # Whether files can be read from several threads at the same time
+    concurrent_reads: bool = False
+    _hashed: bool = False
+
+    def list(self) -> Set[str]:
+        raise NotImplementedError
+
+    def index(self) -> Dict[str, FileEntry]:
+        """
+        One entry per path of the layer (size, mode, link target), built once.
+        """
+        raise NotImplementedError
+
+    def _indexed(self, path: str) -> Optional[FileEntry]:
+        entry = self.index().get(normalize_member_name(path))
+        if entry is None or entry.is_link:
+            # Links are resolved by the filesystem itself
+            return None
+        return entry
+
+    def join(self, path: str):
+        raise NotImplementedError
+
+    def open(self, path: str, mode: str = "r"):
+        raise NotImplementedError
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def isfile(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def isdir(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def is_executable(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, path: str) -> int:
+        raise NotImplementedError
+
+    def mtime(self, path: str) -> float:
+        raise NotImplementedError
+
+    def realpath(self, path: str) -> str:
+        raise NotImplementedError
+
+    def read(self, path: str, size: int = -1) -> bytes:
+        with self.open(path, "rb") as fp:
+            return fp.read(size)
+
+    def hash_files(self) -> None:
+        """
+        Makes sure the digests of every regular file of the index are in its entry.
+        Archive layers hash their members while they are indexed: nothing is read again.
+        """
+        self.index()
+
+    def digest(self, path: str) -> Optional[FileDigests]:
+        """
+        Digests of a regular file, if it was hashed already.
+        """
+        entry = self.index().get(normalize_member_name(path))
+        return entry.digests if entry is not None else None
+
+    def hash_file(self, path: str) -> FileDigests:
+        """
+        Digests of a regular file. The first time they are asked for, the file is
+        read whole and the digests are stored in its entry.
+        """
+        entry = self.index().get(normalize_member_name(path))
+        if entry is not None and entry.digests is not None:
+            return entry.digests
+        with self.open(path, "rb") as fp:
+            digests = hash_content(fp)
+        if entry is not None:
+            entry.digests = digests
+        return digests
+
+    def digests(self) -> Dict[str, FileDigests]:
+        """
+        Digests of the files hashed so far.
+        """
+        return {name: entry.digests for name, entry in self.index().items() if entry.digests is not None}
+
+    @contextmanager
+    def materialize(self, path: str):
+        """
+        Yields a real filesystem path with the content of `path`. Needed by
+        the few tools that cannot read from a file object (sqlite, external binaries).
+        """
+        raise NotImplementedError
+        yield
+
+
+class DirectoryFS(LayerFS):
+    concurrent_reads = True
+
+    def __init__(self, root: str):
+        self.root = root
+        self._index = None
+
+    def index(self) -> Dict[str, FileEntry]:
+        if self._index is None:
+            self._index = build_file_index(self.root)
+        return self._index
+
+    def list(self) -> Set[str]:
+        return set(self.index().keys())
+
+    def join(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    def open(self, path: str, mode: str = "r"):
+        return open(self.join(path), mode)
+
+    def exists(self, path: str) -> bool:
+        return normalize_member_name(path) in self.index() or os.path.exists(self.join(path))
+
+    def isfile(self, path: str) -> bool:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.is_regular
+        return os.path.isfile(self.join(path))
+
+    def isdir(self, path: str) -> bool:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.is_dir
+        return os.path.isdir(self.join(path))
+
+    def is_executable(self, path: str) -> bool:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.is_executable
+        real_path = self.join(path)
+        return os.path.isfile(real_path) and os.access(real_path, os.X_OK)
+
+    def size(self, path: str) -> int:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.size
+        return os.path.getsize(self.join(path))
+
+    def mtime(self, path: str) -> float:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.mtime
+        return os.path.getmtime(self.join(path))
+
+    def realpath(self, path: str) -> str:
+        realpath = os.path.realpath(self.join(path))
+        return realpath.replace(self.root + "/", "")
+
+    def hash_files(self) -> None:
+        # The folder was extracted by someone else: its files are read once, here
+        if self._hashed:
+            return
+        for name, entry in self.index().items():
+            if not entry.is_regular or entry.is_link or entry.digests is not None:
+                continue
+            try:
+                with open(self.join(name), "rb") as fp:
+                    entry.digests = hash_content(fp)
+            except OSError:
+                continue
+        self._hashed = True
+
+    @contextmanager
+    def materialize(self, path: str):
+        yield self.join(path)
+
+
+class TarLayerFS(LayerFS):
+    """
+    Layer filesystem backed directly by the members of a layer tarball.
+    Nothing is written to disk: file contents are read from the archive on demand.
+    """
+    def __init__(self, tar: tarfile.TarFile, root: Optional[str] = None):
+        self.tar = tar
+        self.root = root if root is not None else str(tar.name)
+        self._members: Optional[Dict[str, tarfile.TarInfo]] = None
+        self._digests: Dict[int, FileDigests] = {}
+        self._index = None
+
+    @property
+    def members(self) -> Dict[str, tarfile.TarInfo]:
+        if self._members is None:
+            members = {}
+            # Regular files are hashed as the archive is walked, their content
+            # right after their header: the layer is read once, in order
+            for member in self.tar:
+                if member.isreg():
+                    self._hash_member(member)
+                name = normalize_member_name(member.name)
+                if name == "":
+                    continue
+                members[name] = member
+            self._members = members
+        return self._members
+
+    def _hash_member(self, member: tarfile.TarInfo) -> None:
+        try:
+            with self.tar.extractfile(member) as fp:
+                self._digests[id(member)] = hash_content(fp)
+        except (OSError, tarfile.TarError) as e:
+            logger.debug(f"Could not hash {member.name} in {self.root}: {e}")
+
+    def _member_digests(self, member: Optional[tarfile.TarInfo]) -> Optional[FileDigests]:
+        return self._digests.get(id(member)) if member is not None else None
+
+    def index(self) -> Dict[str, FileEntry]:
+        # Mirrors what an extraction without links, devices and empty folders
+        # would leave on disk: regular files plus the folders containing them.
+        # Links are indexed too, with their target, but are not listed.
+        if self._index is None:
+            index: Dict[str, FileEntry] = {}
+            for name, member in self.members.items():
+                if member.issym():
+                    if not is_excluded(name):
+                        index[name] = FileEntry(name, 0, stat.S_IFLNK | member.mode, member.mtime, member.linkname)
+                elif member.islnk():
+                    if not is_excluded(name):
+                        # Hard links share the digests of their target
+                        index[name] = FileEntry(name, member.size, stat.S_IFREG | member.mode, member.mtime, member.linkname,
+                                                self._member_digests(self._resolve(name)))
+                elif member.isreg():
+                    if not is_excluded(name):
+                        index[name] = FileEntry(name, member.size, stat.S_IFREG | member.mode, member.mtime, None, self._member_digests(member))
+                    parts = name.split("/")
+                    for i in range(1, len(parts)):
+                        folder = "/".join(parts[:i])
+                        if folder in index or is_excluded(folder):
+                            continue
+                        folder_member = self.members.get(folder)
+                        mtime = folder_member.mtime if folder_member is not None else 0
+                        index[folder] = FileEntry(folder, 0, stat.S_IFDIR | 0o755, mtime)
+            self._index = index
+        return self._index
+
+    def list(self) -> Set[str]:
+        return set(name for name, entry in self.index().items() if not entry.is_link)
+
+    def _resolve(self, path: str, depth: int = 0) -> Optional[tarfile.TarInfo]:
+        member = self.members.get(normalize_member_name(path))
+        if member is None or depth > 16:
+            return None
+        if member.issym():
+            target = os.path.normpath(os.path.join(os.path.dirname(path), member.linkname))
+            return self._resolve(target, depth + 1)
+        if member.islnk():
+            return self._resolve(member.linkname, depth + 1)
+        return member
+
+    def _extract(self, member: tarfile.TarInfo):
+        return self.tar.extractfile(member)
+
+
+    def join(self, path: str) -> LayerPath:
+        return LayerPath(self, path)
+
+    def open(self, path: str, mode: str = "r"):
+        member = self._resolve(path)
+        if member is None or not member.isreg():
+            raise FileNotFoundError(f"{self.root}/{path}")
+        fp = self._extract(member)
+        if "b" in mode:
+            return fp
+        return io.TextIOWrapper(fp)
+
+    def exists(self, path: str) -> bool:
+        return normalize_member_name(path) in self.members or self.isdir(path)
+
+    def isfile(self, path: str) -> bool:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.is_regular
+        member = self._resolve(path)
+        return member is not None and member.isreg()
+
+    def isdir(self, path: str) -> bool:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.is_dir
+        member = self._resolve(path)
+        if member is not None:
+            return member.isdir()
+        prefix = normalize_member_name(path) + "/"
+        return any(name.startswith(prefix) for name in self.members)
+
+    def is_executable(self, path: str) -> bool:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.is_executable
+        member = self._resolve(path)
+        return member is not None and member.isreg() and bool(member.mode & 0o111)
+
+    def size(self, path: str) -> int:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.size
+        member = self._resolve(path)
+        if member is None:
+            raise FileNotFoundError(f"{self.root}/{path}")
+        return member.size
+
+    def mtime(self, path: str) -> float:
+        entry = self._indexed(path)
+        if entry is not None:
+            return entry.mtime
+        member = self._resolve(path)
+        if member is None:
+            raise FileNotFoundError(f"{self.root}/{path}")
+        return member.mtime
+
+    def realpath(self, path: str) -> str:
+        parts = normalize_member_name(path).split("/")
+        resolved = []
+        for idx, part in enumerate(parts):
+            current = "/".join([*resolved, part])
+            member = self.members.get(current)
+            if member is not None and member.issym():
+                if member.linkname.startswith("/"):
+                    target = member.linkname
+                else:
+                    target = os.path.join("/".join(resolved), member.linkname)
+                resolved = os.path.normpath(target).lstrip("/").split("/")
+            else:
+                resolved.append(part)
+        return "/".join(resolved)
+
+    @contextmanager
+    def materialize(self, path: str):
+        suffix = "-" + os.path.basename(path)
+        with self.open(path, "rb") as src, tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as dst:
+            shutil.copyfileobj(src, dst)
+        try:
+            yield dst.name
+        finally:
+            os.unlink(dst.name)
+
+
+class MergedLayerFS(TarLayerFS):
+    """
+    Final filesystem of an image: the union of its layers as seen by a running container.
+
+    The view is built from the tar headers only. Layers are applied top-down so a
+    path is owned by the last layer writing it, `.wh.<name>` whiteouts delete
+    files and folders of the lower layers and `.wh..wh..opq` markers hide the
+    whole content of a lower folder. The history of every path is kept as a
+    list of `LayerChangeRecord`.
+    """
+    def __init__(self, layers: List[Tuple[str, TarLayerFS]], root: str = "merged"):
+        self.layers = layers
+        self.root = root
+        self.owner: Dict[str, int] = {}
+        self.history: Dict[str, List[LayerChangeRecord]] = {}
+        self._members = {}
+        # Layer of every member, including the ones hidden in the merged view (hard link targets)
+        self._member_layer: Dict[int, TarLayerFS] = {}
+        self._merge()
+
+    def _merge(self):
+        events: Dict[str, List[Tuple[int, LayerAction]]] = {}
+        hidden: Dict[str, int] = {}   # whited-out paths of the upper layers
+        opaque: Dict[str, int] = {}   # folders whose lower content is hidden
+        for idx in range(len(self.layers) - 1, -1, -1):
+            layer_fs = self.layers[idx][1]
+            layer_hidden = {}
+            layer_opaque = {}
+            for name, member in layer_fs.members.items():
+                dirname, basename = os.path.split(name)
+                if basename == OPAQUE_WHITEOUT:
+                    layer_opaque[dirname] = idx
+                    continue
+                if basename.startswith(WHITEOUT_PREFIX):
+                    layer_hidden[os.path.join(dirname, basename[len(WHITEOUT_PREFIX):])] = idx
+                    continue
+                self._member_layer[id(member)] = layer_fs
+                if not member.isdir():
+                    events.setdefault(name, []).append((idx, LayerAction.ADDED))
+                hidden_by = self._hidden_by(name, hidden, opaque)
+                if hidden_by is not None:
+                    if not member.isdir():
+                        events[name].append((hidden_by, LayerAction.DELETED))
+                    continue
+                if name in self._members:
+                    continue
+                self._members[name] = member
+                self.owner[name] = idx
+            hidden.update(layer_hidden)
+            opaque.update(layer_opaque)
+
+        for path, path_events in events.items():
+            records = []
+            previous = None
+            for idx, action in sorted(set(path_events), key=lambda event: (event[0], event[1] == LayerAction.DELETED)):
+                if action == LayerAction.ADDED and previous == LayerAction.ADDED:
+                    action = LayerAction.REPLACED
+                records.append(LayerChangeRecord(action, self.layers[idx][0]))
+                previous = LayerAction.ADDED if action == LayerAction.REPLACED else action
+            self.history[path] = records
+
+    def _hidden_by(self, name: str, hidden: Dict[str, int], opaque: Dict[str, int]) -> Optional[int]:
+        """
+        Returns the index of the upper layer hiding `name`, if any.
+        """
+        if name in hidden:
+            return hidden[name]
+        parts = name.split("/")
+        for i in range(1, len(parts)):
+            ancestor = "/".join(parts[:i])
+            if ancestor in hidden:
+                return hidden[ancestor]
+            if ancestor in opaque:
+                return opaque[ancestor]
+            # A file or link of an upper layer replaces the whole lower folder
+            member = self._members.get(ancestor)
+            if member is not None and not member.isdir():
+                return self.owner[ancestor]
+        return None
+
+    @property
+    def members(self) -> Dict[str, tarfile.TarInfo]:
+        return self._members
+
+    def _resolve(self, path: str, depth: int = 0) -> Optional[tarfile.TarInfo]:
+        member = self.members.get(normalize_member_name(path))
+        if member is not None and member.islnk():
+            # Hard links always point inside the layer that contains them
+            return self._member_layer[id(member)]._resolve(member.linkname, depth + 1)
+        return super()._resolve(path, depth)
+
+    def _extract(self, member: tarfile.TarInfo):
+        return self._member_layer[id(member)].tar.extractfile(member)
+
+    def _member_digests(self, member: Optional[tarfile.TarInfo]) -> Optional[FileDigests]:
+        # Every layer hashed its own members while they were indexed
+        return self._member_layer[id(member)]._member_digests(member) if member is not None else None
+
+    def layer_of(self, path: str) -> Optional[str]:
+        idx = self.owner.get(normalize_member_name(path))
+        return self.layers[idx][0] if idx is not None else None
+
+
+def as_layerfs(directory) -> LayerFS:
+    if isinstance(directory, LayerFS):
+        return directory
+    return DirectoryFS(directory)
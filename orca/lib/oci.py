@@ -0,0 +1,320 @@
+import io
+import json
+import os
+import platform
+import tarfile
+import tempfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import zstandard
+
+from .imagestream import SPOOL_SIZE
+from .layerfs import normalize_member_name
+from .logger import logger
+
+INDEX_MEDIA_TYPES = [
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+]
+CHUNK_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DECOMPRESS_WORKERS = min(4, os.cpu_count() or 1)
+
+MACHINE_TO_ARCH = {
+    "x86_64": "amd64",
+    "amd64": "amd64",
+    "aarch64": "arm64",
+    "arm64": "arm64",
+    "armv7l": "arm",
+    "ppc64le": "ppc64le",
+    "s390x": "s390x",
+}
+
+
+class OCIError(Exception):
+    pass
+
+
+class Extent(io.RawIOBase):
+    """
+    Read-only, seekable view on `size` bytes of a file starting at `offset`, with its own handle.
+    """
+    def __init__(self, path: str, offset: int, size: int):
+        self.fp = open(path, "rb", buffering=0)
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, b):
+        size = min(len(b), self.size - self.position)
+        if size <= 0:
+            return 0
+        self.fp.seek(self.offset + self.position)
+        data = self.fp.read(size)
+        b[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        self.fp.close()
+        super().close()
+
+
+class OCILayout:
+    """
+    Image stored as an OCI image layout: `index.json` plus content-addressed blobs,
+    either as a directory or packed in a tar archive.
+
+    Every call to `open_blob` returns an independent file object, so blobs can be
+    read from several threads at the same time.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.members: Optional[Dict[str, Tuple[int, int]]] = None
+        if not os.path.isdir(path):
+            self.members = {}
+            with tarfile.open(path) as tar:
+                for member in tar.getmembers():
+                    if member.isreg():
+                        self.members[normalize_member_name(member.name)] = (member.offset_data, member.size)
+
+    def open(self, name: str) -> BinaryIO:
+        if self.members is None:
+            return open(os.path.join(self.path, name), "rb")
+        if name not in self.members:
+            raise FileNotFoundError(name)
+        offset, size = self.members[name]
+        return io.BufferedReader(Extent(self.path, offset, size), CHUNK_SIZE)
+
+    def open_blob(self, digest: str) -> BinaryIO:
+        return self.open(blob_path(digest))
+
+    def read_json(self, name: str):
+        with self.open(name) as fp:
+            return json.load(fp)
+
+    def read_blob_json(self, digest: str):
+        return self.read_json(blob_path(digest))
+
+
+def blob_path(digest: str) -> str:
+    algorithm, encoded = digest.split(":", 1)
+    return f"blobs/{algorithm}/{encoded}"
+
+
+def is_oci_layout(path: str) -> bool:
+    """
+    OCI layouts have an `index.json` but, unlike docker save archives, no `manifest.json`.
+
+    Archive members are read one at a time until the answer is known. Image
+    archives are written in name order, so the `manifest.json` of a docker save
+    archive comes before its `oci-layout`: an archive with `index.json` and
+    `oci-layout` but no `manifest.json` so far is an OCI layout.
+    """
+    if os.path.isdir(path):
+        return os.path.exists(os.path.join(path, "index.json"))
+    if not tarfile.is_tarfile(path):
+        return False
+    found = set()
+    with tarfile.open(path) as tar:
+        for member in tar:
+            name = normalize_member_name(member.name)
+            if name == "manifest.json":
+                return False
+            if name in ("index.json", "oci-layout"):
+                found.add(name)
+                if len(found) == 2:
+                    return True
+    return "index.json" in found
+
+
+def host_platform() -> str:
+    machine = platform.machine().lower()
+    return f"linux/{MACHINE_TO_ARCH.get(machine, machine)}"
+
+
+def match_platform(descriptor: Dict, requested: str) -> bool:
+    desc_platform = descriptor.get("platform")
+    if desc_platform is None:
+        return False
+    parts = requested.split("/")
+    values = [desc_platform.get("os"), desc_platform.get("architecture"), desc_platform.get("variant")]
+    return all(part == value for part, value in zip(parts, values))
+
+
+def select_manifest(layout: OCILayout, index: Dict, requested: Optional[str]) -> Dict:
+    """
+    Walks the (possibly nested) image indexes down to the image manifest of the
+    requested platform, which defaults to the platform ORCA is running on.
+    """
+    manifests = [m for m in index.get("manifests", [])
+                 if m.get("platform", {}).get("architecture") != "unknown"]  # attestation manifests
+    if len(manifests) == 0:
+        raise OCIError("Image index does not contain any manifest")
+    if len(manifests) == 1:
+        selected = manifests[0]
+    else:
+        wanted = requested if requested is not None else host_platform()
+        matching = [m for m in manifests if match_platform(m, wanted)]
+        if len(matching) == 0:
+            available = [f"{m.get('platform', {}).get('os')}/{m.get('platform', {}).get('architecture')}" for m in manifests]
+            raise OCIError(f"Platform {wanted} not found in image index, available: {', '.join(available)}")
+        selected = matching[0]
+    if requested is not None and "platform" in selected and not match_platform(selected, requested):
+        raise OCIError(f"Platform {requested} not found in image index")
+
+    content = layout.read_blob_json(selected["digest"])
+    media_type = content.get("mediaType", selected.get("mediaType"))
+    if media_type in INDEX_MEDIA_TYPES or "manifests" in content:
+        return select_manifest(layout, content, requested)
+    return content
+
+
+def read_image(layout: OCILayout, requested_platform: Optional[str] = None) -> Tuple[Dict, List[Dict]]:
+    """
+    Returns the image config and the layer descriptors of the selected manifest.
+    """
+    manifest = select_manifest(layout, layout.read_json("index.json"), requested_platform)
+    config = layout.read_blob_json(manifest["config"]["digest"])
+    return config, manifest["layers"]
+
+
+def decompress(src: BinaryIO, dst: BinaryIO) -> None:
+    """
+    Inflates a layer blob, detecting gzip and zstd from the magic bytes
+    (media types are not reliable across tools).
+    """
+    head = src.read(len(ZSTD_MAGIC))
+    if head.startswith(GZIP_MAGIC):
+        inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        data = head
+        while data:
+            dst.write(inflater.decompress(data))
+            # Concatenated gzip members
+            while inflater.eof and inflater.unused_data:
+                data = inflater.unused_data
+                inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+                dst.write(inflater.decompress(data))
+            data = src.read(CHUNK_SIZE)
+        dst.write(inflater.flush())
+    elif head == ZSTD_MAGIC:
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BufferedReader(_Prefixed(head, src)), read_across_frames=True)
+        while chunk := reader.read(CHUNK_SIZE):
+            dst.write(chunk)
+    else:
+        dst.write(head)
+        while chunk := src.read(CHUNK_SIZE):
+            dst.write(chunk)
+
+
+class _Prefixed(io.RawIOBase):
+    def __init__(self, prefix: bytes, fp: BinaryIO):
+        self.prefix = prefix
+        self.fp = fp
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.prefix:
+            size = min(len(b), len(self.prefix))
+            b[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.fp.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def decompress_layer(layout: OCILayout, digest: str) -> BinaryIO:
+    """
+    Seekable uncompressed layer: uncompressed blobs are read in place, compressed
+    ones are inflated in a spooled temporary file.
+    """
+    src = layout.open_blob(digest)
+    head = src.read(len(ZSTD_MAGIC))
+    src.seek(0)
+    if not head.startswith(GZIP_MAGIC) and head != ZSTD_MAGIC:
+        return src
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        with src:
+            decompress(src, spool)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def decompress_layers(layout: OCILayout, digests: List[str], workers: int = DECOMPRESS_WORKERS) -> List[BinaryIO]:
+    """
+    Uncompressed layers, for scans that need every layer at the same time. As in
+    `iter_decompressed`, only `workers` layers are inflated ahead; inflated layers
+    are then moved to disk, so memory only holds the layers in flight.
+    """
+    layer_fps: List[BinaryIO] = []
+    try:
+        for _, layer_fp in iter_decompressed(layout, digests, workers, close=False):
+            if isinstance(layer_fp, tempfile.SpooledTemporaryFile):
+                layer_fp.rollover()
+            layer_fps.append(layer_fp)
+    except BaseException:
+        for layer_fp in layer_fps:
+            layer_fp.close()
+        raise
+    return layer_fps
+
+
+def iter_decompressed(layout: OCILayout, digests: List[str], workers: int = DECOMPRESS_WORKERS, close: bool = True) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Yields the uncompressed layers in order. Up to `workers` layers are inflated
+    ahead on a thread pool (zlib and zstd release the GIL), so decompression of
+    the next layers overlaps with the analysis of the current one. Layers are
+    closed once the next one is asked for, unless `close` is False.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending: List[Tuple[str, Future]] = []
+        queued = iter(digests)
+        try:
+            for digest in queued:
+                pending.append((digest, executor.submit(decompress_layer, layout, digest)))
+                if len(pending) >= workers:
+                    break
+            while pending:
+                digest, future = pending.pop(0)
+                next_digest = next(queued, None)
+                if next_digest is not None:
+                    pending.append((next_digest, executor.submit(decompress_layer, layout, next_digest)))
+                logger.debug(f"Waiting for layer {digest}")
+                layer_fp = future.result()
+                try:
+                    yield digest, layer_fp
+                finally:
+                    if close:
+                        layer_fp.close()
+        finally:
+            for _, future in pending:
+                if future.cancel():
+                    continue
+                try:
+                    future.result().close()
+                except Exception:
+                    pass
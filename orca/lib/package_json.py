@@ -1,23 +1,27 @@
 
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import json
 
+from.filecache import get_file_cache
 from.logger import logger
+from.layerfs import as_layerfs, open_file
+from.path import PathTree
 from.types import PackageInfo, PackageInfoType
 #import rpm
 
 
 def parse_package_json(paths,enclosing_dir,file: str):
     try:
-        content = json.load(open(file))
+        content = json.load(open_file(file))
     except Exception:
         logger.error(f"[JS] Could not parse {file}")
         return {}
     if "name" not in content:
         return {}
     name = content["name"]
-    files = set([path for path in paths if enclosing_dir in path])
+    paths = PathTree.of(paths)
+    files = set(paths.under(enclosing_dir))
     main_package = PackageInfo(name,"","npm")
     packages = {}
     if "version" in content:
@@ -33,7 +37,7 @@ def parse_package_json(paths,enclosing_dir,file: str):
             if type(version) is dict:
                 version = version['version']
             package = PackageInfo(dependency,version.split(" ")[0].replace("<","").replace(">","").replace("=",""),None,PackageInfoType.NPM)
-            files_to_add = set([path for path in paths if os.path.join(enclosing_dir,"node_modules","package") in path])
+            files_to_add = set(paths.under(os.path.join(enclosing_dir,"node_modules","package")))
             packages[package] = list(files_to_add)
             files.difference_update(files_to_add)
         packages[main_package] = list(files)
@@ -41,9 +45,13 @@ def parse_package_json(paths,enclosing_dir,file: str):
     return packages
 
 
-def parse_package_lock(paths,enclosing_dir,file: str):
-    packages = {}
-    content = json.load(open(file))
+def read_package_lock(file: str) -> List[Tuple[PackageInfo,bool]]:
+    """
+    Packages of a package-lock.json, in file order, with whether they own the
+    files of the project or only its manifests. Only depends on the file content.
+    """
+    entries = []
+    content = json.load(open_file(file))
     name_author = content["name"].split("/")
     author = "npm"
     name = ""
@@ -53,7 +61,7 @@ def parse_package_lock(paths,enclosing_dir,file: str):
     else:
         name = name_author[0]
         if "version" in content:
-            packages[PackageInfo(name,content["version"],author)] = [path for path in paths if enclosing_dir in path]
+            entries.append((PackageInfo(name,content["version"],author),True))
     key = "packages" if "packages" in content else "dependencies"
     for pkgname,package in content[key].items():
         if pkgname == "":
@@ -64,38 +72,54 @@ def parse_package_lock(paths,enclosing_dir,file: str):
                 continue
             if "/" in pkg:
                 pkg_split = pkg.replace("@","").split("/")
-                packages[PackageInfo(pkg_split[1],package["version"],pkg_split[0],PackageInfoType.NPM)] = [enclosing_dir + "/package_lock.json",enclosing_dir + "/package.json"]
+                entries.append((PackageInfo(pkg_split[1],package["version"],pkg_split[0],PackageInfoType.NPM),False))
             else:
-                packages[PackageInfo(pkg,package["version"],"npm",PackageInfoType.NPM)] = [path for path in paths if enclosing_dir in path]
+                entries.append((PackageInfo(pkg,package["version"],"npm",PackageInfoType.NPM),True))
         else:
             if "/" in pkgname:
                 pkg_split = pkgname.replace("@","").split("/")
-                packages[PackageInfo(pkg_split[1],package["version"],pkg_split[0])] = [enclosing_dir + "/package_lock.json",enclosing_dir + "/package.json"]
+                entries.append((PackageInfo(pkg_split[1],package["version"],pkg_split[0]),False))
             else:
-                packages[PackageInfo(pkgname,package["version"],"npm",PackageInfoType.NPM)] = [enclosing_dir + "/package_lock.json",enclosing_dir + "/package.json"]
-                
+                entries.append((PackageInfo(pkgname,package["version"],"npm",PackageInfoType.NPM),False))
+    return entries
+
+
+def parse_package_lock(paths,enclosing_dir,file: str):
+    packages = {}
+    paths = PathTree.of(paths)
+    entries = get_file_cache().get_or_compute(file,"npm-lock",lambda: read_package_lock(file))
+    for package,owns_project in entries:
+        if owns_project:
+            packages[package] = paths.under(enclosing_dir)
+        else:
+            packages[package] = [enclosing_dir + "/package_lock.json",enclosing_dir + "/package.json"]
     return packages
 
 def parse_library_packages(directory,paths,package_jsons)-> Dict[PackageInfo,List[str]]:
+    fs = as_layerfs(directory)
+    paths = PathTree.of(paths)
     packageMap = {}
     for file in package_jsons:
-        pmap = parse_package_json(paths,os.path.dirname(file),os.path.join(directory,file))
+        pmap = parse_package_json(paths,os.path.dirname(file),fs.join(file))
         packageMap.update(pmap)
     return packageMap
 
 
-def get_package_json(paths: List[str],directory: str):
+def get_package_json(paths: List[str],directory,candidates: Optional[List[str]] = None):
+    fs = as_layerfs(directory)
+    candidates = paths if candidates is None else candidates
+    paths = PathTree.of(paths)
     total_packages = {}
 
-    package_json_node_modules = [path for path in paths if path.endswith("package.json") or path.endswith("package-lock.json")]
+    package_json_node_modules = [path for path in candidates if path.endswith("package.json") or path.endswith("package-lock.json")]
     package_lock = sorted([path for path in package_json_node_modules if "node_modules" not in path ],key=len)
     
-    package_json = sorted([path for path in paths if path.endswith("package.json") and "node_modules" not in path ],key=len)
+    package_json = sorted([path for path in candidates if path.endswith("package.json") and "node_modules" not in path ],key=len)
     
     if len(package_json_node_modules) > 200: # Number can be changes
         logger.warning(f"Discovered {len(package_json_node_modules)} package modules. Analyzing all of these files will take time")
     
-    total_packages = parse_library_packages(directory,paths,package_json_node_modules)
+    total_packages = parse_library_packages(fs,paths,package_json_node_modules)
 
     if len(package_lock) == 0 and len(package_json) == 0:
         if len(package_json_node_modules) == 0:
@@ -109,10 +133,10 @@ def get_package_json(paths: List[str],directory: str):
         for item in biggest:
             basepath = os.path.dirname(item)
             if basepath + "/package.json" in package_json and basepath + "/package-lock.json" in package_lock:
-                total_packages.update(parse_package_lock(paths,basepath,os.path.join(directory,basepath,"package-lock.json")))
+                total_packages.update(parse_package_lock(paths,basepath,fs.join(os.path.join(basepath,"package-lock.json"))))
 
             elif basepath + "/package.json" in package_json and basepath + "/package-lock.json" not in package_lock:
-                pmap = parse_package_json(paths,basepath,os.path.join(directory,basepath,"package.json"))
+                pmap = parse_package_json(paths,basepath,fs.join(os.path.join(basepath,"package.json")))
                 total_packages.update(pmap)
              
             else:
@@ -1,5 +1,13 @@
-import glob
-from typing import Set
+import os
+import stat
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from .pathtable import PathSet
+from .types import FileDigests
+
+EXCLUDED_PATHS = ["etc/ssl/certs/", "usr/share/zoneinfo", "etc/nginx/"]
 
 def remove_folders(paths):
     dir_set = set()
@@ -16,11 +24,112 @@ def remove_folders(paths):
 
     return result
 
-def get_filepaths(directory:str) -> Set[str]:
-    paths = filter(lambda path: len(path) > 2 
-                   and "etc/ssl/certs/" not in path
-                   and "usr/share/zoneinfo" not in path
-                   and "etc/nginx/" not in path,
-                    glob.glob(directory + "/**", recursive=True,include_hidden=True))
-    mapped_paths = map(lambda path: path.replace(directory + "/",""),paths)
-    return set(mapped_paths)#set(remove_folders(paths))
\ No newline at end of file
+def is_excluded(path: str) -> bool:
+    return any(excluded in path for excluded in EXCLUDED_PATHS)
+
+@dataclass
+class FileEntry:
+    path: str
+    size: int
+    mode: int
+    mtime: float
+    linkname: Optional[str] = None
+    # Filled for regular files once they are hashed (see LayerFS.hash_files and LayerFS.hash_file)
+    digests: Optional[FileDigests] = None
+
+    @property
+    def is_regular(self) -> bool:
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_link(self) -> bool:
+        return self.linkname is not None
+
+    @property
+    def is_executable(self) -> bool:
+        return self.is_regular and bool(self.mode & 0o111)
+
+def build_file_index(directory: str) -> Dict[str, FileEntry]:
+    """
+    Walks `directory` once with scandir and stats every entry a single time.
+    Excluded folders are pruned: their content is never visited.
+    """
+    index: Dict[str, FileEntry] = {}
+    stack = [("", directory)]
+    while stack:
+        relative_dir, absolute_dir = stack.pop()
+        try:
+            entries = os.scandir(absolute_dir)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                if is_excluded(relative):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                linkname = os.readlink(entry.path) if stat.S_ISLNK(st.st_mode) else None
+                index[relative] = FileEntry(relative, st.st_size, st.st_mode, st.st_mtime, linkname)
+                if stat.S_ISDIR(st.st_mode) and not is_excluded(relative + "/"):
+                    stack.append((relative, entry.path))
+    return index
+
+def get_filepaths(directory) -> Set[str]:
+    if not isinstance(directory, str):
+        # Layer filesystems (see orca.lib.layerfs) know their own file list
+        return directory.list()
+    return set(build_file_index(directory).keys())
+
+class PathTree:
+    """
+    Sorted paths answering "every path under a folder" with two binary searches,
+    in time proportional to the result instead of a scan over all the paths.
+    """
+    def __init__(self, paths: Iterable[str]):
+        # Path sets of a report share the sorted order of their path table
+        self.paths: List[str] = paths.sorted() if isinstance(paths, PathSet) else sorted(paths)
+
+    @classmethod
+    def of(cls, paths: Iterable[str]) -> "PathTree":
+        return paths if isinstance(paths, PathTree) else cls(paths)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path) -> bool:
+        idx = bisect_left(self.paths, path)
+        return idx < len(self.paths) and self.paths[idx] == path
+
+    def _range(self, directory: str):
+        # "0" is the character after "/": "a/b-c" sorts between "a/b" and "a/b/", "a/b0" after all of "a/b/"
+        return bisect_left(self.paths, directory + "/"), bisect_left(self.paths, directory + "0")
+
+    def under(self, directory: str) -> List[str]:
+        """
+        `directory` itself and every path below it.
+        """
+        directory = directory.rstrip("/")
+        if directory == "":
+            return list(self.paths)
+        start, end = self._range(directory)
+        files = self.paths[start:end]
+        if directory in self:
+            files.insert(0, directory)
+        return files
+
+    def has_under(self, directory: str) -> bool:
+        directory = directory.rstrip("/")
+        if directory == "" or directory in self:
+            return len(self.paths) > 0
+        start, end = self._range(directory)
+        return start < end
@@ -0,0 +1,115 @@
+import sys
+from collections.abc import Set as AbstractSet
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+
+class PathTable:
+    """
+    Interned paths numbered in insertion order.
+
+    Path strings are interned with `sys.intern`, so the layers of an image share a
+    single copy of every path; sets of paths are boolean masks indexed by path id.
+    """
+    def __init__(self, paths: Iterable[str] = ()):
+        self.paths: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self._order: Optional[np.ndarray] = None
+        self.extend(paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def intern(self, path: str) -> int:
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = len(self.paths)
+            path = sys.intern(path)
+            self.paths.append(path)
+            self.ids[path] = path_id
+        return path_id
+
+    def extend(self, paths: Iterable[str]) -> np.ndarray:
+        ids, table = self.ids, self.paths
+        result = []
+        for path in paths:
+            path_id = ids.get(path)
+            if path_id is None:
+                path_id = len(table)
+                path = sys.intern(path)
+                table.append(path)
+                ids[path] = path_id
+            result.append(path_id)
+        return np.array(result, dtype=np.int64)
+
+    def lookup(self, paths: Iterable[str]) -> np.ndarray:
+        """
+        Ids of `paths`, -1 for the ones not in the table.
+        """
+        ids = self.ids
+        return np.fromiter((ids.get(path, -1) for path in paths), dtype=np.int64)
+
+    def sorted_ids(self) -> np.ndarray:
+        """
+        Ids of the paths in lexicographic order, computed once and shared by all the path sets of the table.
+        """
+        if self._order is None or len(self._order) != len(self.paths):
+            self._order = np.array(sorted(range(len(self.paths)), key=self.paths.__getitem__), dtype=np.int64)
+        return self._order
+
+    def mask(self, paths: Iterable[str]) -> np.ndarray:
+        ids = self.extend(paths)
+        mask = np.zeros(len(self.paths), dtype=bool)
+        mask[ids] = True
+        return mask
+
+
+class PathSet(AbstractSet):
+    """
+    Read-only set of the paths of `table` selected by `mask`.
+
+    Operators and the `set` methods used across ORCA return plain sets.
+    """
+    def __init__(self, table: PathTable, mask: np.ndarray):
+        self.table = table
+        self.mask = mask
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+
+    def __contains__(self, path) -> bool:
+        path_id = self.table.ids.get(path)
+        return path_id is not None and path_id < len(self.mask) and bool(self.mask[path_id])
+
+    def __iter__(self) -> Iterator[str]:
+        paths = self.table.paths
+        return (paths[path_id] for path_id in np.flatnonzero(self.mask))
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.mask))
+
+    def __repr__(self) -> str:
+        return f"PathSet({set(self)!r})"
+
+    def sorted(self) -> List[str]:
+        order = self.table.sorted_ids()
+        order = order[order < len(self.mask)]
+        paths = self.table.paths
+        return [paths[path_id] for path_id in order[self.mask[order]]]
+
+    def union(self, *others) -> set:
+        return set(self).union(*others)
+
+    def difference(self, *others) -> set:
+        return set(self).difference(*others)
+
+    def intersection(self, *others) -> set:
+        return set(self).intersection(*others)
+
+    def issubset(self, other) -> bool:
+        return all(path in other for path in self)
+
+    def copy(self) -> set:
+        return set(self)
@@ -1,9 +1,9 @@
 
-from typing import List
+from typing import List, Optional
 import re
-import os
 
 from . import logger
+from .layerfs import as_layerfs, open_file
 from .types import PackageInfo, PackageInfoType
 
 package_regex = r'package\s+([^\s;]+)'
@@ -15,7 +15,7 @@ version_regex = r'\$VERSION\s*=\s*\'([^\']+)\''
 
 def parse_module(filepath):
     try:
-        content = open(filepath).read()
+        content = open_file(filepath).read()
     except Exception as _:
         return "",""
     # Extract package name
@@ -28,11 +28,13 @@ def parse_module(filepath):
             return package_name,version
     return "",""
 
-def get_perl(paths: List[str],directory: str):
+def get_perl(paths: List[str],directory,candidates: Optional[List[str]] = None):
+    fs = as_layerfs(directory)
+    candidates = paths if candidates is None else candidates
     packages = {} 
-    perl_modules = [path for path in paths if path.endswith(".pm") and "perl" in path]
+    perl_modules = [path for path in candidates if path.endswith(".pm") and "perl" in path]
     for module in perl_modules:
-        package,version = parse_module(os.path.join(directory,module))
+        package,version = parse_module(fs.join(module))
         if len(package) > 0 and len(package.split("::")) < 3:
             packages[PackageInfo(package,version,None,PackageInfoType.PERL)] = [module]
     if len(packages):
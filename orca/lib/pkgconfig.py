@@ -1,13 +1,17 @@
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 import pykg_config
 import pykg_config.pcfile
 
 from . import logger
+from .layerfs import as_layerfs
+from .path import PathTree
 from .types import PackageInfo
 
-def get_pkgconfig(paths: List[str],directory: str) -> Dict[PackageInfo,List[str]]:
-    pkgs = filter(lambda path: "pkgconfig" in path and path.endswith(".pc"), paths)
+def get_pkgconfig(paths: List[str],directory,candidates: Optional[List[str]] = None) -> Dict[PackageInfo,List[str]]:
+    fs = as_layerfs(directory)
+    candidates = paths if candidates is None else candidates
+    pkgs = filter(lambda path: "pkgconfig" in path and path.endswith(".pc"), candidates)
     pkgmap = {}
     for pkg in pkgs:
         name = pkg.split("/")[-1]
@@ -16,11 +20,12 @@ def get_pkgconfig(paths: List[str],directory: str) -> Dict[PackageInfo,List[str]
     pkg_dir = {}
     for pkg in pkgmap.values():
         directories = []
-        pc_file_path = directory + "/" + pkg
+        pc_file_path = str(fs.join(pkg))
         vars = {}
         props = {}
         try:
-            _, vars, props = pykg_config.pcfile.read_pc_file(pc_file_path,{})
+            with fs.materialize(pkg) as real_path:
+                _, vars, props = pykg_config.pcfile.read_pc_file(real_path,{})
         except Exception as _:
             logger.logger.warning(f"Could not parse pkgconfig file {pc_file_path}")
             continue
@@ -42,11 +47,9 @@ def get_pkgconfig(paths: List[str],directory: str) -> Dict[PackageInfo,List[str]
             pkg_dir[package] = directories
 
     package_files = {}
+    tree = PathTree.of(paths)
     for package,dirs in pkg_dir.items():
         for directory in list(set(dirs)):
-            files_found = []
-            for path in paths:
-                if directory in path:
-                    files_found.append(path)
+            files_found = tree.under(directory)
         package_files[package] = files_found
     return package_files
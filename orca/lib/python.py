@@ -2,6 +2,8 @@ import os
 from typing import List
 from .types import PackageInfo, PackageInfoType
 from .logger import logger
+from .layerfs import as_layerfs, open_file, path_exists
+from .path import PathTree
 from email.parser import Parser
 from packaging.requirements import Requirement
 
@@ -10,13 +12,13 @@ python_dist_regex = re.compile(
     r'.*python(\d\.\d+)\/(?:site|dist)-packages\/(([a-zA-Z0-9_\-]+)\/)?([a-zA-Z0-9]+)-(\d+\.\d+\.?\d*)\.dist-info'
 )
 
-def check_python_from_path_once(paths,filename: str,directory: str):
+def check_python_from_path_once(paths,filename: str,directory):
     filenamenopath = [split for split in filename.split("/") if "-info" in split]
     if len(filenamenopath) == 0:
         return {}
     filenamenopath = filenamenopath[0]
     basename = os.path.dirname(filename)
-    files = list(filter(lambda x: basename in x,paths))
+    files = PathTree.of(paths).under(basename)
     if filenamenopath.endswith(".dist-info") or  filenamenopath.endswith(".egg-info"):
         file = filenamenopath.replace(".dist-info","").replace(".egg-info","")
         splits = file.split("-")
@@ -26,7 +28,7 @@ def check_python_from_path_once(paths,filename: str,directory: str):
             return {}
         pkg = PackageInfo(package,version,None,PackageInfoType.PYPI)
         if filename.endswith("RECORD"):
-            record = open(os.path.join(directory,filename)).readlines()
+            record = as_layerfs(directory).open(filename).readlines()
             basepath = "/".join(filename.split("/")[:-2])
             files.extend([basepath + "/" + line.split(",")[0] for line in record])
 
@@ -34,8 +36,9 @@ def check_python_from_path_once(paths,filename: str,directory: str):
     return {}
 
 
-def check_python_from_path(paths: List[str],directory: str):
+def check_python_from_path(paths: List[str],directory):
     packages = {}
+    paths = PathTree.of(paths)
     all_dist_info_records = [p for p in paths if ".dist-info" in p or "egg" in p]
 
     for path in all_dist_info_records:
@@ -48,7 +51,7 @@ def check_python_from_path(paths: List[str],directory: str):
 
 def extract_egg_dependencies(depfile):
     packages = []
-    pkg_info_content = open(depfile, 'r').read()
+    pkg_info_content = open_file(depfile, 'r').read()
 
     pkg_info = Parser().parsestr(pkg_info_content)
 
@@ -70,36 +73,40 @@ def extract_egg_dependencies(depfile):
 
 def get_egg_files(file:str,sources: str):
     basepath = "/".join(file.split("/")[:-2])
-    if not os.path.exists(sources):
+    if not path_exists(sources):
         return []
-    lines = open(sources).readlines()
+    lines = open_file(sources).readlines()
     return [basepath + "/"+line.replace("\n","") for line in lines]
 
 def get_record_files(file:str,sources: str):
     basepath = "/".join(file.split("/")[:-2])
-    lines = open(sources).readlines()
+    lines = open_file(sources).readlines()
     return [basepath + "/"+line.replace("\n","").split(",")[0] for line in lines]
 
-def parse_egg_info(paths,file,dirpath: str):
+def parse_egg_info(paths,file,dirpath: str,directory=""):
     packagesMap = {}
-    packages = extract_egg_dependencies(os.path.join(dirpath,"PKG-INFO"))
-    basename = os.path.dirname(file)
+    fs = as_layerfs(directory)
+    packages = extract_egg_dependencies(fs.join(os.path.join(dirpath,"PKG-INFO")))
+    files = PathTree.of(paths).under(os.path.dirname(file))
     for package in packages:
-        packagesMap[package] = [*get_egg_files(file,dirpath + "SOURCES.txt"),*list(filter(lambda x: basename in x, paths))]
+        packagesMap[package] = [*get_egg_files(file,fs.join(dirpath + "SOURCES.txt")),*files]
     return packagesMap
 
-def parse_metadata(paths,file,dirpath: str):
+def parse_metadata(paths,file,dirpath: str,directory=""):
     packagesMap = {}
-    packages = extract_egg_dependencies(dirpath + "METADATA")
-    basename = os.path.dirname(file)
+    fs = as_layerfs(directory)
+    packages = extract_egg_dependencies(fs.join(dirpath + "METADATA"))
+    files = PathTree.of(paths).under(os.path.dirname(file))
     for package in packages:
-        packagesMap[package] = [*get_record_files(file,dirpath + "RECORD"),*list(filter(lambda x: basename in x, paths))]
+        packagesMap[package] = [*get_record_files(file,fs.join(dirpath + "RECORD")),*files]
     return packagesMap
 
-def extract_python_dependencies(paths,directory: str):
-    interesting_paths = [p for p in paths if "dist-info" in p or "site-packages" in p or "dist-packages" in p]
+def extract_python_dependencies(paths,directory,candidates=None):
+    fs = as_layerfs(directory)
+    candidates = paths if candidates is None else candidates
+    interesting_paths = PathTree([p for p in candidates if "dist-info" in p or "site-packages" in p or "dist-packages" in p])
     total_packages = {}
-    total_packages.update(check_python_from_path(interesting_paths,directory))
+    total_packages.update(check_python_from_path(interesting_paths,fs))
 
     for path in interesting_paths:
         if path.endswith(".egg-info") or path.endswith(".dist-info"):
@@ -119,7 +126,7 @@ def extract_python_dependencies(paths,directory: str):
 
 
     for eggpkg in pkginfo:
-        pakagesegg = parse_egg_info(interesting_paths,eggpkg,os.path.join(directory,eggpkg).replace("PKG-INFO",""))
+        pakagesegg = parse_egg_info(interesting_paths,eggpkg,eggpkg.replace("PKG-INFO",""),fs)
         for k,v in  pakagesegg.items():
             if k in total_packages:
                 total_packages[k].extend(v)
@@ -127,7 +134,7 @@ def extract_python_dependencies(paths,directory: str):
                 total_packages[k] = v
         total_packages.update(pakagesegg)
     for record in records:
-        pakagesegg = parse_metadata(interesting_paths,record,os.path.join(directory,record).replace("RECORD",""))
+        pakagesegg = parse_metadata(interesting_paths,record,record.replace("RECORD",""),fs)
         for k,v in  pakagesegg.items():
             if k in total_packages:
                 total_packages[k].extend(v)
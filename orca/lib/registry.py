@@ -0,0 +1,151 @@
+import fnmatch
+import re
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .apk import get_apk
+from .ascii_checkers import parse_gemspec
+from .composer import get_composer
+from .dnf import get_dnf
+from .dpkg import get_dpkg
+from .golang import get_gomod
+from .jar import get_jar
+from .logger import logger
+from .package_json import get_package_json
+from .perl import get_perl
+from .pkgconfig import get_pkgconfig
+from .python import extract_python_dependencies
+from .rpm_packages import get_rpm
+from .sniff import FileClass, SniffedFiles
+from .types import PackageInfo
+
+ENTRY_POINT_GROUP = "orca.analyzers"
+
+AnalyzerFunction = Callable[..., Dict[PackageInfo, List[str]]]
+
+
+@dataclass
+class Analyzer:
+    """
+    A package analyzer and the files it is interested in.
+
+    The function is called as `function(paths, directory, candidates=...)`: `paths` are
+    the files not attributed to a package yet, `candidates` the ones matching the
+    basenames, suffixes, globs or content kinds of the analyzer. Analyzers run by
+    increasing `order`.
+    """
+    name: str
+    function: AnalyzerFunction
+    basenames: Tuple[str, ...] = ()
+    suffixes: Tuple[str, ...] = ()
+    globs: Tuple[str, ...] = ()
+    kinds: Tuple[FileClass, ...] = ()
+    order: int = 100
+
+    def run(self, index: "PathIndex", paths: Set[str], directory) -> Dict[PackageInfo, List[str]]:
+        candidates = sorted(path for path in index.matches(self.name) if path in paths)
+        if len(candidates) == 0:
+            return {}
+        logger.debug(f"Analyzer {self.name}: {len(candidates)} candidates")
+        return self.function(paths, directory, candidates=candidates)
+
+
+ANALYZERS: Dict[str, Analyzer] = {}
+_entry_points_loaded = False
+
+
+def register_analyzer(analyzer: Analyzer) -> None:
+    if analyzer.name in ANALYZERS:
+        logger.warning(f"Analyzer {analyzer.name} is registered twice, keeping the last one")
+    ANALYZERS[analyzer.name] = analyzer
+
+
+def load_entry_points() -> None:
+    """
+    Registers the analyzers of other packages, declared in the `orca.analyzers`
+    entry point group. An entry point is either an `Analyzer` or a callable
+    returning one.
+    """
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            analyzer = entry_point.load()
+            if not isinstance(analyzer, Analyzer):
+                analyzer = analyzer()
+            register_analyzer(analyzer)
+        except Exception as e:
+            logger.warning(f"Could not load analyzer {entry_point.name}: {e}")
+
+
+def get_analyzers() -> List[Analyzer]:
+    global _entry_points_loaded
+    if not _entry_points_loaded:
+        _entry_points_loaded = True
+        load_entry_points()
+    return sorted(ANALYZERS.values(), key=lambda analyzer: analyzer.order)
+
+
+class PathIndex:
+    """
+    Files matched to the analyzers interested in them, in a single pass over the paths.
+
+    Basenames are dictionary lookups, suffixes a single `str.endswith` over all of
+    them, and globs a single combined regular expression; only the paths passing
+    these checks are matched against the patterns of every analyzer.
+    """
+    def __init__(self, analyzers: Iterable[Analyzer], paths: Iterable[str], sniffed: Optional[SniffedFiles] = None):
+        analyzers = list(analyzers)
+        self._matches: Dict[str, Set[str]] = {analyzer.name: set() for analyzer in analyzers}
+
+        by_basename: Dict[str, List[str]] = {}
+        by_suffix: Dict[str, List[str]] = {}
+        by_glob: List[Tuple[re.Pattern, str]] = []
+        for analyzer in analyzers:
+            for basename in analyzer.basenames:
+                by_basename.setdefault(basename, []).append(analyzer.name)
+            for suffix in analyzer.suffixes:
+                by_suffix.setdefault(suffix, []).append(analyzer.name)
+            for glob in analyzer.globs:
+                by_glob.append((re.compile(fnmatch.translate(glob)), analyzer.name))
+        suffixes = tuple(by_suffix.keys())
+        any_glob = re.compile("|".join(f"(?:{pattern.pattern})" for pattern, _ in by_glob)) if len(by_glob) else None
+
+        for path in paths:
+            basename = path.rsplit("/", 1)[-1]
+            for name in by_basename.get(basename, ()):
+                self._matches[name].add(path)
+            if len(suffixes) and path.endswith(suffixes):
+                for suffix, names in by_suffix.items():
+                    if path.endswith(suffix):
+                        for name in names:
+                            self._matches[name].add(path)
+            if any_glob is not None and any_glob.match(path):
+                for pattern, name in by_glob:
+                    if pattern.match(path):
+                        self._matches[name].add(path)
+
+        if sniffed is not None:
+            for analyzer in analyzers:
+                for kind in analyzer.kinds:
+                    self._matches[analyzer.name].update(sniffed.of(kind))
+
+    def matches(self, name: str) -> Set[str]:
+        return self._matches.get(name, set())
+
+
+for _analyzer in [
+    Analyzer("python", extract_python_dependencies, globs=("*dist-info*", "*site-packages*", "*dist-packages*"), order=10),
+    Analyzer("jar", get_jar, suffixes=(".jar",), kinds=(FileClass.ZIP,), order=20),
+    Analyzer("npm", get_package_json, suffixes=("package.json", "package-lock.json"), order=30),
+    Analyzer("composer", get_composer, globs=("*composer.lock*", "*composer.json*"), order=40),
+    Analyzer("perl", get_perl, suffixes=(".pm",), order=50),
+    Analyzer("gem", parse_gemspec, suffixes=(".gemspec",), order=60),
+    Analyzer("gomod", get_gomod, suffixes=("/go.mod",), order=70),
+    Analyzer("dpkg", get_dpkg, globs=("*var/lib/dpkg*", "*dpkg/status"), order=80),
+    Analyzer("rpm", get_rpm, suffixes=("rpmdb.sqlite",),
+             globs=("*rpm/Packages*", "*var/lib/yum*", "*var/cache/yum/*", "*etc/yum.repos.d/*", "*var/log/yum*"), order=90),
+    Analyzer("apk", get_apk, globs=("*apk/db/installed*", "*apk/world*"), order=100),
+    Analyzer("dnf", get_dnf, suffixes=("var/lib/dnf/history.sqlite",), order=110),
+    Analyzer("pkgconfig", get_pkgconfig, suffixes=(".pc",), order=120),
+]:
+    register_analyzer(_analyzer)
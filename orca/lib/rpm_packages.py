@@ -1,12 +1,19 @@
 
+import atexit
 import json
 import os
+import queue
 import re
+import shutil
 import subprocess
-from typing import Dict, List
+import threading
+import time
+from typing import Callable, Container, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from . import logger
-from .types import PackageInfo, PackageInfoType
+from .layerfs import as_layerfs
+from .rpmdb import RpmDBError, RpmHeader, iter_rpmdb
+from .types import FileGroups, PackageInfo, PackageInfoType
 
 installed_bins = {"coreutils": 
                   ["arch","base64","basename","cat","chcon","chgrp","chmod","chown","chroot","cksum","comm","cp","csplit","cut","date","dd","df","dir","dircolors","dirname","du","echo","env","expand","expr","factor","false","flock","fmt","fold","groups","head","hostid","id","install","join","link","ln","logname","ls","md5sum","mkdir","mkfifo","mknod","mktemp","mv","nice","nl","nohup","nproc","numfmt","od","paste","pathchk","pinky","pr","printenv","printf","ptx","pwd","readlink","realpath","rm","rmdir","runcon","sha1sum","shasum","sha256sum","sha384sum","sha224sum","sha512sum","seq","shred","sleep","sort","split","stat","stty","sum","sync","tac","tail","tee","test","timeout","touch","tr","true","truncate","tsort","tty","uname","unexpand","uniq","unlink","users","vdir","wc","who","whoami","yes"],
@@ -32,62 +39,212 @@ def get_author(author):
         return author.lower()
 
 
-def read_rpm_db(directory,path)->Dict[PackageInfo,List[str]]:
-    packages_dict = {}
+RPM_CHECKER = "rpm_checker"
+# Seconds rpm_checker has to answer for one database
+RPM_CHECKER_TIMEOUT = 300
+
+AMAZON_SOURCE_RPM = re.compile(r"^([a-zA-Z0-9\-_]+)-(\d+\.\d+(?:\.\d+)?)-")
+
+RpmFiles = Callable[[], List[str]]
+
+def rpm_packages(name: str, version: str, vendor: str, source_rpm: str) -> List[PackageInfo]:
+    author = get_author(vendor)
+    packages = [PackageInfo(name,version,author,PackageInfoType.RPM)]
+    if author == "amazonlinux":
+        match = AMAZON_SOURCE_RPM.match(source_rpm)
+        if match:
+            name, version = match.groups()
+            if name.startswith("python-") or name.startswith("python3-"):
+                split= version.split("-")
+                if len(split) <=1:
+                    return packages
+                pythonp = split[1]
+                packages.append(PackageInfo(pythonp,version,None,PackageInfoType.PYPI))
+            packages.append(PackageInfo(name,version,author,PackageInfoType.RPM))
+    return packages
+
+def iter_rpm_packages(directory,path) -> Iterator[Tuple[List[PackageInfo],RpmHeader]]:
+    """
+    Streams the packages of the rpmdb at `path` with the header they come from,
+    whose file list is only decoded if it is asked for.
+    """
+    for header in iter_rpmdb(directory,path):
+        yield rpm_packages(header.name,header.version,header.vendor,header.source_rpm),header
+
+def parent_directories(paths: Iterable[str]) -> Set[str]:
+    return {path.rpartition("/")[0] for path in paths}
+
+def header_files(header: RpmHeader,path: str,directories: Optional[Container[str]] = None) -> List[str]:
+    """
+    Files of the package and the database. The file list is not decoded if none of
+    the directories of the package are in `directories`: no file is left to attribute.
+    """
+    if directories is not None and header.directories and not any(directory in directories for directory in header.directories):
+        return [path]
+    try:
+        return [*header.files,path]
+    except RpmDBError as e:
+        logger.logger.warning(f"Invalid rpm header of {header.name} in {path}: {e}")
+        return [path]
+
+def read_rpm_headers(directory,path,directories: Optional[Container[str]] = None) -> Optional[Dict[PackageInfo,RpmFiles]]:
+    """
+    Packages of the rpmdb at `path`, each with a function returning its files and the database.
+    With `directories`, the parents of the files to attribute, only the file lists of the
+    packages with files in them are decoded. Databases that cannot be read in process are
+    handed to the rpm_checker helper.
+    """
+    packages_dict: Dict[PackageInfo,RpmFiles] = {}
     try:
-        # Run the rpm command with --dbpath to list installed packages from the specified database
-        result = subprocess.run(['rpm_checker', '--dbpath', os.path.join(directory,path),], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        # Check for errors
-        if result.returncode != 0:
-            print(f"Error reading RPM database: {result.stderr} - {path}")
+        for packages,header in iter_rpm_packages(directory,path):
+            for package in packages:
+                packages_dict[package] = lambda header=header: header_files(header,path,directories)
+        return packages_dict
+    except RpmDBError as e:
+        logger.logger.warning(f"Could not read rpmdb {path}, falling back to rpm_checker: {e}")
+    rows = read_rpm_checker(directory,path)
+    if rows is None:
+        return None
+    return {package: lambda files=files: files for package,files in rows.items()}
+
+def read_rpm_db(directory,path,skip: Container[PackageInfo] = (),directories: Optional[Container[str]] = None)->Optional[Dict[PackageInfo,List[str]]]:
+    """
+    Packages of the rpmdb at `path` and their files. File lists are not decoded for the packages
+    in `skip`, nor for the ones without files in `directories`.
+    """
+    headers = read_rpm_headers(directory,path,directories)
+    if headers is None:
+        return None
+    packages_dict = {}
+    for package,files in headers.items():
+        if package not in skip:
+            packages_dict[package] = files()
+    return packages_dict
+
+class RpmCheckerError(Exception):
+    pass
+
+class RpmChecker:
+    """
+    rpm_checker helper running in server mode for the whole scan. Database paths
+    are written on its stdin and the packages are read back one JSON line at a
+    time, ending with an `{"end": true}` line: one process serves every layer
+    and the package list is never held in memory as a whole on the Python side.
+    The helper itself still decodes the whole database before writing the first
+    line: go-rpmdb only lists the packages of a database all at once.
+    """
+    def __init__(self, command: Optional[List[str]] = None, timeout: float = RPM_CHECKER_TIMEOUT):
+        self.command = command if command is not None else [RPM_CHECKER, "-server"]
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.process: Optional[subprocess.Popen] = None
+        self.lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _start(self) -> subprocess.Popen:
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+            # Lines are read on a thread so that every wait for the helper can time out
+            self.lines = queue.Queue()
+            threading.Thread(target=self._read, args=(self.process.stdout, self.lines), daemon=True).start()
+        return self.process
+
+    @staticmethod
+    def _read(stdout, lines: "queue.Queue[Optional[str]]") -> None:
+        for line in stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def query(self, dbpath: str) -> Iterator[dict]:
+        """
+        Streams the packages of the database at `dbpath`. Raises `RpmCheckerError` if the
+        helper fails or does not answer within the timeout; it is restarted on the next query.
+        """
+        if "\n" in dbpath:
+            raise RpmCheckerError(f"Invalid database path {dbpath!r}")
+        with self._lock:
+            process = self._start()
+            deadline = time.monotonic() + self.timeout
+            complete = False
+            try:
+                process.stdin.write(dbpath + "\n")
+                process.stdin.flush()
+                while True:
+                    try:
+                        line = self.lines.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        raise RpmCheckerError(f"rpm_checker did not answer within {self.timeout} seconds")
+                    if line is None:
+                        raise RpmCheckerError("rpm_checker exited")
+                    item = json.loads(line)
+                    if item.get("end"):
+                        complete = True
+                        if item.get("error"):
+                            raise RpmCheckerError(item["error"])
+                        return
+                    yield item
+            except (OSError, ValueError) as e:
+                raise RpmCheckerError(f"rpm_checker failed: {e}") from e
+            finally:
+                if not complete:
+                    # The rest of the answer would be read by the next query
+                    self.close()
+
+    def close(self) -> None:
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
             return
-        
-        # Print the list of installed packages
-        packages_raw = result.stdout.splitlines()[0]
-        json_data = json.loads(packages_raw)
-    
-        for item in json_data:
-            author =  get_author(item['author'])
-
-
-
-            package = PackageInfo(item["package"],item["version"],author,PackageInfoType.RPM)
-            packages_dict[package] = [*item["files"],path]
-            if author == "amazonlinux":
-                pattern = re.compile(r"^([a-zA-Z0-9\-_]+)-(\d+\.\d+(?:\.\d+)?)-")
-                # Process each package
-                match = pattern.match(item['rpm'])
-                if match:
-                    name, version = match.groups()
-                    package = PackageInfo(name,version,author,PackageInfoType.RPM)
-                    if name.startswith("python-") or name.startswith("python3-"):
-                        split= version.split("-")
-                        if len(split) <=1:
-                            continue
-                        pythonp = split[1]
-                        ppkg = PackageInfo(pythonp,version,None,PackageInfoType.PYPI)
-                        packages_dict[ppkg] = [*item["files"],path]
+        try:
+            process.stdin.close()
+            process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+
+_rpm_checker: Optional[RpmChecker] = None
+
+def get_rpm_checker() -> RpmChecker:
+    """
+    The rpm_checker server of the process, started on first use. Worker processes start their own.
+    """
+    global _rpm_checker
+    if _rpm_checker is None or _rpm_checker.pid != os.getpid():
+        _rpm_checker = RpmChecker()
+        atexit.register(_rpm_checker.close)
+    return _rpm_checker
+
+def read_rpm_checker(directory,path)->Optional[Dict[PackageInfo,List[str]]]:
+    packages_dict = {}
+    if shutil.which(RPM_CHECKER) is None:
+        logger.logger.error(f"rpm_checker not found, cannot read RPM database {path}")
+        return None
+    try:
+        with as_layerfs(directory).materialize(path) as dbpath:
+            for item in get_rpm_checker().query(dbpath):
+                for package in rpm_packages(item["package"],item["version"],item["author"],item["rpm"]):
                     packages_dict[package] = [*item["files"],path]
-
         return packages_dict
-    
-    except Exception as e:
-        print(f"An error occurred: {e.with_traceback()}")
+    except (RpmCheckerError,KeyError) as e:
+        logger.logger.error(f"Error reading RPM database {path}: {e}")
+        return None
 
 
-def get_rpm(paths: List[str],directory: str)-> Dict[PackageInfo,List[str]]:
-    additional_files = [file for file in paths if "var/lib/yum" in file or "var/cache/yum/" in file or "etc/yum.repos.d/" in file or "var/log/yum" in file]
+def get_rpm(paths: List[str],directory,candidates: Optional[List[str]] = None)-> Dict[PackageInfo,List[str]]:
+    candidates = paths if candidates is None else candidates
+    additional_files = [file for file in candidates if "var/lib/yum" in file or "var/cache/yum/" in file or "etc/yum.repos.d/" in file or "var/log/yum" in file]
     total_packages = {}
-    for path in paths:
+    directories = None
+    for path in candidates:
         if "rpm/Packages" in path or path.endswith( "rpmdb.sqlite"):
-            packages = read_rpm_db(directory,path)
+            if directories is None:
+                # Only the packages owning some of the remaining files have their file list decoded
+                directories = parent_directories(paths)
+            # Packages found in another database of the layer already have their files
+            packages = read_rpm_db(directory,path,total_packages,directories)
             if packages and len(packages.keys()):
                 logger.logger.info(f"RPMs: {len(packages.keys())}")
-                if len(additional_files):
-                    for package in packages.keys():
-                        packages[package].extend(additional_files)
-                total_packages.update(packages)
+                for package,files in packages.items():
+                    total_packages[package] = FileGroups(files,[additional_files])
             
   
 
@@ -0,0 +1,306 @@
+import bisect
+import mmap
+import os
+import posixpath
+import sqlite3
+import struct
+import urllib.parse
+from functools import cached_property
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .layerfs import DirectoryFS, as_layerfs
+from .logger import logger
+
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_VENDOR = 1011
+RPMTAG_ARCH = 1022
+RPMTAG_OLDFILENAMES = 1027
+RPMTAG_FILEDIGESTS = 1035
+RPMTAG_FILEFLAGS = 1037
+RPMTAG_SOURCERPM = 1044
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_FILEDIGESTALGO = 5011
+
+RPMFILE_CONFIG = 1 << 0
+RPMFILE_GHOST = 1 << 6
+# OpenPGP hash algorithm ids used by RPMTAG_FILEDIGESTALGO, md5 when the tag is missing
+PGP_HASH_ALGORITHMS = {1: "md5", 2: "sha1", 8: "sha256", 9: "sha384", 10: "sha512", 11: "sha224"}
+
+RPM_INT32_TYPE = 4
+RPM_STRING_TYPE = 6
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+STRING_TYPES = (RPM_STRING_TYPE, RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE)
+# Limits of rpm's headerImport
+HEADER_MAX_TAGS = 0xffff
+HEADER_MAX_DATA = 256 * 1024 * 1024
+
+SQLITE_MAGIC = b"SQLite format 3\x00"
+# ndb (rpm >= 4.16 on SUSE): header, slot pages and 16 bytes blocks holding the blobs
+NDB_MAGIC = b"RpmP"
+NDB_SLOT_MAGIC = b"Slot"
+NDB_BLOB_MAGIC = b"BlbS"
+NDB_PAGE_SIZE = 4096
+NDB_HEADER_SIZE = 32
+NDB_SLOT_SIZE = 16
+NDB_BLOCK_SIZE = 16
+# Berkeley DB hash database: headers are stored as off-page items on overflow pages
+BDB_HASH_MAGIC = 0x061561
+BDB_PAGE_HEADER_SIZE = 26
+BDB_HASH_UNSORTED_PAGE = 2
+BDB_HASH_PAGE = 13
+BDB_OFFPAGE_ITEM = 3
+
+
+class RpmDBError(Exception):
+    pass
+
+
+class RpmHeader:
+    """
+    Header of an installed package as stored in the rpmdb. Only the tag index is
+    parsed up front; tags are decoded when they are accessed, so the file list of
+    a package is only built if it is asked for.
+    """
+    def __init__(self, blob: bytes):
+        if len(blob) < 8:
+            raise RpmDBError("Truncated header")
+        tags, size = struct.unpack_from(">II", blob)
+        if tags > HEADER_MAX_TAGS or size > HEADER_MAX_DATA or 8 + 16 * tags + size > len(blob):
+            raise RpmDBError(f"Invalid header: {tags} tags, {size} bytes of data")
+        self.blob = blob
+        self.data = 8 + 16 * tags
+        self.size = size
+        self.index: Dict[int, Tuple[int, int, int]] = {}
+        for tag, kind, offset, count in struct.iter_unpack(">IIiI", blob[8:self.data]):
+            if 0 <= offset < size:
+                self.index[tag] = (kind, offset, count)
+
+    @cached_property
+    def _offsets(self) -> List[int]:
+        return sorted(set(offset for _, offset, _ in self.index.values()) | {self.size})
+
+    def _end(self, offset: int) -> int:
+        # Data of an entry ends where the data of the next one starts
+        return self._offsets[bisect.bisect_right(self._offsets, offset)]
+
+    def strings(self, tag: int) -> List[str]:
+        entry = self.index.get(tag)
+        if entry is None or entry[0] not in STRING_TYPES:
+            return []
+        _, offset, count = entry
+        if entry[0] == RPM_STRING_TYPE:
+            count = 1
+        data = self.blob[self.data + offset:self.data + self._end(offset)]
+        return [value.decode("utf-8", errors="replace") for value in data.split(b"\x00", count)[:count]]
+
+    def string(self, tag: int) -> Optional[str]:
+        values = self.strings(tag)
+        return values[0] if len(values) else None
+
+    def int32s(self, tag: int) -> List[int]:
+        entry = self.index.get(tag)
+        if entry is None or entry[0] != RPM_INT32_TYPE or entry[1] + 4 * entry[2] > self.size:
+            return []
+        return list(struct.unpack_from(f">{entry[2]}i", self.blob, self.data + entry[1]))
+
+    @cached_property
+    def name(self) -> str:
+        return self.string(RPMTAG_NAME) or ""
+
+    @cached_property
+    def version(self) -> str:
+        return self.string(RPMTAG_VERSION) or ""
+
+    @cached_property
+    def release(self) -> str:
+        return self.string(RPMTAG_RELEASE) or ""
+
+    @cached_property
+    def epoch(self) -> Optional[int]:
+        values = self.int32s(RPMTAG_EPOCH)
+        return values[0] if len(values) else None
+
+    @cached_property
+    def arch(self) -> str:
+        return self.string(RPMTAG_ARCH) or ""
+
+    @cached_property
+    def vendor(self) -> str:
+        return self.string(RPMTAG_VENDOR) or ""
+
+    @cached_property
+    def source_rpm(self) -> str:
+        return self.string(RPMTAG_SOURCERPM) or ""
+
+    @cached_property
+    def directories(self) -> List[str]:
+        """
+        Directories of the files of the package, relative to the root and without
+        the trailing slash. Empty for headers with an old style file list.
+        """
+        directories = []
+        for dirname in self.strings(RPMTAG_DIRNAMES):
+            if "//" in dirname or "/." in dirname:
+                dirname = posixpath.normpath(dirname)
+            directories.append(dirname.strip("/"))
+        return directories
+
+    @cached_property
+    def files(self) -> List[str]:
+        """
+        Paths of the files of the package, relative to the root of the filesystem.
+        """
+        basenames = self.strings(RPMTAG_BASENAMES)
+        dirnames = self.strings(RPMTAG_DIRNAMES)
+        indexes = self.int32s(RPMTAG_DIRINDEXES)
+        if len(basenames) == 0 or len(dirnames) == 0 or len(indexes) == 0:
+            return [path.lstrip("/") for path in self.strings(RPMTAG_OLDFILENAMES)]
+        if len(indexes) != len(basenames) or len(dirnames) > len(basenames):
+            raise RpmDBError(f"Invalid file list of {self.name}")
+        files = []
+        for index, basename in zip(indexes, basenames):
+            path = dirnames[index] + basename if 0 <= index < len(dirnames) else basename
+            if "//" in path or "/." in path or path.endswith("/"):
+                path = posixpath.normpath(path)
+            files.append(path[1:])
+        return files
+
+    @cached_property
+    def digest_algorithm(self) -> Optional[str]:
+        values = self.int32s(RPMTAG_FILEDIGESTALGO)
+        return PGP_HASH_ALGORITHMS.get(values[0] if len(values) else 1)
+
+    def file_digests(self) -> List[Tuple[str, str]]:
+        """
+        Path and hex digest of the regular files of the package. Config files,
+        expected to be edited, and ghost files, not shipped, are left out.
+        """
+        digests = self.strings(RPMTAG_FILEDIGESTS)
+        files = self.files
+        if len(digests) != len(files):
+            return []
+        flags = self.int32s(RPMTAG_FILEFLAGS)
+        if len(flags) != len(files):
+            flags = [0] * len(files)
+        return [(path, digest) for path, digest, flag in zip(files, digests, flags)
+                if digest and not flag & (RPMFILE_CONFIG | RPMFILE_GHOST)]
+
+
+def iter_sqlite(path: str) -> Iterator[bytes]:
+    # The layer is read only and its write ahead log, if any, is not part of the database
+    connection = sqlite3.connect(f"file:{urllib.parse.quote(path)}?immutable=1", uri=True)
+    try:
+        for (blob,) in connection.execute("SELECT blob FROM Packages ORDER BY hnum"):
+            yield blob
+    except sqlite3.Error as e:
+        raise RpmDBError(f"Invalid sqlite rpmdb: {e}") from e
+    finally:
+        connection.close()
+
+
+def iter_ndb(data) -> Iterator[bytes]:
+    if len(data) < NDB_HEADER_SIZE or data[:4] != NDB_MAGIC:
+        raise RpmDBError("Not an ndb rpmdb")
+    version, _, slot_pages = struct.unpack_from("<III", data, 4)
+    if version != 0 or slot_pages == 0 or slot_pages * NDB_PAGE_SIZE > len(data):
+        raise RpmDBError(f"Unsupported ndb rpmdb: version {version}, {slot_pages} slot pages")
+    for slot in range(NDB_HEADER_SIZE, slot_pages * NDB_PAGE_SIZE, NDB_SLOT_SIZE):
+        magic, index, block, _ = struct.unpack_from("<4sIII", data, slot)
+        if magic != NDB_SLOT_MAGIC:
+            raise RpmDBError(f"Bad ndb slot at {slot}")
+        if block == 0:
+            continue
+        start = block * NDB_BLOCK_SIZE
+        if start + 16 > len(data):
+            raise RpmDBError(f"ndb blob of package {index} out of the file")
+        magic, blob_index, _, length = struct.unpack_from("<4sIII", data, start)
+        if magic != NDB_BLOB_MAGIC or blob_index != index or start + 16 + length > len(data):
+            raise RpmDBError(f"Bad ndb blob of package {index}")
+        yield data[start + 16:start + 16 + length]
+
+
+def iter_bdb(data) -> Iterator[bytes]:
+    if len(data) < 64:
+        raise RpmDBError("Not a Berkeley DB rpmdb")
+    for order in ("<", ">"):
+        if struct.unpack_from(order + "I", data, 12)[0] == BDB_HASH_MAGIC:
+            break
+    else:
+        raise RpmDBError("Not a Berkeley DB hash database")
+    page_size, = struct.unpack_from(order + "I", data, 20)
+    last_page, = struct.unpack_from(order + "I", data, 32)
+    if data[24] != 0:
+        raise RpmDBError("Encrypted Berkeley DB database")
+    if page_size < 512 or page_size & (page_size - 1):
+        raise RpmDBError(f"Invalid Berkeley DB page size {page_size}")
+    for page_number in range(1, min(last_page, len(data) // page_size - 1) + 1):
+        page = page_number * page_size
+        if data[page + 25] not in (BDB_HASH_UNSORTED_PAGE, BDB_HASH_PAGE):
+            continue
+        entries, = struct.unpack_from(order + "H", data, page + 20)
+        if BDB_PAGE_HEADER_SIZE + 2 * entries > page_size:
+            raise RpmDBError(f"Invalid hash page {page_number}")
+        offsets = struct.unpack_from(f"{order}{entries}H", data, page + BDB_PAGE_HEADER_SIZE)
+        # Keys and values alternate, values are the headers
+        for offset in offsets[1::2]:
+            if offset + 12 > page_size or data[page + offset] != BDB_OFFPAGE_ITEM:
+                continue
+            overflow, length = struct.unpack_from(order + "II", data, page + offset + 4)
+            yield bdb_overflow(data, order, page_size, overflow, length)
+
+
+def bdb_overflow(data, order: str, page_size: int, page_number: int, length: int) -> bytes:
+    chunks = []
+    read = 0
+    seen = set()
+    while page_number != 0 and read < length:
+        page = page_number * page_size
+        if page_number in seen or page + page_size > len(data):
+            raise RpmDBError(f"Invalid overflow page {page_number}")
+        seen.add(page_number)
+        next_page, = struct.unpack_from(order + "I", data, page + 16)
+        used, = struct.unpack_from(order + "H", data, page + 22)
+        end = page + page_size if next_page != 0 else page + BDB_PAGE_HEADER_SIZE + used
+        chunks.append(data[page + BDB_PAGE_HEADER_SIZE:end])
+        read += end - page - BDB_PAGE_HEADER_SIZE
+        page_number = next_page
+    return b"".join(chunks)[:length]
+
+
+def _iter_blobs(fs, path: str) -> Iterator[bytes]:
+    with fs.open(path, "rb") as fp:
+        magic = fp.read(len(SQLITE_MAGIC))
+        if magic != SQLITE_MAGIC:
+            backend = iter_ndb if magic.startswith(NDB_MAGIC) else iter_bdb
+            if isinstance(fs, DirectoryFS) and os.fstat(fp.fileno()).st_size > 0:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    yield from backend(data)
+            else:
+                fp.seek(0)
+                yield from backend(fp.read())
+            return
+    with fs.materialize(path) as dbpath:
+        yield from iter_sqlite(dbpath)
+
+
+def iter_rpmdb(directory, path: str) -> Iterator[RpmHeader]:
+    """
+    Streams the headers of the packages installed in the rpmdb at `path`: a
+    sqlite (`rpmdb.sqlite`), ndb (`Packages.db`) or Berkeley DB (`Packages`)
+    database. Raises `RpmDBError` if the database cannot be read.
+    """
+    fs = as_layerfs(directory)
+    try:
+        for blob in _iter_blobs(fs, path):
+            try:
+                yield RpmHeader(blob)
+            except RpmDBError as e:
+                logger.debug(f"Skipping rpm header in {path}: {e}")
+    except (OSError, ValueError, IndexError, struct.error, sqlite3.Error) as e:
+        raise RpmDBError(f"Could not read {path}: {e}") from e
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Tuple
+
+from .logger import logger
+from .types import PackageInfo
+
+SIGNATURES_FILE = os.path.join(os.path.dirname(__file__), "signatures.json")
+SELF_VERSION = rb" (v?[0-9]+\.[0-9]+\.[0-9]+)"
+
+
+@dataclass
+class Signature:
+    """
+    Fingerprint of a library or tool embedded in binaries.
+
+    `pattern` is a bytes regex whose first group is the version; it starts with
+    `literal`, which is what the scanner looks for before trying the regex.
+    Patterns only match printable characters (`[ -~]` instead of `.`), like the
+    strings of a binary.
+    """
+    id: str
+    product: str
+    vendor: Optional[str]
+    literal: bytes
+    regex: Pattern[bytes]
+
+    def package(self, version: bytes) -> PackageInfo:
+        return PackageInfo(self.product, version.decode("ascii"), self.vendor, None)
+
+
+def load_signatures(path: str = SIGNATURES_FILE) -> List[Signature]:
+    """
+    Reads a JSON list of signatures with `id`, `product`, `vendor`, `literal` and
+    `pattern` keys. Invalid entries are skipped with a warning.
+    """
+    with open(path) as fp:
+        entries = json.load(fp)
+    signatures = []
+    for entry in entries:
+        try:
+            regex = re.compile(entry["pattern"].encode())
+            if regex.groups < 1 or len(entry["literal"]) == 0:
+                raise ValueError("a literal and a version group are required")
+            signatures.append(Signature(entry["id"], entry["product"], entry.get("vendor"), entry["literal"].encode(), regex))
+        except (KeyError, ValueError, re.error) as e:
+            logger.warning(f"Skipping binary signature {entry.get('id')} of {path}: {e}")
+    return signatures
+
+
+class SignatureScanner:
+    """
+    Finds the signatures in the bytes of a binary in a single pass.
+
+    The literals of all the signatures are combined in one alternation used as
+    a prefilter; the version regex of a signature is only tried, anchored, where
+    its literal was found. Adding signatures grows the alternation rather than
+    the number of passes over the file.
+    """
+    def __init__(self, signatures: Iterable[Signature]):
+        self.signatures = list(signatures)
+        literals = sorted({signature.literal for signature in self.signatures}, key=len, reverse=True)
+        # A hit on a literal also starts every signature whose literal is a prefix of it
+        self.candidates: Dict[bytes, List[Signature]] = {
+            literal: [signature for signature in self.signatures if literal.startswith(signature.literal)]
+            for literal in literals
+        }
+        self.prefilter = re.compile(b"|".join(re.escape(literal) for literal in literals)) if literals else None
+        # Identifies the signature set, for results cached across scans
+        self.fingerprint = hashlib.sha256(b"\n".join(
+            f"{s.id}|{s.product}|{s.vendor}".encode() + b"|" + s.literal + b"|" + s.regex.pattern for s in self.signatures)).hexdigest()[:16]
+
+    def scan(self, data, ranges: Optional[Sequence[Tuple[int, int]]] = None, binary_name: Optional[str] = None,
+             deadline: Optional[float] = None) -> List[PackageInfo]:
+        """
+        Packages of the signatures found in `data` (bytes or mmap), restricted to
+        the `(start, end)` ranges if given; the first match of every signature
+        wins. With `binary_name`, also looks for the name followed by a version.
+        Past the `time.monotonic()` `deadline`, the scan stops with what was found.
+        """
+        ranges = ranges if ranges is not None else [(0, len(data))]
+
+        def expired() -> bool:
+            return deadline is not None and time.monotonic() > deadline
+
+        found: Dict[str, PackageInfo] = {}
+        if self.prefilter is not None:
+            for start, end in ranges:
+                pos = start
+                while len(found) < len(self.signatures) and not expired():
+                    hit = self.prefilter.search(data, pos, end)
+                    if hit is None:
+                        break
+                    for signature in self.candidates[hit.group()]:
+                        if signature.id not in found:
+                            match = signature.regex.match(data, hit.start(), end)
+                            if match:
+                                found[signature.id] = signature.package(match.group(1))
+                    pos = hit.start() + 1
+        # Signatures of the same product may report the same version
+        packages = list(dict.fromkeys(found[signature.id] for signature in self.signatures if signature.id in found))
+
+        if expired():
+            logger.warning(f"Time budget exceeded while scanning {binary_name}, results may be incomplete")
+        elif binary_name is not None and len(binary_name) > 1:
+            regex = re.compile(re.escape(binary_name.encode()) + SELF_VERSION)
+            for start, end in ranges:
+                match = regex.search(data, start, end)
+                if match:
+                    packages.append(PackageInfo(binary_name, match.group(1).decode("ascii"), None, None))
+                    break
+        return packages
+
+
+@lru_cache(maxsize=None)
+def default_scanner() -> SignatureScanner:
+    return SignatureScanner(load_signatures())
@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Iterable, List, Optional
+
+from .elf import ELFCache, ELFError
+from .layerfs import LayerFS, as_layerfs
+from .logger import logger
+
+HEAD_SIZE = 64
+BATCH_SIZE = 256
+SNIFF_WORKERS = 8
+
+# Content of these files is never routed to an analyzer by its bytes
+SKIP_EXTENSIONS = (".h", ".c", ".cc", ".hpp", ".xml", ".html", ".htm", ".png", ".jpg", ".jpeg", ".gif", ".svg",
+                   ".ico", ".csv", ".js", ".ts", ".css", ".map", ".md", ".rst", ".txt", ".json", ".yaml", ".yml",
+                   ".py", ".pyc", ".pyi", ".rb", ".pl", ".pm", ".php", ".go", ".java", ".class", ".mo", ".po",
+                   ".pem", ".crt", ".gpg", ".ttf", ".woff", ".woff2", ".list", ".md5sums")
+
+
+class FileClass(Enum):
+    ELF = "elf"
+    ZIP = "zip"
+    GZIP = "gzip"
+    ZSTD = "zstd"
+    SCRIPT = "script"
+    TEXT = "text"
+    OTHER = "other"
+
+
+@dataclass
+class SniffResult:
+    path: str
+    kind: FileClass
+    dynamic: bool = False
+    go: bool = False
+
+
+def classify(head: bytes) -> FileClass:
+    if head.startswith(b"\x7fELF"):
+        return FileClass.ELF
+    if head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06"):
+        return FileClass.ZIP
+    if head.startswith(b"\x1f\x8b"):
+        return FileClass.GZIP
+    if head.startswith(b"\x28\xb5\x2f\xfd"):
+        return FileClass.ZSTD
+    if head.startswith(b"#!"):
+        return FileClass.SCRIPT
+    # The head may cut a multi-byte character at its end
+    if len(head) and b"\x00" not in head and (_is_text(head) or _is_text(head[:-3])):
+        return FileClass.TEXT
+    return FileClass.OTHER
+
+
+def _is_text(data: bytes) -> bool:
+    try:
+        data.decode("utf-8")
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def sniff_file(fs: LayerFS, path: str, elves: Optional[ELFCache] = None) -> SniffResult:
+    """
+    Classifies `path` by its first bytes. The headers of ELF files are parsed
+    into `elves` to know whether they are dynamically linked or built by Go.
+    """
+    elves = elves if elves is not None else ELFCache(fs)
+    try:
+        with fs.open(path, "rb") as fp:
+            head = fp.read(HEAD_SIZE)
+            kind = classify(head)
+            if kind != FileClass.ELF:
+                return SniffResult(path, kind)
+            try:
+                with elves.open(path, fp) as elf:
+                    return SniffResult(path, kind, elf.is_dynamic, elf.is_go)
+            except ELFError:
+                return SniffResult(path, kind)
+    except Exception as e:
+        logger.debug(f"Could not sniff {path}: {e}")
+        return SniffResult(path, FileClass.OTHER)
+
+
+def is_candidate(fs: LayerFS, path: str) -> bool:
+    if path.lower().endswith(SKIP_EXTENSIONS):
+        return False
+    entry = fs.index().get(path)
+    return entry is not None and entry.is_regular and not entry.is_link and entry.size > 0
+
+
+class SniffedFiles:
+    """
+    Files of a layer grouped by content class, so every analyzer only gets the
+    files it can handle, whatever their name.
+    """
+    def __init__(self, results: Iterable[SniffResult], elves: Optional[ELFCache] = None):
+        self.results: Dict[str, SniffResult] = {result.path: result for result in results}
+        # ELF headers parsed while sniffing, reused by the binary analyzers
+        self.elves = elves
+
+    def of(self, kind: FileClass) -> List[str]:
+        return [path for path, result in self.results.items() if result.kind == kind]
+
+    def elf(self, go: Optional[bool] = None, dynamic: Optional[bool] = None) -> List[str]:
+        return [path for path, result in self.results.items()
+                if result.kind == FileClass.ELF
+                and (go is None or result.go == go)
+                and (dynamic is None or result.dynamic == dynamic)]
+
+    def kind(self, path: str) -> Optional[FileClass]:
+        result = self.results.get(path)
+        return result.kind if result is not None else None
+
+
+def sniff_files(directory, paths: Iterable[str], workers: int = SNIFF_WORKERS) -> SniffedFiles:
+    """
+    Reads the first bytes of every candidate file once. Folders are read in
+    batches on a thread pool; archive-backed layers share a single file handle,
+    so their members are read in archive order instead.
+    """
+    fs = as_layerfs(directory)
+    elves = ELFCache(fs)
+    candidates = sorted(path for path in paths if is_candidate(fs, path))
+    if not fs.concurrent_reads:
+        members = getattr(fs, "members", {})
+        candidates.sort(key=lambda path: getattr(members.get(path), "offset_data", 0))
+        return SniffedFiles((sniff_file(fs, path, elves) for path in candidates), elves)
+
+    def sniff_batch(batch: List[str]) -> List[SniffResult]:
+        return [sniff_file(fs, path, elves) for path in batch]
+
+    batches = [candidates[idx:idx + BATCH_SIZE] for idx in range(0, len(candidates), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+        results = [result for batch in executor.map(sniff_batch, batches) for result in batch]
+    return SniffedFiles(results, elves)
@@ -5,6 +5,7 @@ from spdx_tools.spdx.model import (Document,CreationInfo,Package,SpdxNone,Actor,
 from spdx_tools.spdx.writer.write_anything import write_file
 import base64
 from.types import PackageInfo, PackageInfoType, VulnerabilityReport
+from .logger import logger
 from packageurl import PackageURL
 
 
@@ -119,6 +120,7 @@ def generateFileMappingReport(reportMap: Dict[str,VulnerabilityReport])-> Dict[s
     filemap: Dict[str,File] = dict()
     for layer,report in reportMap.items():
         layer_id = layer.split("/")[-1]
+        folders = {file.rpartition("/")[0] for file in report.initial_files}
         
         for file in report.initial_files:
             fid = file.replace("/","-").replace("_","").replace(" ","")
@@ -126,9 +128,18 @@ def generateFileMappingReport(reportMap: Dict[str,VulnerabilityReport])-> Dict[s
             if sid in filemap:
                 filemap[sid].comment += f"\n Layer: {layer_id}"
             else:
-                checksum = Checksum(ChecksumAlgorithm.SHA1,hashlib.sha1("testme".encode()).hexdigest())
+                digests = report.digests.get(file)
+                if digests is not None:
+                    checksums = [Checksum(ChecksumAlgorithm.SHA1,digests.sha1.hex()),Checksum(ChecksumAlgorithm.SHA256,digests.sha256.hex())]
+                elif file in folders:
+                    # Folders have no content, SPDX still requires a SHA1
+                    checksums = [Checksum(ChecksumAlgorithm.SHA1,hashlib.sha1(b"").hexdigest())]
+                else:
+                    # Links and files that could not be read have no checksum to report
+                    logger.debug(f"No checksum for {file} in layer {layer_id}, not listed")
+                    continue
                
-                filemap[sid] = File(name=file,spdx_id=sid,comment=f"Layer: {layer}",checksums=[checksum])
+                filemap[sid] = File(name=file,spdx_id=sid,comment=f"Layer: {layer}",checksums=checksums)
     return filemap
     
 
@@ -1,12 +1,13 @@
+import io
 import os
 import pytest
 from unittest.mock import patch
-from orca.lib.apk import get_apk, read_apk_db, read_world_file
+from orca.lib.apk import get_apk, iter_apk_db, parse_apk_db, read_apk_db, read_world_file
 from orca.lib.types import PackageInfo, PackageInfoType
 
 
 class TestApk:
-    @patch("orca.lib.apk.open", create=True)
+    @patch("orca.lib.layerfs.open", create=True)
     def test_read_apk_db(self, mock_open):
         # Mock the file content
         file_content = """P:test_package
@@ -19,7 +20,7 @@ V:4.5.6
 F:usr/bin
 R:executable
 """
-        mock_open.return_value.read.return_value = file_content
+        mock_open.return_value.__iter__.return_value = iter(file_content.splitlines(True))
         mock_open.return_value.__enter__.return_value = mock_open.return_value
 
         # Call the function
@@ -36,10 +37,28 @@ R:executable
         )
         assert expected_package1 in result
         assert expected_package2 in result
-        assert result[expected_package1] == {"lib/test.so", "actual_path"}
-        assert result[expected_package2] == {"usr/bin/executable", "actual_path"}
-
-    @patch("orca.lib.apk.open", create=True)
+        assert set(result[expected_package1]) == {"lib/test.so", "actual_path"}
+        assert set(result[expected_package2]) == {"usr/bin/executable", "actual_path"}
+
+    def test_parse_apk_db_records(self):
+        content = ("C:Q1abc=\nP:busybox\nV:1.36.1-r5\nA:x86_64\no:busybox\nR:.keep\n"
+                   "F:bin\nR:busybox\na:0:0:755\nZ:Q1oCSbEl9C4YbW3gCwvvpbIN8LZrM=\n"
+                   "F:usr/share/my docs\nR:read me.txt\nZ:Q2qZBqkPpUa9m6Cq6HWOQiGKeyxTwMoyIpxM1GXtU+QpE=\nR:empty\n\n"
+                   "P:musl\nV:1.2.4-r2\nA:x86_64\no:musl\nF:bin\nR:ldd\n")
+        packages = list(iter_apk_db(io.StringIO(content)))
+        busybox, musl = packages
+        assert (busybox.name, busybox.version, busybox.arch, busybox.origin) == ("busybox", "1.36.1-r5", "x86_64", "busybox")
+        # Directories are shared between packages
+        assert busybox.directories[1].path is musl.directories[0].path
+
+        result = parse_apk_db(content, "lib/apk/db/installed")
+        files = result[busybox.info()]
+        assert list(files) == [".keep", "bin/busybox", "usr/share/my docs/read me.txt", "usr/share/my docs/empty", "lib/apk/db/installed"]
+        assert files.checksums() == {"bin/busybox": "Q1oCSbEl9C4YbW3gCwvvpbIN8LZrM=",
+                                     "usr/share/my docs/read me.txt": "Q2qZBqkPpUa9m6Cq6HWOQiGKeyxTwMoyIpxM1GXtU+QpE="}
+        assert files.groups[0] is result[musl.info()].groups[0]
+
+    @patch("orca.lib.layerfs.open", create=True)
     def test_read_world_file(self, mock_open):
         # Mock the file content
         file_content = "package1\npackage2\n"
@@ -1,7 +1,17 @@
+import io
+import json
 import os
+import re
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 from unittest.mock import patch
-from orca.lib import bin_checkers
+from orca.lib import bin_checkers, filecache
+from orca.lib.elf import printable_strings
+from orca.lib.filecache import FileCache
+from orca.lib.layerfs import TarLayerFS
+from orca.lib.signatures import SignatureScanner, default_scanner, load_signatures
 from orca.lib.types import PackageInfo
 
 def test_check_gcc():
@@ -103,6 +113,116 @@ def test_extract_strings():
     # Clean up the dummy file
     os.remove("test_file.txt")
 
+def test_signature_scanner():
+    scanner = default_scanner()
+    data = (b"\x00\x01GCC: (Debian 12.2.0-14) 12.2.0\x00GCC: (GNU) 11.1.0\x00"
+            b"\x7fELF OpenSSL\x003.0.0\x02OpenSSL 3.0.11 19 Sep 2023\x00g++ 12.2.0\x00")
+    assert scanner.scan(data, binary_name="g++") == [
+        PackageInfo("gcc", "12.2.0", "gnu", None),
+        PackageInfo("openssl", "3.0.11", "openssl", None),
+        PackageInfo("g++", "12.2.0", None, None),
+    ]
+    # Only the given ranges are scanned
+    start = data.index(b"OpenSSL 3")
+    assert scanner.scan(data, [(start, len(data))]) == [PackageInfo("openssl", "3.0.11", "openssl", None)]
+
+def test_load_signatures(tmp_path):
+    path = tmp_path / "signatures.json"
+    path.write_text(json.dumps([
+        {"id": "curl", "product": "curl", "vendor": "haxx", "literal": "libcurl/", "pattern": "libcurl/([0-9]+\\.[0-9]+\\.[0-9]+)"},
+        {"id": "broken", "product": "broken", "literal": "broken", "pattern": "broken"},
+    ]))
+    signatures = load_signatures(str(path))
+    assert [signature.id for signature in signatures] == ["curl"]
+    assert SignatureScanner(signatures).scan(b"\x00libcurl/8.4.0 OpenSSL/3.0.11") == [PackageInfo("curl", "8.4.0", "haxx", None)]
+
+def test_signatures_match_like_legacy_regexes():
+    # The former regexes used \s on printable strings, where a space is the only whitespace
+    legacy = [("gcc", "gnu", rb"GCC:\s\(.*\)\s([0-9]+\.[0-9]+\.[0-9]+)"), ("gcc", "gnu", rb"gcc\s([0-9]+\.[0-9]+\.[0-9]+)"),
+              ("openssl", "openssl", rb".*OpenSSL\s([0-9]+\.[0-9]+\.[0-9]+)"), ("zlib", "zlib", rb"inflate\s\(.*\)\s([0-9]+\.[0-9]+\.[0-9]+)"),
+              ("postgresql", "postgresql", rb".*\(PostgreSQL\)\s([0-9]+\.[0-9]+\.[0-9]+)")]
+    samples = [b"GCC: (GNU) 7.5.0", b"GCC:\t(GNU) 7.5.0", b"GCC: (GNU)\n7.5.0", b"gcc\t12.2.0", b"gcc  12.2.0",
+               b"OpenSSL\x0b3.0.11", b"OpenSSL 3.0.11", b"inflate (1.2.13 Copyright) 1.2.13", b"inflate\r(x) 1.2.13",
+               b"postgres (PostgreSQL) 15.4", b"(PostgreSQL)\x0c15.4"]
+    for data in samples:
+        strings = [string.encode() for string in printable_strings(data)]
+        expected = set()
+        for product, vendor, pattern in legacy:
+            match = next((match for match in map(re.compile(pattern).search, strings) if match), None)
+            if match:
+                expected.add(PackageInfo(product, match.group(1).decode(), vendor, None))
+        assert set(default_scanner().scan(b"\x00" + data + b"\x00")) == expected, data
+
+def test_limit_ranges():
+    assert bin_checkers.limit_ranges([(0, 10), (20, 40), (50, 60)], 25) == [(0, 10), (20, 35)]
+    assert bin_checkers.limit_ranges([(0, 10)], 0) == []
+
+def test_check_binaries_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(bin_checkers, "POOL_MIN_BINARIES", 2)
+    (tmp_path / "tool").write_bytes(b"\x00tool 1.0.0\x00OpenSSL 3.0.11 19 Sep 2023\x00")
+    (tmp_path / "lib.so").write_bytes(b"\x01OpenSSL 3.0.11\x00")
+    (tmp_path / "empty").write_bytes(b"")
+    expected = {
+        PackageInfo("openssl", "3.0.11", "openssl", None): ["tool", "lib.so"],
+        PackageInfo("tool", "1.0.0", None, None): ["tool"],
+    }
+    executables = ["tool", "lib.so", "empty"]
+    assert bin_checkers.check_binaries(str(tmp_path), executables, workers=2) == expected
+    assert bin_checkers.check_binaries(str(tmp_path), executables, workers=1) == expected
+    # Nothing is scanned past the time budget, and such results are not cached
+    monkeypatch.setattr(filecache, "_file_cache", FileCache())
+    assert bin_checkers.check_binaries(str(tmp_path), executables, workers=1, time_budget=-1) == {}
+    assert bin_checkers.check_binaries(str(tmp_path), executables, workers=1) == expected
+
+def test_binary_pool_shared():
+    pool = bin_checkers.get_binary_pool(2)
+    try:
+        # Every layer of the scan uses the same worker processes
+        assert bin_checkers.get_binary_pool(2) is pool
+    finally:
+        bin_checkers.close_binary_pool()
+
+class CountingExecutor(ThreadPoolExecutor):
+    """
+    Thread pool recording the most tasks submitted and not finished at once.
+    """
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+
+    def submit(self, fn, *args):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        def run():
+            try:
+                return fn(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+        return super().submit(run)
+
+def test_check_binaries_pending_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(bin_checkers, "POOL_MIN_BINARIES", 2)
+    monkeypatch.setattr(filecache, "_file_cache", FileCache())
+    content = b"\x00OpenSSL 3.0.11 19 Sep 2023\x00" * 64
+    with tarfile.open(tmp_path / "layer.tar", "w") as tar:
+        for idx in range(6):
+            info = tarfile.TarInfo(f"bin/tool{idx}")
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    fs = TarLayerFS(tarfile.open(tmp_path / "layer.tar"))
+    executables = [f"bin/tool{idx}" for idx in range(6)]
+    # Room for the content of a single binary: the others are read once it is scanned
+    monkeypatch.setattr(bin_checkers, "MAX_PENDING_SIZE", len(content))
+    executor = CountingExecutor()
+    with executor:
+        results = bin_checkers.check_binaries(fs, executables, workers=4, pool=executor)
+    assert results == {PackageInfo("openssl", "3.0.11", "openssl", None): executables}
+    assert executor.most == 1
+
 # Test for check_binaries
 @pytest.mark.skip(reason="no way to test this functionality yet")
 def test_check_binaries():
@@ -0,0 +1,136 @@
+import io
+import tarfile
+
+from orca.find_cpes import scan_filesystem
+from orca.lib.delta import PackageState, ParagraphDigests
+from orca.lib.dpkg import iter_dpkg_fields
+from orca.lib.layerfs import TarLayerFS
+from orca.lib.types import LayerAction, PackageInfo, PackageInfoType
+
+BASE_STATUS = """Package: zlib1g
+Status: install ok installed
+Architecture: amd64
+Version: 1:1.2.13.dfsg-1
+
+Package: libssl3
+Status: install ok installed
+Architecture: amd64
+Version: 3.0.11-1
+
+"""
+
+UPPER_STATUS = """Package: zlib1g
+Status: install ok installed
+Architecture: amd64
+Version: 1:1.2.13.dfsg-1
+
+Package: libssl3
+Status: install ok installed
+Architecture: amd64
+Version: 3.0.13-1
+
+Package: curl
+Status: install ok installed
+Architecture: amd64
+Version: 7.88.1-10
+
+"""
+
+def build_layer(tmp_path, name, files, mtime=0):
+    path = tmp_path / f"{name}.tar"
+    with tarfile.open(path, "w") as tar:
+        for file, content in files.items():
+            info = tarfile.TarInfo(file)
+            info.size = len(content)
+            info.mtime = mtime
+            tar.addfile(info, io.BytesIO(content))
+    layer = tarfile.open(path)
+    return TarLayerFS(layer, name), layer.getnames()
+
+def test_paragraph_digests():
+    lines = ParagraphDigests(io.StringIO(UPPER_STATUS))
+    digests = {fields["Package"]: lines.last for fields in iter_dpkg_fields(lines)}
+    assert len(set(digests.values())) == 3
+    # Blank lines around a paragraph are not part of its fingerprint
+    lines = ParagraphDigests(io.StringIO("\n\n" + UPPER_STATUS.rstrip("\n").replace("\n\n", "\n \n\n")))
+    assert {fields["Package"]: lines.last for fields in iter_dpkg_fields(lines)} == digests
+    assert list(iter_dpkg_fields(ParagraphDigests(["\n", "\n"]))) == []
+
+def test_incremental_dpkg(tmp_path):
+    state = PackageState()
+    base, base_files = build_layer(tmp_path, "base", {
+        "var/lib/dpkg/status": BASE_STATUS.encode(),
+        "var/lib/dpkg/info/zlib1g:amd64.list": b"/usr/lib/libz.so.1\n",
+        "usr/lib/libz.so.1": b"zlib",
+        "app/package.json": b'{"name": "app", "version": "1.0.0"}',
+    })
+    upper, upper_files = build_layer(tmp_path, "upper", {
+        "var/lib/dpkg/status": UPPER_STATUS.encode(),
+        "var/lib/dpkg/info/curl:amd64.list": b"/usr/bin/curl\n",
+        "usr/bin/curl": b"curl",
+        # Same content as in the lower layer, e.g. a chown in a RUN instruction
+        "app/package.json": b'{"name": "app", "version": "1.0.0"}',
+    })
+
+    base_report = scan_filesystem(base, base_files, package_state=state)
+    assert set(p.name for p in base_report.packages) == {"zlib1g", "libssl3", "app"}
+    assert all(record.action == LayerAction.ADDED for record in base_report.package_changes.values())
+
+    upper_report = scan_filesystem(upper, upper_files, package_state=state)
+    names = set(p.name for p in upper_report.packages)
+    assert names == {"curl", "libssl3"}
+    curl = PackageInfo("curl", "7.88.1-10", None, PackageInfoType.DEBIAN, "amd64")
+    assert "usr/bin/curl" in upper_report.package_files[curl]
+    changes = {(p.name, p.version): record.action for p, record in upper_report.package_changes.items()}
+    assert changes == {
+        ("curl", "7.88.1-10"): LayerAction.ADDED,
+        ("libssl3", "3.0.13-1"): LayerAction.REPLACED,
+        ("libssl3", "3.0.11-1"): LayerAction.DELETED,
+    }
+    # The unchanged file is accounted for in the report of the lower layer
+    assert "app/package.json" in upper_report.initial_files
+    assert "app/package.json" not in upper_report.remaining_files
+    assert "app/package.json" in base_report.analyzed_files
+
+def test_incremental_removal(tmp_path):
+    state = PackageState()
+    base, base_files = build_layer(tmp_path, "base", {"var/lib/dpkg/status": UPPER_STATUS.encode()})
+    upper, upper_files = build_layer(tmp_path, "upper", {"var/lib/dpkg/status": BASE_STATUS.encode()}, mtime=1)
+    scan_filesystem(base, base_files, package_state=state)
+    upper_report = scan_filesystem(upper, upper_files, package_state=state)
+    assert set(p.name for p in upper_report.packages) == {"libssl3"}
+    deleted = [p.name for p, record in upper_report.package_changes.items() if record.action == LayerAction.DELETED]
+    assert sorted(deleted) == ["curl", "libssl3"]
+    assert all(record.layer == "upper" for record in upper_report.package_changes.values())
+
+def test_incremental_apk(tmp_path):
+    state = PackageState()
+    base_db = b"P:musl\nV:1.2.4-r2\nF:lib\nR:libc.musl-x86_64.so.1\n\n"
+    upper_db = base_db + b"P:curl\nV:8.5.0-r0\nF:usr/bin\nR:curl\n\n"
+    base, base_files = build_layer(tmp_path, "base", {"lib/apk/db/installed": base_db})
+    upper, upper_files = build_layer(tmp_path, "upper", {"lib/apk/db/installed": upper_db, "usr/bin/curl": b"curl"})
+    scan_filesystem(base, base_files, package_state=state)
+    upper_report = scan_filesystem(upper, upper_files, package_state=state)
+    assert [p.name for p in upper_report.packages] == ["curl"]
+    assert "usr/bin/curl" in upper_report.analyzed_files
+
+def test_incremental_same_size_and_mtime(tmp_path):
+    state = PackageState()
+    # Rebuilt with a normalised mtime: only the content tells the files apart
+    base, base_files = build_layer(tmp_path, "base", {"app/package.json": b'{"name": "app", "version": "1.0.0"}'})
+    upper, upper_files = build_layer(tmp_path, "upper", {"app/package.json": b'{"name": "app", "version": "2.0.0"}'})
+    scan_filesystem(base, base_files, package_state=state)
+    upper_report = scan_filesystem(upper, upper_files, package_state=state)
+    assert [(p.name, p.version) for p in upper_report.packages] == [("app", "2.0.0")]
+
+def test_incremental_whiteout_readded(tmp_path):
+    state = PackageState()
+    package_json = b'{"name": "app", "version": "1.0.0"}'
+    base, base_files = build_layer(tmp_path, "base", {"app/package.json": package_json, "lib/libz.so.1": b"zlib"})
+    deleted, deleted_files = build_layer(tmp_path, "deleted", {".wh.app": b"", "lib/.wh..wh..opq": b""})
+    readded, readded_files = build_layer(tmp_path, "readded", {"app/package.json": package_json, "lib/libz.so.1": b"zlib"})
+    for layer, files in ((base, base_files), (deleted, deleted_files)):
+        scan_filesystem(layer, files, package_state=state)
+    readded_report = scan_filesystem(readded, readded_files, package_state=state)
+    assert [p.name for p in readded_report.packages] == ["app"]
+    assert "lib/libz.so.1" in readded_report.remaining_files
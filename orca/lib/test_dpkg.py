@@ -0,0 +1,96 @@
+import io
+import time
+
+import pytest
+
+from .dpkg import DpkgFormatError, dpkg_info_index, get_dpkg, iter_dpkg_fields, parse_deb822_paragraphs, parse_dpkg_paragraphs
+from .layerfs import DirectoryFS
+from .types import FileGroups, PackageInfo, PackageInfoType, VulnerabilityReport
+
+
+def status_paragraph(idx: int) -> str:
+    return (f"Package: python3-lib{idx}\n"
+            "Status: install ok installed\n"
+            "Priority: optional\n"
+            f"Architecture: {'all' if idx % 2 else 'amd64'}\n"
+            f"Source: lib{idx} (1:{idx}.0-1)\n"
+            f"Version: 1:{idx}.0-1\n"
+            f"Depends: libc6 (>= 2.34), lib{idx}-common\n"
+            f"Description: library number {idx}\n"
+            " Long description of the library,\n"
+            " .\n"
+            " on several lines.\n")
+
+
+def status_file(count: int) -> str:
+    return "\n".join(status_paragraph(idx) for idx in range(count))
+
+
+def test_streaming_parser_matches_deb822():
+    content = "# comment\n\n" + status_file(3) + "\n \nPackage: tzdata\r\nVersion: 2024a-0\r\nArchitecture: all\r\n"
+    packages = parse_dpkg_paragraphs(io.StringIO(content))
+    assert packages == parse_deb822_paragraphs(io.StringIO(content))
+    assert packages[:3] == [
+        PackageInfo("python3-lib0", "0.0-1", None, PackageInfoType.DEBIAN, "amd64", "1"),
+        PackageInfo("lib0", "0.0-1", None, PackageInfoType.PYPI, "amd64", "1"),
+        PackageInfo("lib0", "0.0-1", None, PackageInfoType.DEBIAN, "amd64", "1"),
+    ]
+    assert packages[-1] == PackageInfo("tzdata", "2024a-0", None, PackageInfoType.DEBIAN, "all", None)
+
+
+def test_malformed_status_falls_back_to_deb822():
+    content = "Package: tzdata\nnot a field\nVersion: 2024a-0\nArchitecture: all\n"
+    with pytest.raises(DpkgFormatError):
+        list(iter_dpkg_fields(content.splitlines()))
+    assert parse_dpkg_paragraphs(io.StringIO(content)) == parse_deb822_paragraphs(io.StringIO(content))
+    assert parse_dpkg_paragraphs(content.splitlines())[0].name == "tzdata"
+
+
+def test_streaming_parser_benchmark():
+    content = status_file(2000)
+    timings = {}
+    for parser in (parse_deb822_paragraphs, parse_dpkg_paragraphs):
+        start = time.perf_counter()
+        packages = parser(io.StringIO(content))
+        timings[parser.__name__] = time.perf_counter() - start
+        assert len(packages) == 6000
+    print(timings)
+    assert timings["parse_dpkg_paragraphs"] < timings["parse_deb822_paragraphs"]
+
+
+def test_dpkg_info_index(tmp_path):
+    files = {
+        "var/lib/dpkg/status": ("Package: libc6\nVersion: 2.36-9\nArchitecture: amd64\n\n"
+                                "Package: libc6\nVersion: 2.36-9\nArchitecture: i386\n\n"
+                                "Package: tzdata\nVersion: 2024a-0\nArchitecture: all\n"),
+        "var/lib/dpkg/info/libc6:amd64.list": "/usr/lib/x86_64-linux-gnu/libc.so.6\n",
+        "var/lib/dpkg/info/libc6:amd64.md5sums": "",
+        "var/lib/dpkg/info/libc6:i386.list": "/usr/lib/i386-linux-gnu/libc.so.6\n",
+        "var/lib/dpkg/info/tzdata.list": "/usr/share/zoneinfo/UTC\n",
+        "var/lib/dpkg/info/tzdata.postinst": "",
+        "usr/lib/x86_64-linux-gnu/libc.so.6": "",
+        "usr/lib/i386-linux-gnu/libc.so.6": "",
+        "usr/share/zoneinfo/UTC": "",
+    }
+    for path, content in files.items():
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(content)
+    fs = DirectoryFS(str(tmp_path))
+    paths = fs.list()
+    index = dpkg_info_index(paths)
+    assert index["libc6"] == {"amd64": ["var/lib/dpkg/info/libc6:amd64.list", "var/lib/dpkg/info/libc6:amd64.md5sums"],
+                              "i386": ["var/lib/dpkg/info/libc6:i386.list"]}
+
+    packages = get_dpkg(paths, fs)
+    by_arch = {package.arch: files for package, files in packages.items()}
+    assert "usr/lib/i386-linux-gnu/libc.so.6" in by_arch["i386"]
+    assert "usr/lib/i386-linux-gnu/libc.so.6" not in by_arch["amd64"]
+    assert "var/lib/dpkg/info/tzdata.postinst" in by_arch["all"]
+    # The database files are one group shared by every package
+    groups = [files.groups for files in packages.values()]
+    assert all(isinstance(files, FileGroups) for files in packages.values())
+    assert all(group[0] is groups[0][0] for group in groups)
+
+    report = VulnerabilityReport(set(files))
+    report.add_package_files(packages)
+    assert len(report.remaining_files) == 0
@@ -0,0 +1,70 @@
+import struct
+
+import pytest
+
+from .elf import DT_NEEDED, DT_SONAME, DT_STRTAB, DT_VERNEED, DT_VERNEEDNUM, NT_GNU_BUILD_ID, ELFCache, ELFError
+from .test_golang import BASE, build_elf
+
+
+def build_dynamic_elf() -> bytes:
+    """
+    64 bits ELF library without section headers: one loadable segment holding
+    the dynamic string table, the version needs and the dynamic entries, and
+    a note segment with the build-id.
+    """
+    dynstr = b"\x00libc.so.6\x00libdemo.so.1\x00GLIBC_2.34\x00GLIBC_2.2.5\x00"
+    strtab = 0x100
+    verneed = strtab + len(dynstr) + 7 & ~7
+    needs = (struct.pack("<HHIII", 1, 2, 1, 16, 0)
+             + struct.pack("<IHHII", 0, 0, 2, 24, 16)
+             + struct.pack("<IHHII", 0, 0, 3, 35, 0))
+    dynamic_offset = verneed + len(needs)
+    entries = [(DT_NEEDED, 1), (DT_SONAME, 11), (DT_STRTAB, BASE + strtab),
+               (DT_VERNEED, BASE + verneed), (DT_VERNEEDNUM, 1), (0, 0)]
+    dynamic = b"".join(struct.pack("<qQ", tag, value) for tag, value in entries)
+    note_offset = dynamic_offset + len(dynamic)
+    note = struct.pack("<III", 4, 4, NT_GNU_BUILD_ID) + b"GNU\x00" + b"\xde\xad\xbe\xef"
+    total = note_offset + len(note)
+
+    ident = b"\x7fELF" + bytes([2, 1, 1]) + b"\x00" * 9
+    header = ident + struct.pack("<HHIQQQIHHHHHH", 3, 62, 1, 0, 64, 0, 0, 64, 56, 3, 64, 0, 0)
+    program = (struct.pack("<IIQQQQQQ", 1, 4, 0, BASE, BASE, total, total, 0x1000)
+               + struct.pack("<IIQQQQQQ", 2, 6, dynamic_offset, BASE + dynamic_offset, 0, len(dynamic), len(dynamic), 8)
+               + struct.pack("<IIQQQQQQ", 4, 4, note_offset, BASE + note_offset, 0, len(note), len(note), 4))
+    content = header + program
+    content += b"\x00" * (strtab - len(content)) + dynstr
+    content += b"\x00" * (verneed - len(content)) + needs
+    return content + dynamic + note
+
+
+def test_dynamic_metadata(tmp_path):
+    (tmp_path / "libdemo.so.1").write_bytes(build_dynamic_elf())
+    elves = ELFCache(str(tmp_path))
+    with elves.open("libdemo.so.1") as elf:
+        assert elf.sections == {}
+        assert elf.is_dynamic and not elf.is_go
+        assert elf.needed == ["libc.so.6"]
+        assert elf.soname == "libdemo.so.1"
+        assert elf.version_needs == {"libc.so.6": ["GLIBC_2.34", "GLIBC_2.2.5"]}
+        assert elf.build_id == "deadbeef"
+
+    # Parsed metadata outlives the file, the same model is handed out again
+    elf = elves.get("libdemo.so.1")
+    assert elf.soname == "libdemo.so.1"
+    with elves.open("libdemo.so.1") as again:
+        assert again is elf
+
+
+def test_section_ranges(tmp_path):
+    payload = b"\x00\x01version 1.2.3\x00ab\x00"
+    (tmp_path / "app").write_bytes(build_elf(lambda _: payload))
+    (tmp_path / "notes").write_bytes(b"tool 2.0.0\n")
+    elves = ELFCache(str(tmp_path))
+    with elves.open("app") as elf:
+        [(start, end)] = elf.section_ranges([".go.buildinfo", ".rodata"])
+        assert elf.read(start, end - start) == payload
+        assert elf.comment == []
+
+    with pytest.raises(ELFError):
+        with elves.open("notes"):
+            pass
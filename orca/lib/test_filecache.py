@@ -0,0 +1,89 @@
+import io
+import pickle
+import tarfile
+
+from .filecache import QUICK_HASH_SIZE, FileCache
+from .layerfs import TarLayerFS
+
+
+def counting(result):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return result
+    return compute, calls
+
+
+def test_identical_files_analyzed_once(tmp_path):
+    (tmp_path / "a").write_bytes(b"same content")
+    (tmp_path / "b").write_bytes(b"same content")
+    (tmp_path / "c").write_bytes(b"other content")
+    cache = FileCache()
+    compute, calls = counting(["pkg"])
+    for name in ("a", "b", "c"):
+        assert cache.get_or_compute(str(tmp_path / name), "test", compute) == ["pkg"]
+    assert len(calls) == 2
+    assert cache.stats() == {"hits": 1, "misses": 2}
+    # Results of another analyzer or context are separate
+    cache.get_or_compute(str(tmp_path / "a"), "test", compute, context="name")
+    assert len(calls) == 3
+
+
+def test_large_files_prefilter(tmp_path):
+    head, tail = b"h" * QUICK_HASH_SIZE, b"t" * QUICK_HASH_SIZE
+    (tmp_path / "a").write_bytes(head + b"middle-1" + tail)
+    (tmp_path / "b").write_bytes(head + b"middle-2" + tail)
+    (tmp_path / "c").write_bytes(head + b"middle-1" + tail)
+    cache = FileCache()
+    first = cache.probe(str(tmp_path / "a"), "test")
+    assert first.digest is None and not first.found
+    cache.store(first, 1)
+    # Same size, head and tail: the whole content decides
+    second = cache.probe(str(tmp_path / "b"), "test")
+    assert second.digest is not None and not second.found
+    cache.store(second, 2)
+    assert cache.get_or_compute(str(tmp_path / "c"), "test", lambda: 3) == 1
+
+
+def test_persistent_cache(tmp_path):
+    db = str(tmp_path / "cache" / "files.sqlite")
+    (tmp_path / "lib.so").write_bytes(b"\x7fELF" + b"x" * 1000)
+    cache = FileCache(db)
+    cache.get_or_compute(str(tmp_path / "lib.so"), "binary", lambda: ["openssl"])
+    cache.close()
+
+    # A new process, e.g. a worker, only shares the database
+    other = pickle.loads(pickle.dumps(FileCache(db)))
+    compute, calls = counting(["other"])
+    assert other.get_or_compute(str(tmp_path / "lib.so"), "binary", compute) == ["openssl"]
+    assert len(calls) == 0
+
+
+def test_eviction(tmp_path):
+    cache = FileCache(str(tmp_path / "files.sqlite"), max_size=1)
+    for idx in range(3):
+        (tmp_path / f"f{idx}").write_bytes(f"content {idx}".encode())
+        cache.get_or_compute(str(tmp_path / f"f{idx}"), "test", lambda: idx)
+    cache.evict()
+    assert cache._db().execute("SELECT COUNT(*) FROM results").fetchone()[0] == 0
+    # Served from memory for the rest of the process
+    assert cache.get_or_compute(str(tmp_path / "f0"), "test", lambda: -1) == 0
+
+
+def test_known_digests_not_read_again(tmp_path):
+    content = b"x" * (3 * QUICK_HASH_SIZE)
+    with tarfile.open(tmp_path / "layer.tar", "w") as tar:
+        for name in ("a", "b"):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    fs = TarLayerFS(tarfile.open(tmp_path / "layer.tar"))
+    fs.hash_files()
+    cache = FileCache()
+    probe = cache.probe(fs.join("a"), "test")
+    assert probe.digest == fs.digest("a").sha256.hex() and probe.quick == ""
+    cache.store(probe, 1)
+    # Known digests: the content of the file is not opened
+    fs._extract = None
+    assert cache.get_or_compute(fs.join("b"), "test", lambda: 2) == 1
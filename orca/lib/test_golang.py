@@ -0,0 +1,140 @@
+import os
+import shutil
+import struct
+import sys
+
+import pytest
+
+from ..find_cpes import scan_filesystem
+from .elf import GO_BUILDINFO_MAGIC, GO_BUILDINFO_SEARCH_SIZE, open_elf
+from .golang import extract_dependency, extract_go_dependencies, read_buildinfo
+from .types import PackageInfo, PackageInfoType
+
+GO_BINARY = shutil.which("go") or "/usr/local/go/bin/go"
+BASE = 0x400000
+
+MODINFO = (
+    "path\texample.com/app\n"
+    "mod\texample.com/app\t(devel)\t\n"
+    "dep\tgithub.com/pkg/errors\tv0.9.1\th1:abc=\n"
+    "build\t-ldflags=\"-X example.com/app/version.Version=1.4.2\"\n"
+)
+
+
+def uvarint(value: int) -> bytes:
+    out = b""
+    while value >= 0x80:
+        out += bytes([value & 0x7f | 0x80])
+        value >>= 7
+    return out + bytes([value])
+
+
+def wrap(modinfo: str) -> bytes:
+    return b"\x30" * 16 + modinfo.encode() + b"\xf9" * 16
+
+
+def build_elf(payload, is64=True, big_endian=False, sections=True) -> bytes:
+    """
+    Minimal ELF file with one loadable segment and the payload in a `.go.buildinfo`
+    section. `payload` is called with the virtual address of the section.
+    """
+    e = ">" if big_endian else "<"
+    ehsize, phentsize, shentsize = (64, 56, 64) if is64 else (52, 32, 40)
+    data_offset = (ehsize + phentsize + 15) // 16 * 16
+    data = payload(BASE + data_offset)
+    shstrtab = b"\x00.go.buildinfo\x00.shstrtab\x00"
+    shstr_offset = data_offset + len(data)
+    shoff = shstr_offset + len(shstrtab)
+    total = shoff + 3 * shentsize
+
+    ident = b"\x7fELF" + bytes([2 if is64 else 1, 2 if big_endian else 1, 1]) + b"\x00" * 9
+    header_format = e + ("HHIQQQIHHHHHH" if is64 else "HHIIIIIHHHHHH")
+    header = ident + struct.pack(header_format, 2, 62, 1, BASE, ehsize, shoff if sections else 0, 0,
+                                 ehsize, phentsize, 1, shentsize, 3 if sections else 0, 2 if sections else 0)
+    if is64:
+        program = struct.pack(e + "IIQQQQQQ", 1, 6, 0, BASE, BASE, total, total, 0x1000)
+    else:
+        program = struct.pack(e + "IIIIIIII", 1, 0, BASE, BASE, total, total, 6, 0x1000)
+    section_format = e + ("IIQQQQIIQQ" if is64 else "IIIIIIIIII")
+    section_headers = (struct.pack(section_format, *[0] * 10)
+                       + struct.pack(section_format, 1, 1, 3, BASE + data_offset, data_offset, len(data), 0, 0, 16, 0)
+                       + struct.pack(section_format, 15, 3, 0, 0, shstr_offset, len(shstrtab), 0, 0, 1, 0))
+    content = header + program
+    content += b"\x00" * (data_offset - len(content))
+    return content + data + shstrtab + section_headers
+
+
+def inline_buildinfo(version: str, modinfo: str):
+    def payload(_):
+        header = GO_BUILDINFO_MAGIC + bytes([8, 2]) + b"\x00" * 16
+        return header + uvarint(len(version)) + version.encode() + uvarint(len(wrap(modinfo))) + wrap(modinfo)
+    return payload
+
+
+def pointer_buildinfo(version: str, modinfo: str):
+    # Go < 1.18: 32 bits big endian pointers to Go string headers
+    def payload(vaddr):
+        mod = wrap(modinfo)
+        header = GO_BUILDINFO_MAGIC + bytes([4, 1]) + struct.pack(">II", vaddr + 32, vaddr + 40) + b"\x00" * 8
+        strings = struct.pack(">II", vaddr + 48, len(version)) + struct.pack(">II", vaddr + 48 + len(version), len(mod))
+        return header + strings + version.encode() + mod
+    return payload
+
+
+def test_read_inline_buildinfo(tmp_path):
+    (tmp_path / "app").write_bytes(build_elf(inline_buildinfo("go1.21.6", MODINFO)))
+    with open_elf(str(tmp_path), "app") as elf:
+        assert read_buildinfo(elf) == ("go1.21.6", MODINFO)
+
+    packages = extract_dependency("app", str(tmp_path))
+    assert packages == [
+        PackageInfo("stdlib", "1.21.6", None, PackageInfoType.GOLANG),
+        PackageInfo("example.com/app", "(devel)", None, PackageInfoType.GOLANG),
+        PackageInfo("github.com/pkg/errors", "v0.9.1", None, PackageInfoType.GOLANG),
+        PackageInfo("example.com/app", "1.4.2\"", None, PackageInfoType.GOLANG),
+    ]
+
+
+def test_read_large_inline_buildinfo(tmp_path):
+    # The module list runs past the 64KB searched for the header
+    deps = "".join(f"dep\tgithub.com/example/module{idx:05}\tv1.0.{idx}\th1:abc=\n" for idx in range(2000))
+    modinfo = "path\texample.com/app\nmod\texample.com/app\t(devel)\t\n" + deps
+    assert len(modinfo) > GO_BUILDINFO_SEARCH_SIZE
+    (tmp_path / "app").write_bytes(build_elf(inline_buildinfo("go1.22.1", modinfo)))
+    with open_elf(str(tmp_path), "app") as elf:
+        assert read_buildinfo(elf) == ("go1.22.1", modinfo)
+    packages = extract_dependency("app", str(tmp_path))
+    assert len(packages) == 2002 and packages[-1] == PackageInfo("github.com/example/module01999", "v1.0.1999", None, PackageInfoType.GOLANG)
+
+
+def test_read_pointer_buildinfo_without_sections(tmp_path):
+    (tmp_path / "app").write_bytes(build_elf(pointer_buildinfo("go1.16.15", MODINFO), is64=False, big_endian=True, sections=False))
+    with open_elf(str(tmp_path), "app") as elf:
+        assert elf.sections == {}
+        assert read_buildinfo(elf) == ("go1.16.15", MODINFO)
+
+
+def test_go_binary_without_sections(tmp_path):
+    (tmp_path / "app").write_bytes(build_elf(inline_buildinfo("go1.22.1", MODINFO), sections=False))
+    (tmp_path / "other").write_bytes(build_elf(lambda _: b"\x00" * 64, sections=False))
+    with open_elf(str(tmp_path), "app") as elf:
+        assert elf.sections == {} and elf.is_go
+    with open_elf(str(tmp_path), "other") as elf:
+        assert not elf.is_go
+    # Sniffed as Go, so the binary reaches the build info reader
+    report = scan_filesystem(str(tmp_path), ["app", "other"])
+    assert PackageInfo("stdlib", "1.22.1", None, PackageInfoType.GOLANG) in report.packages
+    assert "app" in report.analyzed_files and "other" in report.remaining_files
+
+def test_not_go_binary(tmp_path):
+    shutil.copy(sys.executable, tmp_path / "python")
+    (tmp_path / "script").write_text("#!/bin/sh\n")
+    assert extract_go_dependencies(["python", "script", "missing"], str(tmp_path)) == {}
+
+
+@pytest.mark.skipif(not os.path.exists(GO_BINARY), reason="go toolchain not available")
+def test_go_toolchain_binary(tmp_path):
+    shutil.copy(GO_BINARY, tmp_path / "go")
+    packages = extract_go_dependencies(["go"], str(tmp_path))
+    stdlib = [package for package in packages if package.name == "stdlib"]
+    assert len(stdlib) == 1 and stdlib[0].version[0].isdigit()
@@ -0,0 +1,75 @@
+import hashlib
+import io
+import json
+import tarfile
+
+import pytest
+
+from orca.lib.imagestream import IterStream, iter_layers, resolve_link
+
+
+def add_file(tar: tarfile.TarFile, name: str, content: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tar.addfile(info, io.BytesIO(content))
+
+def add_symlink(tar: tarfile.TarFile, name: str, target: str):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    tar.addfile(info)
+
+def build_layer(files) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            add_file(tar, name, content)
+    return buffer.getvalue()
+
+@pytest.fixture
+def archive():
+    layer = build_layer({"etc/os-release": b'NAME="Alpine Linux"\n'})
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        add_file(tar, "aaa/layer.tar", layer)
+        add_file(tar, "aaa/VERSION", b"1.0")
+        add_symlink(tar, "bbb/layer.tar", "../aaa/layer.tar")
+        add_file(tar, "config.json", b'{"history": []}')
+        add_file(tar, "manifest.json", json.dumps([{"Config": "config.json", "Layers": ["aaa/layer.tar", "bbb/layer.tar"]}]).encode())
+    return buffer.getvalue(), layer
+
+def test_iter_stream_reads_chunks():
+    stream = io.BufferedReader(IterStream([b"ab", b"", b"cde", b"f"]))
+    assert stream.read(4) == b"abcd"
+    assert stream.read() == b"ef"
+    assert stream.read() == b""
+
+def test_iter_stream_propagates_errors():
+    def chunks():
+        yield b"abc"
+        raise IOError("connection reset")
+    stream = io.BufferedReader(IterStream(chunks()))
+    with pytest.raises(IOError):
+        stream.read()
+
+def test_iter_layers(archive):
+    data, layer = archive
+    metadata, links = {}, {}
+    layers = []
+    for name, fp, digest in iter_layers(IterStream([data[i:i + 1000] for i in range(0, len(data), 1000)]), metadata, links):
+        assert fp.read() == layer
+        layers.append((name, digest))
+    assert layers == [("aaa/layer.tar", f"sha256:{hashlib.sha256(layer).hexdigest()}")]
+    assert set(metadata.keys()) == {"config.json", "manifest.json"}
+    assert resolve_link("bbb/layer.tar", links) == "aaa/layer.tar"
+
+def test_iter_layers_skip(archive):
+    data, _ = archive
+    metadata, links = {}, {}
+    assert list(iter_layers(io.BytesIO(data), metadata, links, lambda name: False)) == []
+    assert "manifest.json" in metadata
+
+def test_resolve_link_parent():
+    links = {"bbb": "aaa", "aaa/layer.tar": "ccc/layer.tar"}
+    assert resolve_link("bbb/layer.tar", links) == "ccc/layer.tar"
+    assert resolve_link("ddd/layer.tar", links) == "ddd/layer.tar"
@@ -0,0 +1,68 @@
+import os
+import time
+
+from orca.lib.layercache import LayerCache, layer_digests
+from orca.lib.types import PackageInfo, PackageInfoType, VulnerabilityReport
+
+
+def make_report(name: str) -> VulnerabilityReport:
+    report = VulnerabilityReport({f"usr/lib/{name}.so"})
+    report.add_package_files({PackageInfo(name, "1.0", None, PackageInfoType.DEBIAN): [f"usr/lib/{name}.so"]})
+    return report
+
+def test_layer_digests_from_blobs():
+    layers = ["blobs/sha256/abcd", "blobs/sha256/ef01"]
+    assert layer_digests(layers, {}) == ["sha256:abcd", "sha256:ef01"]
+
+def test_layer_digests_from_diff_ids():
+    layers = ["1234/layer.tar", "5678/layer.tar"]
+    config = {"rootfs": {"diff_ids": ["sha256:aa", "sha256:bb"]}}
+    assert layer_digests(layers, config) == ["sha256:aa", "sha256:bb"]
+    assert layer_digests(layers, {"rootfs": {"diff_ids": ["sha256:aa"]}}) == [None, None]
+
+def test_cache_roundtrip(tmp_path):
+    cache = LayerCache(str(tmp_path))
+    assert cache.get("sha256:aa", binary_analysis=False) is None
+    cache.put("sha256:aa", make_report("zlib"), binary_analysis=False)
+
+    report = cache.get("sha256:aa", binary_analysis=False)
+    assert report is not None
+    assert report.packages == [PackageInfo("zlib", "1.0", None, PackageInfoType.DEBIAN)]
+    assert report.remaining_files == set()
+    # Different analysis options are different entries
+    assert cache.get("sha256:aa", binary_analysis=True) is None
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+def test_cache_without_digest(tmp_path):
+    cache = LayerCache(str(tmp_path))
+    cache.put(None, make_report("zlib"))
+    assert cache.get(None) is None
+    assert os.listdir(cache.directory) == []
+
+def test_cache_corrupted_entry(tmp_path):
+    cache = LayerCache(str(tmp_path))
+    cache.put("sha256:aa", make_report("zlib"))
+    entry = os.path.join(cache.directory, os.listdir(cache.directory)[0])
+    with open(entry, "wb") as fp:
+        fp.write(b"garbage")
+    assert cache.get("sha256:aa") is None
+    assert not os.path.exists(entry)
+
+def test_cache_lru_eviction(tmp_path):
+    cache = LayerCache(str(tmp_path))
+    cache.put("sha256:aa", make_report("a"))
+    entry_size = os.path.getsize(os.path.join(cache.directory, os.listdir(cache.directory)[0]))
+    cache.max_size = entry_size * 2 + entry_size // 2
+
+    cache.put("sha256:bb", make_report("b"))
+    past = time.time() - 100
+    for name in os.listdir(cache.directory):
+        os.utime(os.path.join(cache.directory, name), (past, past))
+    # A hit refreshes the entry, so "bb" becomes the least recently used
+    assert cache.get("sha256:aa") is not None
+    cache.put("sha256:cc", make_report("c"))
+
+    assert len(os.listdir(cache.directory)) == 2
+    assert cache.get("sha256:bb") is None
+    assert cache.get("sha256:aa") is not None
+    assert cache.get("sha256:cc") is not None
@@ -0,0 +1,188 @@
+import hashlib
+import io
+import os
+import tarfile
+
+import pytest
+from spdx_tools.spdx.validation.file_validator import validate_file
+
+from orca.find_cpes import scan_filesystem
+from orca.lib.layerfs import DirectoryFS, LayerPath, MergedLayerFS, TarLayerFS, as_layerfs, open_file
+from orca.lib.spdx import generateFileMappingReport
+from orca.lib.types import LayerAction, PackageInfo, PackageInfoType
+
+DPKG_STATUS = """Package: zlib1g
+Status: install ok installed
+Architecture: amd64
+Version: 1:1.2.13.dfsg-1
+
+"""
+
+def add_file(tar: tarfile.TarFile, name: str, content: bytes, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    info.mode = mode
+    tar.addfile(info, io.BytesIO(content))
+
+def add_symlink(tar: tarfile.TarFile, name: str, target: str):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    tar.addfile(info)
+
+@pytest.fixture
+def layer_tar(tmp_path):
+    path = tmp_path / "layer.tar"
+    with tarfile.open(path, "w") as tar:
+        add_file(tar, "var/lib/dpkg/status", DPKG_STATUS.encode())
+        add_file(tar, "var/lib/dpkg/info/zlib1g:amd64.list", b"/usr/lib/libz.so.1\n")
+        add_file(tar, "usr/lib/libz.so.1", b"\x7fELF" + b"\x00" * 60)
+        add_file(tar, "usr/bin/tool", b"\x7fELF" + b"\x00" * 60, mode=0o755)
+        add_file(tar, "./etc/os-release", b'NAME="Debian GNU/Linux"\nVERSION_ID="12"\n')
+        add_file(tar, "etc/ssl/certs/ca.pem", b"cert")
+        add_symlink(tar, "usr/lib/libz.so", "libz.so.1")
+    return path
+
+def test_tar_layerfs_list(layer_tar):
+    fs = TarLayerFS(tarfile.open(layer_tar))
+    paths = fs.list()
+    assert "usr/lib/libz.so.1" in paths
+    assert "etc/os-release" in paths
+    assert "usr/lib" in paths
+    assert "etc/ssl/certs/ca.pem" not in paths
+    assert "usr/lib/libz.so" not in paths  # links are not regular files
+
+def test_tar_layerfs_read(layer_tar):
+    fs = TarLayerFS(tarfile.open(layer_tar))
+    assert fs.open("etc/os-release").read().startswith("NAME=")
+    assert fs.read("usr/lib/libz.so", 4) == b"\x7fELF"
+    assert fs.realpath("usr/lib/libz.so") == "usr/lib/libz.so.1"
+    assert fs.is_executable("usr/bin/tool")
+    assert not fs.is_executable("usr/lib/libz.so.1")
+    assert fs.isdir("var/lib/dpkg")
+    assert fs.size("usr/bin/tool") == 64
+    with pytest.raises(FileNotFoundError):
+        fs.open("does/not/exist")
+
+def test_tar_layerfs_join(layer_tar):
+    fs = TarLayerFS(tarfile.open(layer_tar))
+    handle = fs.join("var/lib/dpkg/status")
+    assert isinstance(handle, LayerPath)
+    assert "zlib1g" in open_file(handle).read()
+
+def test_tar_layerfs_materialize(layer_tar):
+    fs = TarLayerFS(tarfile.open(layer_tar))
+    with fs.materialize("etc/os-release") as real_path:
+        assert os.path.isfile(real_path)
+        assert open(real_path).read().startswith("NAME=")
+    assert not os.path.exists(real_path)
+
+def test_as_layerfs(tmp_path):
+    fs = as_layerfs(str(tmp_path))
+    assert isinstance(fs, DirectoryFS)
+    assert as_layerfs(fs) is fs
+
+def test_scan_tar_matches_extracted(layer_tar, tmp_path):
+    extracted = tmp_path / "extracted"
+    with tarfile.open(layer_tar) as tar:
+        tar.extractall(extracted, filter=lambda member, path: member if member.isreg() else None)
+        names = tar.getnames()
+
+    from_disk = scan_filesystem(str(extracted), names)
+    from_tar = scan_filesystem(TarLayerFS(tarfile.open(layer_tar)), names)
+
+    package = PackageInfo("zlib1g", "1.2.13.dfsg-1", None, PackageInfoType.DEBIAN, "amd64", "1")
+    assert package in from_tar.packages
+    assert set(from_tar.packages) == set(from_disk.packages)
+    # glob also returns the root folder itself, as an empty relative path
+    assert from_tar.initial_files == from_disk.initial_files - {""}
+    assert from_tar.remaining_files == from_disk.remaining_files - {""}
+    assert from_tar.os == from_disk.os
+
+def add_dir(tar: tarfile.TarFile, name: str):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    tar.addfile(info)
+
+def open_layer(tmp_path, name, build):
+    path = tmp_path / f"{name}.tar"
+    with tarfile.open(path, "w") as tar:
+        build(tar)
+    return name, TarLayerFS(tarfile.open(path), name)
+
+@pytest.fixture
+def merged_fs(tmp_path):
+    def base(tar):
+        add_file(tar, "etc/os-release", b'NAME="Debian GNU/Linux"\n')
+        add_file(tar, "tmp/build/big.o", b"object")
+        add_file(tar, "opt/app/old.py", b"old")
+        add_file(tar, "usr/bin/tool", b"v1", mode=0o755)
+        add_file(tar, "var/cache/apt/pkgcache.bin", b"cache")
+    def upper(tar):
+        add_file(tar, ".wh.tmp", b"")
+        add_dir(tar, "opt/app")
+        add_file(tar, "opt/app/.wh..wh..opq", b"")
+        add_file(tar, "opt/app/new.py", b"new")
+        add_file(tar, "usr/bin/tool", b"v2", mode=0o755)
+        add_file(tar, "var/cache/apt/.wh.pkgcache.bin", b"")
+    def top(tar):
+        add_file(tar, "tmp/build/big.o", b"rebuilt")
+        add_symlink(tar, "usr/bin/tool-link", "tool")
+    return MergedLayerFS([open_layer(tmp_path, "base", base), open_layer(tmp_path, "upper", upper),
+                          open_layer(tmp_path, "top", top)])
+
+def test_merged_layerfs_whiteouts(merged_fs):
+    files = set(path for path, member in merged_fs.members.items() if member.isreg())
+    assert files == {"etc/os-release", "tmp/build/big.o", "opt/app/new.py", "usr/bin/tool"}
+    assert merged_fs.layer_of("etc/os-release") == "base"
+    assert merged_fs.layer_of("usr/bin/tool") == "upper"
+    assert merged_fs.layer_of("tmp/build/big.o") == "top"
+    assert merged_fs.read("usr/bin/tool-link") == b"v2"
+    assert merged_fs.open("tmp/build/big.o").read() == "rebuilt"
+    assert not merged_fs.exists("opt/app/old.py")
+
+def test_merged_layerfs_history(merged_fs):
+    def actions(path):
+        return [(record.action, record.layer) for record in merged_fs.history[path]]
+    assert actions("usr/bin/tool") == [(LayerAction.ADDED, "base"), (LayerAction.REPLACED, "upper")]
+    assert actions("var/cache/apt/pkgcache.bin") == [(LayerAction.ADDED, "base"), (LayerAction.DELETED, "upper")]
+    assert actions("tmp/build/big.o") == [(LayerAction.ADDED, "base"), (LayerAction.DELETED, "upper"), (LayerAction.ADDED, "top")]
+    assert actions("opt/app/old.py") == [(LayerAction.ADDED, "base"), (LayerAction.DELETED, "upper")]
+
+def test_merged_layerfs_hash_files(merged_fs):
+    # Members are hashed while the layers are indexed: no content is read afterwards
+    merged_fs._extract = None
+    merged_fs.hash_files()
+    digests = merged_fs.digests()
+    assert set(digests) == {"etc/os-release", "tmp/build/big.o", "opt/app/new.py", "usr/bin/tool"}
+    tool = merged_fs.digest("usr/bin/tool")
+    assert (tool.sha1, tool.sha256, tool.size) == (hashlib.sha1(b"v2").digest(), hashlib.sha256(b"v2").digest(), 2)
+
+def test_tar_layerfs_hard_link_digests(tmp_path):
+    def build(tar):
+        add_file(tar, "usr/bin/python3.11", b"interpreter")
+        info = tarfile.TarInfo("usr/bin/python3")
+        info.type = tarfile.LNKTYPE
+        info.linkname = "usr/bin/python3.11"
+        tar.addfile(info)
+    _, fs = open_layer(tmp_path, "layer", build)
+    fs.hash_files()
+    assert fs.digest("usr/bin/python3") is fs.digest("usr/bin/python3.11")
+    assert fs.digest("usr/bin/python3").sha256 == hashlib.sha256(b"interpreter").digest()
+
+def test_hash_file_stores_digests(tmp_path):
+    (tmp_path / "tool").write_bytes(b"v2")
+    fs = DirectoryFS(str(tmp_path))
+    tool = fs.hash_file("tool")
+    assert tool.sha256 == hashlib.sha256(b"v2").digest()
+    # The file is not read again
+    (tmp_path / "tool").unlink()
+    assert fs.hash_file("tool") is tool and fs.digests() == {"tool": tool}
+
+def test_spdx_file_checksums(merged_fs):
+    report = scan_filesystem(merged_fs, list(merged_fs.members.keys()))
+    files = {file.name: file for file in generateFileMappingReport({"layer": report}).values()}
+    assert [checksum.value for checksum in files["usr/bin/tool"].checksums] == [hashlib.sha1(b"v2").hexdigest(), hashlib.sha256(b"v2").hexdigest()]
+    assert [checksum.value for checksum in files["usr/bin"].checksums] == [hashlib.sha1(b"").hexdigest()]
+    assert all(validate_file(file, "SPDX-2.3") == [] for file in files.values())
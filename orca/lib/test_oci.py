@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+
+import pytest
+import zstandard
+
+from orca.lib.oci import OCIError, OCILayout, decompress, decompress_layers, is_oci_layout, iter_decompressed, read_image
+
+
+def build_layer(files) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+def write_blob(root, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()
+    os.makedirs(os.path.join(root, "blobs", "sha256"), exist_ok=True)
+    with open(os.path.join(root, "blobs", "sha256", digest), "wb") as fp:
+        fp.write(content)
+    return f"sha256:{digest}"
+
+def write_json_blob(root, content) -> dict:
+    data = json.dumps(content).encode()
+    return {"digest": write_blob(root, data), "size": len(data)}
+
+def write_image(root, layers, arch="amd64"):
+    config = {"architecture": arch, "os": "linux", "history": [{"created_by": "RUN true"}],
+              "config": {"Env": []}}
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": "application/vnd.oci.image.manifest.v1+json",
+        "config": {"mediaType": "application/vnd.oci.image.config.v1+json", **write_json_blob(root, config)},
+        "layers": [{"mediaType": "application/vnd.oci.image.layer.v1.tar+gzip", "digest": write_blob(root, blob), "size": len(blob)}
+                   for blob in layers],
+    }
+    return {"mediaType": "application/vnd.oci.image.manifest.v1+json",
+            "platform": {"os": "linux", "architecture": arch}, **write_json_blob(root, manifest)}
+
+@pytest.fixture
+def multiarch_layout(tmp_path):
+    root = str(tmp_path / "layout")
+    amd64 = write_image(root, [gzip.compress(build_layer({"etc/os-release": b"ID=amd64\n"}))])
+    arm64 = write_image(root, [zstandard.ZstdCompressor().compress(build_layer({"etc/os-release": b"ID=arm64\n"})),
+                               build_layer({"app/package.json": b"{}"})], "arm64")
+    attestation = {"mediaType": "application/vnd.oci.image.manifest.v1+json", "digest": arm64["digest"],
+                   "platform": {"os": "unknown", "architecture": "unknown"}}
+    index = {"schemaVersion": 2, "mediaType": "application/vnd.oci.image.index.v1+json",
+             "manifests": [amd64, arm64, attestation]}
+    nested = {"mediaType": "application/vnd.oci.image.index.v1+json", **write_json_blob(root, index)}
+    with open(os.path.join(root, "index.json"), "w") as fp:
+        json.dump({"schemaVersion": 2, "manifests": [nested]}, fp)
+    with open(os.path.join(root, "oci-layout"), "w") as fp:
+        json.dump({"imageLayoutVersion": "1.0.0"}, fp)
+    return root
+
+def test_is_oci_layout(multiarch_layout, tmp_path):
+    assert is_oci_layout(multiarch_layout)
+    assert not is_oci_layout(str(tmp_path))
+
+def test_read_image_platform(multiarch_layout):
+    layout = OCILayout(multiarch_layout)
+    config, layers = read_image(layout, "linux/arm64")
+    assert config["architecture"] == "arm64"
+    assert len(layers) == 2
+    config, layers = read_image(layout, "linux/amd64")
+    assert config["architecture"] == "amd64"
+    with pytest.raises(OCIError):
+        read_image(layout, "linux/s390x")
+
+def test_layout_tar(multiarch_layout, tmp_path):
+    path = str(tmp_path / "image.tar")
+    with tarfile.open(path, "w") as tar:
+        for name in os.listdir(multiarch_layout):
+            tar.add(os.path.join(multiarch_layout, name), name)
+    assert is_oci_layout(path)
+    layout = OCILayout(path)
+    _, layers = read_image(layout, "linux/arm64")
+    decompressed = {digest: fp.read() for digest, fp in iter_decompressed(layout, [layer["digest"] for layer in layers], 2)}
+    with tarfile.open(fileobj=io.BytesIO(decompressed[layers[0]["digest"]])) as layer:
+        assert layer.extractfile("etc/os-release").read() == b"ID=arm64\n"
+
+def test_decompress_layers_in_place(multiarch_layout, tmp_path):
+    path = str(tmp_path / "image.tar")
+    with tarfile.open(path, "w") as tar:
+        tar.add(multiarch_layout, "")
+    layout = OCILayout(path)
+    _, layers = read_image(layout, "linux/arm64")
+    inflated, uncompressed = decompress_layers(layout, [layer["digest"] for layer in layers], 1)
+    try:
+        # The zstd layer is inflated on disk, the uncompressed one is read from the archive
+        assert isinstance(inflated, tempfile.SpooledTemporaryFile) and inflated._rolled
+        assert not isinstance(uncompressed, tempfile.SpooledTemporaryFile)
+        with tarfile.open(fileobj=uncompressed) as layer:
+            assert layer.extractfile("app/package.json").read() == b"{}"
+    finally:
+        inflated.close()
+        uncompressed.close()
+
+def test_is_oci_layout_docker_archive(tmp_path):
+    # docker save archives of Docker 25+ are also OCI layouts, with a manifest.json
+    path = str(tmp_path / "image.tar")
+    with tarfile.open(path, "w") as tar:
+        for name in ("blobs/sha256/layer", "index.json", "manifest.json", "oci-layout", "repositories"):
+            tar.addfile(tarfile.TarInfo(name), io.BytesIO())
+    assert not is_oci_layout(path)
+
+def test_iter_decompressed_order(multiarch_layout):
+    layout = OCILayout(multiarch_layout)
+    _, layers = read_image(layout, "linux/arm64")
+    digests = [layer["digest"] for layer in layers] * 3
+    assert [digest for digest, _ in iter_decompressed(layout, digests, 2)] == digests
+
+def test_decompress_concatenated_gzip():
+    out = io.BytesIO()
+    decompress(io.BytesIO(gzip.compress(b"abc") + gzip.compress(b"def")), out)
+    assert out.getvalue() == b"abcdef"
@@ -1,5 +1,6 @@
 import pytest
-from orca.lib.path import remove_folders, get_filepaths
+from orca.lib.path import PathTree, build_file_index, remove_folders, get_filepaths
+from orca.lib.types import VulnerabilityReport
 import os
 import tempfile
 
@@ -27,3 +28,47 @@ def test_get_filepaths():
         assert "a/b/test.txt" in paths
         assert "file.txt" in paths
         assert "etc/ssl/certs/cert.pem" not in paths
+
+def test_build_file_index(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "usr/bin")
+    os.makedirs(tmp_path / "etc/ssl/certs/nested")
+    (tmp_path / "usr/bin/tool").write_bytes(b"\x7fELF")
+    os.chmod(tmp_path / "usr/bin/tool", 0o755)
+    (tmp_path / "usr/bin/readme").write_text("text")
+    os.symlink("tool", tmp_path / "usr/bin/alias")
+    (tmp_path / "etc/ssl/certs/nested/cert.pem").write_text("cert")
+
+    visited = []
+    scandir = os.scandir
+    def recording_scandir(path):
+        visited.append(os.path.relpath(path, tmp_path))
+        return scandir(path)
+    monkeypatch.setattr("orca.lib.path.os.scandir", recording_scandir)
+
+    index = build_file_index(str(tmp_path))
+    assert index["usr/bin/tool"].is_executable
+    assert index["usr/bin/tool"].size == 4
+    assert not index["usr/bin/readme"].is_executable
+    assert index["usr/bin/alias"].linkname == "tool"
+    assert index["usr/bin"].is_dir
+    assert "etc/ssl/certs" in index
+    assert "etc/ssl/certs/nested/cert.pem" not in index
+    # Excluded subtrees are pruned, not filtered afterwards
+    assert "etc/ssl/certs" not in visited
+
+def test_path_tree():
+    paths = ["node_modules/mod1", "node_modules/mod1/index.js", "node_modules/mod1/lib/a.js",
+             "node_modules/mod10/index.js", "node_modules/mod1-extra/index.js", "package.json"]
+    tree = PathTree(paths)
+    assert tree.under("node_modules/mod1") == ["node_modules/mod1", "node_modules/mod1/index.js", "node_modules/mod1/lib/a.js"]
+    assert tree.under("node_modules/mod1/") == tree.under("node_modules/mod1")
+    assert tree.under("node_modules/mod10") == ["node_modules/mod10/index.js"]
+    assert tree.under("") == sorted(paths)
+    assert tree.under("node_modules/mod2") == []
+    assert tree.has_under("node_modules/mod1-extra") and not tree.has_under("node_modules/mod")
+    assert PathTree.of(tree) is tree
+
+def test_path_tree_of_report_files():
+    report = VulnerabilityReport({"b/2", "a", "b", "b/1", "c"})
+    report.remaining_files = {"b/1", "c", "b"}
+    assert PathTree.of(report.remaining_files).under("b") == ["b", "b/1"]
@@ -0,0 +1,74 @@
+import pickle
+
+from .pathtable import PathSet, PathTable
+from .types import PackageInfo, VulnerabilityReport
+
+
+def test_path_table():
+    table = PathTable(["usr/bin/ls", "usr/bin"])
+    assert len(table) == 2
+    assert table.intern("usr/bin") == 1
+    assert table.intern("usr/lib") == 2
+    assert list(table.lookup(["usr/lib", "missing", "usr/bin/ls"])) == [2, -1, 0]
+
+    paths = PathSet(table, table.mask(["usr/bin/ls", "usr/lib"]))
+    assert paths == {"usr/bin/ls", "usr/lib"}
+    assert "usr/bin" not in paths and "missing" not in paths
+    assert paths - {"usr/lib"} == {"usr/bin/ls"}
+    assert paths.union({"etc"}) == {"usr/bin/ls", "usr/lib", "etc"}
+    assert isinstance(paths.difference(["usr/lib"]), set)
+
+
+def test_report_attribution():
+    pkg = PackageInfo("coreutils", "9.1", None)
+    report = VulnerabilityReport({"usr", "usr/bin", "usr/bin/ls", "etc/hostname"}, ["usr/bin/ls", "usr/bin/dir", "etc/hostname"])
+    remaining = report.remaining_files
+    report.add_package_files({pkg: ["usr/bin/ls", "usr/bin/dir", "usr/share/doc/coreutils"]})
+
+    assert report.packages == [pkg]
+    assert report.package_files[pkg] == ["usr/bin/ls", "usr/bin/dir", "usr/share/doc/coreutils"]
+    assert report.analyzed_files == {"usr/bin/ls"}
+    assert report.remaining_files == {"usr", "usr/bin", "etc/hostname"}
+    # Earlier snapshots are not modified
+    assert "usr/bin/ls" in remaining
+    assert report.original_files == {"usr/bin/ls", "usr/bin/dir", "etc/hostname"}
+
+    # Packages without any file of the layer are listed but own nothing
+    other = PackageInfo("other", "1.0", None)
+    report.add_package_files({other: ["opt/other"]})
+    assert other in report.packages and other not in report.package_files
+
+
+def test_report_assignment():
+    report = VulnerabilityReport({"a", "b"})
+    report.remaining_files = {"b", "c"}
+    assert report.remaining_files == {"b", "c"}
+    assert report.initial_files == {"a", "b"}
+    report.add_package_files({PackageInfo("pkg", "1", None): ["a", "c"]})
+    assert report.remaining_files == {"b", "c"}
+
+    copy = pickle.loads(pickle.dumps(report))
+    assert copy.remaining_files == {"b", "c"} and copy.analyzed_files == {"a"}
+
+
+def test_reports_share_table():
+    table = PathTable()
+    lower = VulnerabilityReport({"usr", "usr/bin/ls"}, table=table)
+    upper = VulnerabilityReport({"usr", "opt/app.py"}, table=table)
+    assert len(table) == 3
+    # The paths added by the upper layer are not in the lower report
+    assert lower.remaining_files == {"usr", "usr/bin/ls"} and "opt/app.py" not in lower.initial_files
+    lower.add_package_files({PackageInfo("coreutils", "9.1", None): ["usr/bin/ls", "opt/app.py"]})
+    assert lower.analyzed_files == {"usr/bin/ls"} and upper.remaining_files == {"usr", "opt/app.py"}
+
+    # Snapshots are reused until the report changes
+    remaining = upper.remaining_files
+    assert upper.remaining_files is remaining
+    upper.add_package_files({PackageInfo("app", "1.0", None): ["opt/app.py"]})
+    assert upper.remaining_files is not remaining and upper.remaining_files == {"usr"}
+
+    # Pickled reports only keep their own paths, and move back to the table of the image
+    copy = pickle.loads(pickle.dumps(lower))
+    assert sorted(copy.table.paths) == ["usr", "usr/bin/ls"]
+    copy.use_table(table)
+    assert copy.table is table and copy.analyzed_files == {"usr/bin/ls"} and copy.remaining_files == {"usr"}
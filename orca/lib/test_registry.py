@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+from orca.find_cpes import scan_filesystem
+from orca.lib import registry
+from orca.lib.registry import ANALYZERS, Analyzer, PathIndex, get_analyzers
+from orca.lib.sniff import FileClass, SniffResult, SniffedFiles
+from orca.lib.types import PackageInfo
+
+PATHS = [
+    "usr/lib/python3/dist-packages/requests-2.31.0.dist-info/METADATA",
+    "app/lib/library-1.0.jar",
+    "app/node_modules/left-pad/package.json",
+    "var/lib/dpkg/status",
+    "var/lib/dpkg/info/bash.list",
+    "usr/share/perl5/Module.pm",
+    "src/go.mod",
+    "usr/lib/pkgconfig/zlib.pc",
+    "etc/hostname",
+]
+
+def test_path_index():
+    analyzers = [
+        Analyzer("java", None, suffixes=(".jar",), kinds=(FileClass.ZIP,)),
+        Analyzer("dpkg", None, basenames=("status",), globs=("var/lib/dpkg/info/*.list",)),
+        Analyzer("python", None, globs=("*dist-info*",)),
+    ]
+    sniffed = SniffedFiles([SniffResult("app/lib/renamed.bin", FileClass.ZIP)])
+    index = PathIndex(analyzers, PATHS, sniffed)
+    assert index.matches("java") == {"app/lib/library-1.0.jar", "app/lib/renamed.bin"}
+    assert index.matches("dpkg") == {"var/lib/dpkg/status", "var/lib/dpkg/info/bash.list"}
+    assert index.matches("python") == {PATHS[0]}
+    assert index.matches("unknown") == set()
+
+def test_builtin_analyzers():
+    index = PathIndex(get_analyzers(), PATHS)
+    assert index.matches("jar") == {"app/lib/library-1.0.jar"}
+    assert index.matches("npm") == {"app/node_modules/left-pad/package.json"}
+    assert index.matches("gomod") == {"src/go.mod"}
+    assert index.matches("pkgconfig") == {"usr/lib/pkgconfig/zlib.pc"}
+    matched = set().union(*(index.matches(analyzer.name) for analyzer in get_analyzers()))
+    assert "etc/hostname" not in matched
+
+def test_registered_analyzer(tmp_path, monkeypatch):
+    (tmp_path / "opt").mkdir()
+    (tmp_path / "opt" / "tool.version").write_text("tool 1.2.3")
+    (tmp_path / "opt" / "other").write_text("other")
+    calls = []
+
+    def get_tool(paths, directory, candidates=None):
+        calls.append(candidates)
+        return {PackageInfo("tool", "1.2.3", None): candidates}
+
+    monkeypatch.setitem(ANALYZERS, "tool", Analyzer("tool", get_tool, suffixes=(".version",)))
+    report = scan_filesystem(str(tmp_path), [])
+    assert calls == [["opt/tool.version"]]
+    assert PackageInfo("tool", "1.2.3", None) in report.packages
+    assert report.remaining_files == {"opt", "opt/other"}
+
+def test_entry_points(monkeypatch):
+    analyzer = Analyzer("plugin", lambda paths, directory, candidates=None: {}, basenames=("plugin.lock",))
+    entries = [
+        SimpleNamespace(name="plugin", load=lambda: (lambda: analyzer)),
+        SimpleNamespace(name="broken", load=lambda: 1 / 0),
+    ]
+    monkeypatch.setattr(registry, "entry_points", lambda group: entries if group == "orca.analyzers" else [])
+    monkeypatch.setattr(registry, "_entry_points_loaded", False)
+    monkeypatch.delitem(ANALYZERS, "plugin", raising=False)
+    try:
+        assert "plugin" in [registered.name for registered in get_analyzers()]
+    finally:
+        ANALYZERS.pop("plugin", None)
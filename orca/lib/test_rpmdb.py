@@ -0,0 +1,210 @@
+import hashlib
+import sqlite3
+import struct
+import sys
+import textwrap
+
+import pytest
+
+from .layerfs import DirectoryFS
+from .rpm_packages import RpmChecker, RpmCheckerError, get_rpm, read_rpm_db
+from .rpmdb import (BDB_HASH_MAGIC, NDB_BLOCK_SIZE, RPM_INT32_TYPE, RPM_STRING_ARRAY_TYPE, RPM_STRING_TYPE, RPMFILE_CONFIG,
+                    RPMTAG_BASENAMES, RPMTAG_DIRINDEXES, RPMTAG_DIRNAMES, RPMTAG_EPOCH, RPMTAG_FILEDIGESTALGO,
+                    RPMTAG_FILEDIGESTS, RPMTAG_FILEFLAGS, RPMTAG_NAME, RPMTAG_SOURCERPM, RPMTAG_VENDOR, RPMTAG_VERSION,
+                    RpmDBError, iter_rpmdb)
+from .verify import verify_packages
+from .types import PackageInfo, PackageInfoType, VulnerabilityReport
+
+
+def header_blob(name: str, version: str, vendor: str, files: list, epoch=None, digests=None, flags=None) -> bytes:
+    dirnames = sorted(set("/" + path.rsplit("/", 1)[0] + "/" for path in files))
+    tags = [(RPMTAG_NAME, RPM_STRING_TYPE, [name]), (RPMTAG_VERSION, RPM_STRING_TYPE, [version]),
+            (RPMTAG_VENDOR, RPM_STRING_TYPE, [vendor]), (RPMTAG_SOURCERPM, RPM_STRING_TYPE, [f"{name}-{version}-1.src.rpm"])]
+    if epoch is not None:
+        tags.append((RPMTAG_EPOCH, RPM_INT32_TYPE, [epoch]))
+    if len(files):
+        tags += [(RPMTAG_DIRINDEXES, RPM_INT32_TYPE, [dirnames.index("/" + path.rsplit("/", 1)[0] + "/") for path in files]),
+                 (RPMTAG_BASENAMES, RPM_STRING_ARRAY_TYPE, [path.rsplit("/", 1)[1] for path in files]),
+                 (RPMTAG_DIRNAMES, RPM_STRING_ARRAY_TYPE, dirnames)]
+    if digests is not None:
+        tags += [(RPMTAG_FILEDIGESTS, RPM_STRING_ARRAY_TYPE, digests), (RPMTAG_FILEDIGESTALGO, RPM_INT32_TYPE, [8])]
+    if flags is not None:
+        tags.append((RPMTAG_FILEFLAGS, RPM_INT32_TYPE, flags))
+    entries, data = b"", b""
+    for tag, kind, values in tags:
+        if kind == RPM_INT32_TYPE:
+            data += b"\x00" * (-len(data) % 4)
+            value = struct.pack(f">{len(values)}i", *values)
+        else:
+            value = b"".join(v.encode() + b"\x00" for v in values)
+        entries += struct.pack(">IIiI", tag, kind, len(data), len(values))
+        data += value
+    return struct.pack(">II", len(tags), len(data)) + entries + data
+
+
+def write_sqlite(path, blobs):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE Packages (hnum INTEGER PRIMARY KEY AUTOINCREMENT, blob BLOB NOT NULL)")
+    connection.executemany("INSERT INTO Packages (blob) VALUES (?)", [(blob,) for blob in blobs])
+    connection.commit()
+    connection.close()
+
+
+def write_ndb(path, blobs):
+    slots, content = b"", b""
+    offset = 4096
+    for idx, blob in enumerate(blobs, 1):
+        record = struct.pack("<4sIII", b"BlbS", idx, 0, len(blob)) + blob
+        record += b"\x00" * (-len(record) % NDB_BLOCK_SIZE) + struct.pack("<4sII", b"BlbE", 0, 0).ljust(16, b"\x00")
+        slots += struct.pack("<4sIII", b"Slot", idx, offset // NDB_BLOCK_SIZE, len(record) // NDB_BLOCK_SIZE)
+        content += record
+        offset += len(record)
+    header = struct.pack("<4sIIII", b"RpmP", 0, 0, 1, len(blobs) + 1).ljust(32, b"\x00")
+    slots += struct.pack("<4sIII", b"Slot", 0, 0, 0) * ((4096 - 32 - len(slots)) // 16)
+    with open(path, "wb") as fp:
+        fp.write(header + slots + content)
+
+
+def write_bdb(path, blobs, page_size=512):
+    """
+    Berkeley DB hash database with one hash page: every header is an off-page
+    item stored on a chain of overflow pages, like rpm writes them.
+    """
+    pages = {}
+    next_page = 2
+    items = []
+    for idx, blob in enumerate(blobs, 1):
+        chunk = page_size - 26
+        chunks = [blob[i:i + chunk] for i in range(0, len(blob), chunk)]
+        first = next_page
+        for number, data in enumerate(chunks):
+            following = first + number + 1 if number + 1 < len(chunks) else 0
+            header = struct.pack("<8xIIIHHBB", first + number, 0, following, 1, len(data), 0, 7)
+            pages[first + number] = (header + data).ljust(page_size, b"\x00")
+        next_page += len(chunks)
+        items.append(struct.pack("<B", 1) + struct.pack("<I", idx))
+        items.append(struct.pack("<B3xII", 3, first, len(blob)))
+    # Item with the data inline: not a header
+    items += [struct.pack("<B", 1) + struct.pack("<I", 0), struct.pack("<B", 1) + b"next"]
+    body = bytearray(page_size)
+    offsets, end = [], page_size
+    for item in items:
+        end -= len(item)
+        body[end:end + len(item)] = item
+        offsets.append(end)
+    body[:26] = struct.pack("<8xIIIHHBB", 1, 0, 0, len(items), end, 0, 2)
+    body[26:26 + 2 * len(offsets)] = struct.pack(f"<{len(offsets)}H", *offsets)
+    pages[1] = bytes(body)
+    meta = struct.pack("<8xIIIIBBBBII", 0, BDB_HASH_MAGIC, 9, page_size, 0, 8, 0, 0, 0, next_page - 1).ljust(page_size, b"\x00")
+    with open(path, "wb") as fp:
+        fp.write(meta + b"".join(pages[number] for number in range(1, next_page)))
+
+
+BLOBS = [
+    header_blob("bash", "5.2.15", "Red Hat, Inc.", ["usr/bin/bash", "usr/share/doc/bash/README"]),
+    header_blob("openssl-libs", "3.0.7", "Red Hat, Inc.", [f"usr/lib64/engines-3/engine{i}.so" for i in range(200)], epoch=1),
+    header_blob("gpg-pubkey", "fd431d51", "", []),
+]
+
+
+@pytest.mark.parametrize("writer,name", [(write_sqlite, "rpmdb.sqlite"), (write_ndb, "Packages.db"), (write_bdb, "Packages")])
+def test_rpmdb_backends(tmp_path, writer, name):
+    writer(str(tmp_path / name), BLOBS)
+    headers = list(iter_rpmdb(str(tmp_path), name))
+    assert [(header.name, header.version, header.vendor) for header in headers] == [
+        ("bash", "5.2.15", "Red Hat, Inc."), ("openssl-libs", "3.0.7", "Red Hat, Inc."), ("gpg-pubkey", "fd431d51", "")]
+    # File lists are only decoded when asked for
+    assert "files" not in vars(headers[1])
+    assert headers[0].files == ["usr/bin/bash", "usr/share/doc/bash/README"]
+    assert len(headers[1].files) == 200 and headers[1].epoch == 1
+    assert headers[2].files == [] and headers[2].epoch is None
+
+
+def test_invalid_rpmdb(tmp_path):
+    (tmp_path / "Packages").write_bytes(b"\x00" * 4096)
+    with pytest.raises(RpmDBError):
+        list(iter_rpmdb(str(tmp_path), "Packages"))
+
+
+def test_get_rpm(tmp_path):
+    (tmp_path / "var/lib/rpm").mkdir(parents=True)
+    (tmp_path / "etc/yum.repos.d").mkdir(parents=True)
+    (tmp_path / "etc/yum.repos.d/ubi.repo").write_text("[ubi]\n")
+    (tmp_path / "usr/bin").mkdir(parents=True)
+    (tmp_path / "usr/bin/bash").write_text("bash")
+    write_sqlite(str(tmp_path / "var/lib/rpm/rpmdb.sqlite"), BLOBS)
+    fs = DirectoryFS(str(tmp_path))
+    packages = get_rpm(list(fs.list()), fs)
+    bash = PackageInfo("bash", "5.2.15", "redhat", PackageInfoType.RPM)
+    assert list(packages[bash]) == ["usr/bin/bash", "usr/share/doc/bash/README", "var/lib/rpm/rpmdb.sqlite", "etc/yum.repos.d/ubi.repo"]
+
+    rows = read_rpm_db(fs, "var/lib/rpm/rpmdb.sqlite", skip=[bash])
+    assert bash not in rows and len(rows) == 2
+
+    # The file lists of packages without files in the layer are not decoded
+    openssl = PackageInfo("openssl-libs", "3.0.7", "redhat", PackageInfoType.RPM)
+    assert list(packages[openssl]) == ["var/lib/rpm/rpmdb.sqlite", "etc/yum.repos.d/ubi.repo"]
+
+
+def test_verify_rpm_digests(tmp_path):
+    files = {"usr/bin/bash": b"bash", "usr/bin/sh": b"sh", "etc/bashrc": b"config"}
+    (tmp_path / "var/lib/rpm").mkdir(parents=True)
+    for path in files:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(b"changed" if path != "usr/bin/sh" else files[path])
+    digests = [hashlib.sha256(content).hexdigest() for content in files.values()]
+    blob = header_blob("bash", "5.2.15", "Red Hat, Inc.", list(files), digests=digests, flags=[0, 0, RPMFILE_CONFIG])
+    write_sqlite(str(tmp_path / "var/lib/rpm/rpmdb.sqlite"), [blob])
+    [header] = iter_rpmdb(str(tmp_path), "var/lib/rpm/rpmdb.sqlite")
+    assert header.digest_algorithm == "sha256" and len(header.file_digests()) == 2
+
+    fs = DirectoryFS(str(tmp_path))
+    report = VulnerabilityReport(fs.list())
+    report.add_package_files(get_rpm(list(fs.list()), fs))
+    tampered = verify_packages(fs, report)
+    bash = PackageInfo("bash", "5.2.15", "redhat", PackageInfoType.RPM)
+    # Config files are expected to change
+    assert [(file.path, file.algorithm) for file in tampered[bash]] == [("usr/bin/bash", "sha256")]
+    # The digests computed by the check are kept in the layer index
+    assert fs.digest("usr/bin/sh").sha256 == hashlib.sha256(b"sh").digest()
+
+
+FAKE_RPM_CHECKER = textwrap.dedent("""
+    import json, sys, time
+    for line in sys.stdin:
+        path = line.strip()
+        if path == "slow":
+            time.sleep(10)
+        elif path == "broken":
+            print(json.dumps({"end": True, "count": 0, "error": "invalid database"}), flush=True)
+        else:
+            for idx in range(2):
+                print(json.dumps({"package": f"pkg{idx}", "version": "1.0", "author": "Red Hat, Inc.",
+                                  "files": [f"usr/bin/pkg{idx}"], "rpm": f"pkg{idx}-1.0-1.src.rpm"}))
+            print(json.dumps({"end": True, "count": 2}), flush=True)
+""")
+
+
+def test_rpm_checker_server(tmp_path):
+    (tmp_path / "rpm_checker.py").write_text(FAKE_RPM_CHECKER)
+    checker = RpmChecker([sys.executable, str(tmp_path / "rpm_checker.py")], timeout=1)
+    try:
+        assert [item["package"] for item in checker.query("Packages")] == ["pkg0", "pkg1"]
+        process = checker.process
+        # One process answers every database
+        assert len(list(checker.query("rpmdb.sqlite"))) == 2 and checker.process is process
+        with pytest.raises(RpmCheckerError, match="invalid database"):
+            list(checker.query("broken"))
+        assert checker.process is process
+
+        # A stuck helper is killed and restarted by the next query
+        with pytest.raises(RpmCheckerError, match="did not answer"):
+            list(checker.query("slow"))
+        assert checker.process is None and process.poll() is not None
+        assert len(list(checker.query("Packages"))) == 2
+
+        # Leaving an answer unread does not leak it into the next query
+        next(checker.query("Packages"))
+        assert [item["package"] for item in checker.query("Packages")] == ["pkg0", "pkg1"]
+    finally:
+        checker.close()
@@ -0,0 +1,76 @@
+import io
+import os
+import shutil
+import sys
+import zipfile
+
+import pytest
+
+from orca.find_cpes import scan_filesystem
+from orca.lib.layerfs import DirectoryFS
+from orca.lib.sniff import FileClass, classify, sniff_files
+from orca.lib.test_golang import MODINFO, build_elf, inline_buildinfo
+from orca.lib.types import PackageInfoType
+
+GO_BINARY = shutil.which("go") or "/usr/local/go/bin/go"
+
+def test_classify():
+    assert classify(b"\x7fELF\x02\x01\x01") == FileClass.ELF
+    assert classify(b"PK\x03\x04rest") == FileClass.ZIP
+    assert classify(b"\x1f\x8b\x08\x00") == FileClass.GZIP
+    assert classify(b"\x28\xb5\x2f\xfd\x00") == FileClass.ZSTD
+    assert classify(b"#!/bin/sh\necho") == FileClass.SCRIPT
+    assert classify("configuration é".encode()[:-1]) == FileClass.TEXT
+    assert classify(b"\x00\x01\x02\x03") == FileClass.OTHER
+    assert classify(b"") == FileClass.OTHER
+
+def pom_archive() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("META-INF/maven/org.example/demo/pom.properties",
+                         "groupId=org.example\nartifactId=demo\nversion=1.2.3\n")
+    return buffer.getvalue()
+
+@pytest.fixture
+def layer(tmp_path):
+    os.makedirs(tmp_path / "usr/bin")
+    os.makedirs(tmp_path / "opt/app")
+    shutil.copy(sys.executable, tmp_path / "usr/bin/python")
+    (tmp_path / "usr/bin/run").write_text("#!/bin/sh\nexec python\n")
+    (tmp_path / "opt/app/library.bin").write_bytes(pom_archive())
+    (tmp_path / "opt/app/notes").write_text("just text")
+    return str(tmp_path)
+
+def test_sniff_files(layer):
+    fs = DirectoryFS(layer)
+    sniffed = sniff_files(fs, fs.list(), workers=2)
+    assert sniffed.elf() == ["usr/bin/python"]
+    assert sniffed.elf(go=True) == []
+    assert sniffed.of(FileClass.ZIP) == ["opt/app/library.bin"]
+    assert sniffed.kind("usr/bin/run") == FileClass.SCRIPT
+    assert sniffed.kind("opt/app/notes") == FileClass.TEXT
+    assert sniffed.kind("usr/bin") is None
+
+@pytest.mark.skipif(not os.path.exists(GO_BINARY), reason="go toolchain not available")
+def test_sniff_go_binary(tmp_path):
+    shutil.copy(GO_BINARY, tmp_path / "tool")
+    sniffed = sniff_files(str(tmp_path), ["tool"])
+    assert sniffed.elf(go=True) == ["tool"]
+
+def test_renamed_jar_reaches_analyzer(layer):
+    report = scan_filesystem(layer, [])
+    maven = [package for package in report.packages if package.type == PackageInfoType.MAVEN]
+    assert [(package.name, package.version) for package in maven] == [("demo", "1.2.3")]
+
+def test_owned_binaries_skipped(tmp_path):
+    os.makedirs(tmp_path / "lib/apk/db")
+    os.makedirs(tmp_path / "usr/bin")
+    (tmp_path / "usr/bin/owned").write_bytes(build_elf(inline_buildinfo("go1.21.6", MODINFO)))
+    (tmp_path / "usr/bin/unowned").write_bytes(build_elf(inline_buildinfo("go1.22.1", MODINFO)))
+    (tmp_path / "lib/apk/db/installed").write_text("P:tool\nV:1.0.0\nF:usr/bin\nR:owned\n\n")
+
+    def go_files(report):
+        return sorted(set(file for package, files in report.package_files.items()
+                          if package.type == PackageInfoType.GOLANG for file in files))
+    assert go_files(scan_filesystem(str(tmp_path), [])) == ["usr/bin/unowned"]
+    assert go_files(scan_filesystem(str(tmp_path), [], all_binaries=True)) == ["usr/bin/owned", "usr/bin/unowned"]
@@ -0,0 +1,105 @@
+import base64
+import hashlib
+import io
+import os
+import tarfile
+
+from orca.find_cpes import scan_filesystem
+from orca.lib.analyzer import analyze_record
+from orca.lib.layerfs import DirectoryFS, MergedLayerFS, TarLayerFS
+from orca.lib.types import PackageInfo, PackageInfoType, to_record
+from orca.lib.verify import file_digest
+
+STATUS = "Package: hello\nStatus: install ok installed\nArchitecture: amd64\nVersion: 2.10-3\n"
+
+
+def md5(content: bytes) -> str:
+    return hashlib.md5(content).hexdigest()
+
+
+def record_hash(content: bytes) -> str:
+    return base64.urlsafe_b64encode(hashlib.sha256(content).digest()).decode().rstrip("=")
+
+
+def apk_hash(content: bytes) -> str:
+    return "Q1" + base64.b64encode(hashlib.sha1(content).digest()).decode()
+
+
+def write_files(root, files):
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        with open(os.path.join(root, path), "wb") as fp:
+            fp.write(content)
+
+
+def test_verify_directory(tmp_path):
+    site = "usr/lib/python3/site-packages"
+    write_files(str(tmp_path), {
+        # dpkg: the binary was replaced, the library is untouched, the doc was removed
+        "var/lib/dpkg/status": STATUS.encode(),
+        "var/lib/dpkg/info/hello.list": b"/usr/bin/hello\n/usr/lib/libhello.so\n/usr/share/doc/hello/README\n",
+        "var/lib/dpkg/info/hello.md5sums": (f"{md5(b'hello')}  usr/bin/hello\n{md5(b'lib')}  usr/lib/libhello.so\n"
+                                            f"{md5(b'doc')}  usr/share/doc/hello/README\n").encode(),
+        "usr/bin/hello": b"patched",
+        "usr/lib/libhello.so": b"lib",
+        # Python
+        f"{site}/requests-2.31.0.dist-info/METADATA": b"Metadata-Version: 2.1\nName: requests\nVersion: 2.31.0\n",
+        f"{site}/requests-2.31.0.dist-info/RECORD": (f"requests/__init__.py,sha256={record_hash(b'init')},4\n"
+                                                     f"requests/api.py,sha256={record_hash(b'api')},3\n"
+                                                     f"../../../bin/requests,sha256={record_hash(b'main')},4\n"
+                                                     "requests/__pycache__/api.cpython-312.pyc,,\n"
+                                                     "requests-2.31.0.dist-info/RECORD,,\n").encode(),
+        f"{site}/requests/__init__.py": b"init",
+        f"{site}/requests/api.py": b"backdoor",
+        "usr/bin/requests": b"main",
+        # apk: edits under etc/ are expected, links are not followed
+        "lib/apk/db/installed": (f"P:busybox\nV:1.36.1-r5\nA:x86_64\nF:bin\nR:busybox\nZ:{apk_hash(b'busybox')}\n"
+                                 f"R:sh\nZ:{apk_hash(b'/bin/busybox')}\nF:etc\nR:motd\nZ:{apk_hash(b'welcome')}\n").encode(),
+        "bin/busybox": b"busybox",
+        "etc/motd": b"hacked",
+    })
+    os.symlink("busybox", tmp_path / "bin/sh")
+    fs = DirectoryFS(str(tmp_path))
+    report = scan_filesystem(fs, list(fs.list()), verify=True)
+
+    tampered = {package.name: [(file.path, file.algorithm) for file in files] for package, files in report.tampered.items()}
+    assert tampered == {"hello": [("usr/bin/hello", "md5")], "requests": [(f"{site}/requests/api.py", "sha256")]}
+    hello = report.tampered[PackageInfo("hello", "2.10-3", None, PackageInfoType.DEBIAN, "amd64")][0]
+    assert hello.expected == md5(b"hello") and hello.actual == md5(b"patched") and not hello.replaced
+
+    assert scan_filesystem(fs, list(fs.list())).tampered == {}
+
+
+def test_analyze_record(tmp_path):
+    write_files(str(tmp_path), {"pkg/a.py": b"a" * 10000, "pkg/b.py": b"b"})
+    assert analyze_record(str(tmp_path), to_record(f"pkg/a.py,sha256={record_hash(b'a' * 10000)},10000"))
+    assert not analyze_record(str(tmp_path), to_record(f"pkg/b.py,sha256={record_hash(b'c')},1"))
+    assert not analyze_record(str(tmp_path), to_record(f"pkg/missing.py,sha256={record_hash(b'c')},1"))
+    assert analyze_record(str(tmp_path), to_record("pkg/b.pyc,,"))
+
+
+def layer(tmp_path, name, files):
+    path = tmp_path / f"{name}.tar"
+    with tarfile.open(path, "w") as tar:
+        for file, content in files.items():
+            info = tarfile.TarInfo(file)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return name, TarLayerFS(tarfile.open(path), name)
+
+
+def test_verify_replaced_by_upper_layer(tmp_path):
+    content = os.urandom(3 * 1024 * 1024)
+    base = layer(tmp_path, "base", {
+        "var/lib/dpkg/status": STATUS.encode(),
+        "var/lib/dpkg/info/hello.list": b"/usr/bin/hello\n",
+        "var/lib/dpkg/info/hello.md5sums": f"{md5(content)}  usr/bin/hello\n".encode(),
+        "usr/bin/hello": content,
+    })
+    upper = layer(tmp_path, "upper", {"usr/bin/hello": content[:-1] + b"\x00"})
+    assert file_digest(base[1], "usr/bin/hello", "md5").hex() == md5(content)
+
+    merged = MergedLayerFS([base, upper])
+    report = scan_filesystem(merged, list(merged.members.keys()), verify=True)
+    [file] = [file for files in report.tampered.values() for file in files]
+    assert (file.path, file.layer, file.replaced) == ("usr/bin/hello", "upper", True)
@@ -1,7 +1,11 @@
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set
 from enum import Enum
 
+import numpy as np
+
+from .pathtable import PathSet, PathTable
+
 class LayerAction(Enum):
     ADDED = "added"
     REPLACED = "replaced"
@@ -34,6 +38,31 @@ class LayerChangeRecord:
     action: LayerAction
     layer: str
 
+@dataclass(frozen=True, slots=True)
+class FileDigests:
+    """
+    Digests of the content of a regular file, computed when its layer is read.
+    """
+    sha1: bytes
+    sha256: bytes
+    size: int
+
+@dataclass
+class TamperedFile:
+    """
+    File of a package whose content does not match the digest recorded by its
+    package manager (dpkg md5sums, rpmdb, apk installed db, Python RECORD).
+    """
+    path: str
+    manifest: str
+    algorithm: str
+    expected: str
+    actual: str
+    # Layer that last wrote the file, on merged scans: a file replaced by another
+    # layer than the one of its manifest was overwritten after the package install
+    layer: Optional[str] = None
+    replaced: bool = False
+
 class PackageInfoType(Enum):
     DEBIAN = "debian",
     PYPI = "pypi",
@@ -70,27 +99,163 @@ class PackageInfo:
 
         return f"{self.name},{self.version},{author}"
 
+class FileGroups(Sequence[str]):
+    """
+    Files of a package: its own files followed by groups of files shared with
+    other packages (e.g. the package database), referenced instead of copied.
+    """
+    def __init__(self, files: Optional[Iterable[str]] = None, groups: Iterable[List[str]] = ()):
+        self.files: List[str] = list(files) if files is not None else []
+        self.groups: List[List[str]] = list(groups)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.files
+        for group in self.groups:
+            yield from group
+
+    def __len__(self) -> int:
+        return len(self.files) + sum(len(group) for group in self.groups)
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, (list, FileGroups)) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"FileGroups({self.files!r}, {len(self.groups)} shared groups)"
+
+    def extend(self, files: Iterable[str]) -> None:
+        self.files.extend(files)
+
+    def share(self, group: List[str]) -> None:
+        self.groups.append(group)
+
+MASKS = ("_original", "_initial", "_remaining", "_analyzed")
+
+def _path_set(mask: str, doc: str) -> property:
+    def get(self) -> PathSet:
+        # The snapshot is shared by the readers until the mask changes
+        path_set = self._sets.get(mask)
+        if path_set is None:
+            path_set = self._sets[mask] = PathSet(self.table, getattr(self, mask).copy())
+        return path_set
+    def set(self, paths: Iterable[str]) -> None:
+        setattr(self, mask, self._mask(paths))
+        self._sets.pop(mask, None)
+    return property(get, set, doc=doc)
+
 class VulnerabilityReport:
-    def __init__(self,paths: Set[str],files=None):
-        if files is not None:
-            self.original_files = files
-        else:
-            self.original_files = paths
-        self.initial_files = paths
-        self.remaining_files = paths
-        assert isinstance(self.remaining_files, set), "remaining_files must be a set"
+    """
+    Paths are interned once in `table`, shared by the reports of the layers of an
+    image; the file sets of the report are boolean masks over the table, exposed
+    as read-only set snapshots. Masks created before the table grew are shorter
+    than the table: the paths past their end are not in the set.
+    """
+    original_files = _path_set("_original", "All the files of the layer, including links and devices")
+    initial_files = _path_set("_initial", "Files to analyze")
+    remaining_files = _path_set("_remaining", "Files not attributed to a package yet")
+    analyzed_files = _path_set("_analyzed", "Files attributed to a package")
+
+    def __init__(self,paths: Set[str],files=None,table: Optional[PathTable]=None):
+        self.table = table if table is not None else PathTable()
+        self._sets: Dict[str,PathSet] = {}
+        self._initial = self.table.mask(paths)
+        self._original = self._mask(files) if files is not None else self._initial.copy()
+        self._remaining = self._initial.copy()
+        self._analyzed = np.zeros(len(self.table), dtype=bool)
         self.packages: List[PackageInfo] = []
         self.package_files: Dict[PackageInfo,List[str]] = {}
-        self.analyzed_files: Set[str] = set()
         self.os = None
+        # Changes of every file over the image layers (final filesystem scans only)
+        self.history: Dict[str,List[LayerChangeRecord]] = {}
+        # Packages added or removed by the layer (incremental scans only)
+        self.package_changes: Dict[PackageInfo,LayerChangeRecord] = {}
+        # Files not matching their package manager digests (--verify only)
+        self.tampered: Dict[PackageInfo,List[TamperedFile]] = {}
+        # Digests of the regular files of the layer
+        self.digests: Dict[str,FileDigests] = {}
+
+    def __getstate__(self):
+        # Only the paths of the report are stored, not the ones of the other layers of the table
+        state = self.__dict__.copy()
+        del state["_sets"]
+        size = max(len(getattr(self, name)) for name in MASKS)
+        used = np.zeros(size, dtype=bool)
+        for name in MASKS:
+            mask = getattr(self, name)
+            used[:len(mask)] |= mask
+        ids = np.flatnonzero(used)
+        state["table"] = PathTable(self.table.paths[path_id] for path_id in ids)
+        for name in MASKS:
+            mask = getattr(self, name)
+            state[name] = mask[ids[ids < len(mask)]]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sets = {}
+        for name in MASKS:
+            mask = getattr(self, name)
+            if len(mask) < len(self.table):
+                setattr(self, name, np.concatenate([mask, np.zeros(len(self.table) - len(mask), dtype=bool)]))
+
+    def use_table(self, table: PathTable) -> None:
+        """
+        Moves the report to `table`, e.g. the one of the other layers of the image
+        for reports read from the layer cache or returned by worker processes.
+        """
+        if table is self.table:
+            return
+        ids = table.extend(self.table.paths)
+        for name in MASKS:
+            mask = getattr(self, name)
+            moved = np.zeros(len(table), dtype=bool)
+            moved[ids[:len(mask)][mask]] = True
+            setattr(self, name, moved)
+        self.table = table
+        self._sets = {}
+
+    def _mask(self, paths: Iterable[str]) -> np.ndarray:
+        ids = self.table.extend(paths)
+        for name in MASKS:
+            # New paths were added to the table: every mask must cover them
+            current = getattr(self, name, None)
+            if current is not None and len(current) < len(self.table):
+                setattr(self, name, np.concatenate([current, np.zeros(len(self.table) - len(current), dtype=bool)]))
+        mask = np.zeros(len(self.table), dtype=bool)
+        mask[ids] = True
+        return mask
 
     def add_package_files(self,package_files: Dict[PackageInfo,List[str]]):
         self.packages.extend(package_files.keys())
-        self.package_files.update({pkg: files for pkg, files in package_files.items() if any(f in self.initial_files for f in files)}) # TODO: probably add the other files to another dict
-        fs = [file for file_list in package_files.values() for file in file_list ]
-        fs_in_initial = [f for f in fs if f in self.initial_files]
-        self.analyzed_files.update(fs_in_initial)
-        self.remaining_files = self.remaining_files.difference(fs_in_initial)
+        owned = []
+        # Groups shared by several packages are looked up and marked once
+        shared: Dict[int, np.ndarray] = {}
+        def lookup(files) -> np.ndarray:
+            ids = self.table.lookup(files)
+            ids = ids[(ids >= 0) & (ids < len(self._initial))]
+            return ids[self._initial[ids]]
+        for pkg, files in package_files.items():
+            if isinstance(files, FileGroups):
+                ids = lookup(files.files)
+                for group in files.groups:
+                    if id(group) not in shared:
+                        shared[id(group)] = lookup(group)
+                        owned.append(shared[id(group)])
+                found = len(ids) > 0 or any(len(shared[id(group)]) for group in files.groups)
+            else:
+                ids = lookup(files)
+                found = len(ids) > 0
+            if found:
+                self.package_files[pkg] = files # TODO: probably add the other files to another dict
+                owned.append(ids)
+        if len(owned):
+            owned = np.concatenate(owned)
+            self._analyzed[owned] = True
+            self._remaining[owned] = False
+            self._sets.pop("_analyzed", None)
+            self._sets.pop("_remaining", None)
     
     def to_json(self):
         json_dict = {}
@@ -0,0 +1,254 @@
+import base64
+import hashlib
+import mmap
+import os
+import posixpath
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .apk import ApkFiles, apk_digest
+from .dpkg import DPKG_INFO, read_dpkg_md5sums
+from .layerfs import DirectoryFS, LayerFS, as_layerfs, normalize_member_name
+from .logger import logger
+from .rpm_packages import iter_rpm_packages
+from .rpmdb import RpmDBError
+from .types import FileGroups, PackageInfo, PackageRecord, TamperedFile, VulnerabilityReport, to_record
+
+HASH_BUFFER_SIZE = 1024 * 1024
+VERIFY_WORKERS = 8
+# Like apk itself, edits under /etc are expected and not reported
+APK_PROTECTED_PATHS = ("etc/",)
+
+
+@dataclass(frozen=True)
+class ExpectedDigest:
+    path: str
+    algorithm: str
+    digest: bytes
+    manifest: str
+
+
+def file_digest(fs: LayerFS, path: str, algorithm: str) -> bytes:
+    """
+    Digest of a file of the layer. SHA1 and SHA256 are read from the layer index,
+    where they are stored by the first read of the file. For other algorithms,
+    files on disk are memory mapped and hashed in one call, archive members are
+    read in large blocks; hashlib releases the GIL on both, so several files are
+    hashed in parallel on threads.
+    """
+    if algorithm in ("sha1", "sha256"):
+        return getattr(fs.hash_file(path), algorithm)
+    digest = hashlib.new(algorithm)
+    with fs.open(path, "rb") as fp:
+        if isinstance(fs, DirectoryFS) and os.fstat(fp.fileno()).st_size > 0:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+            return digest.digest()
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            size = fp.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.digest()
+
+
+def record_digest(record: PackageRecord) -> Optional[bytes]:
+    if record.hash is None:
+        return None
+    try:
+        return base64.urlsafe_b64decode(record.hash + "=" * (-len(record.hash) % 4))
+    except ValueError:
+        return None
+
+
+def record_digests(fs: LayerFS, path: str) -> List[ExpectedDigest]:
+    """
+    Digests of the `RECORD` file of a Python distribution: paths are relative to
+    the folder containing the `.dist-info` folder, digests are urlsafe base64.
+    """
+    base = posixpath.dirname(posixpath.dirname(path))
+    digests = []
+    try:
+        lines = fs.open(path).readlines()
+    except OSError as e:
+        logger.debug(f"RECORD not readable: {path} {e}")
+        return digests
+    for line in lines:
+        try:
+            record = to_record(line.rstrip("\n"))
+        except (ValueError, IndexError):
+            continue
+        digest = record_digest(record)
+        if record.hashtype is None or digest is None:
+            continue
+        file = posixpath.normpath(posixpath.join(base, record.path))
+        if not file.startswith("../"):
+            digests.append(ExpectedDigest(file, record.hashtype, digest, path))
+    return digests
+
+
+def dpkg_digests(fs: LayerFS, path: str) -> List[ExpectedDigest]:
+    digests = []
+    for file, digest in read_dpkg_md5sums(fs, path).items():
+        try:
+            digests.append(ExpectedDigest(file, "md5", bytes.fromhex(digest), path))
+        except ValueError:
+            continue
+    return digests
+
+
+def apk_digests(files: ApkFiles) -> List[ExpectedDigest]:
+    manifest = files.groups[0][0] if len(files.groups) and len(files.groups[0]) else "lib/apk/db/installed"
+    digests = []
+    for file, checksum in files.checksums().items():
+        decoded = apk_digest(checksum)
+        if decoded is not None and not file.startswith(APK_PROTECTED_PATHS):
+            digests.append(ExpectedDigest(file, decoded[0], decoded[1], manifest))
+    return digests
+
+
+def rpm_digests(fs: LayerFS, path: str, packages: List[PackageInfo]) -> Iterator[Tuple[PackageInfo, List[ExpectedDigest]]]:
+    """
+    File digests of the rpmdb headers of `packages`. The database is read again:
+    only the headers of the packages of the report have their file lists decoded.
+    """
+    wanted = set(packages)
+    try:
+        for infos, header in iter_rpm_packages(fs, path):
+            if infos[0] not in wanted or header.digest_algorithm is None:
+                continue
+            try:
+                digests = [ExpectedDigest(file, header.digest_algorithm, bytes.fromhex(digest), path)
+                           for file, digest in header.file_digests()]
+            except (RpmDBError, ValueError) as e:
+                logger.debug(f"Invalid file digests of {header.name} in {path}: {e}")
+                continue
+            yield infos[0], digests
+    except RpmDBError as e:
+        logger.warning(f"Could not read the file digests of {path}: {e}")
+
+
+def is_rpmdb(path: str) -> bool:
+    return "rpm/Packages" in path or path.endswith("rpmdb.sqlite")
+
+
+def is_manifest(path: str) -> bool:
+    return (path.startswith(DPKG_INFO) and path.endswith(".md5sums")) or path.endswith(".dist-info/RECORD") or is_rpmdb(path)
+
+
+def manifest_name(path: str) -> str:
+    if path.endswith(".md5sums"):
+        # libc6:amd64.md5sums
+        return posixpath.basename(path)[:-len(".md5sums")].partition(":")[0]
+    # requests-2.31.0.dist-info/RECORD
+    return posixpath.basename(posixpath.dirname(path)).split("-")[0]
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def manifest_owner(path: str, packages: List[PackageInfo]) -> PackageInfo:
+    """
+    Package a manifest belongs to among the ones listing it, e.g. the binary
+    package and not its source package, which shares the dpkg info files.
+    """
+    name = normalize_name(manifest_name(path))
+    return next((package for package in packages if normalize_name(package.name) == name), packages[0])
+
+
+def expected_digests(directory, report: VulnerabilityReport) -> Dict[PackageInfo, List[ExpectedDigest]]:
+    """
+    Digests recorded by the package managers for the files of the packages of the report.
+    """
+    fs = as_layerfs(directory)
+    expected: Dict[PackageInfo, List[ExpectedDigest]] = {}
+    listed: Dict[str, List[PackageInfo]] = {}
+    for package, files in report.package_files.items():
+        if isinstance(files, ApkFiles):
+            expected.setdefault(package, []).extend(apk_digests(files))
+            continue
+        # Shared groups hold the database files of every package
+        own = files.files if isinstance(files, FileGroups) else files
+        for path in own:
+            if is_manifest(path):
+                listed.setdefault(path, []).append(package)
+    for path, packages in listed.items():
+        if is_rpmdb(path):
+            for package, digests in rpm_digests(fs, path, packages):
+                expected.setdefault(package, []).extend(digests)
+        elif path.endswith(".md5sums"):
+            expected.setdefault(manifest_owner(path, packages), []).extend(dpkg_digests(fs, path))
+        else:
+            expected.setdefault(manifest_owner(path, packages), []).extend(record_digests(fs, path))
+    return expected
+
+
+def verify_digests(directory, expected: Dict[PackageInfo, List[ExpectedDigest]], workers: int = VERIFY_WORKERS) -> Dict[PackageInfo, List[TamperedFile]]:
+    """
+    Hashes the files with a recorded digest and returns the ones that do not match,
+    by package. Every file is hashed once per algorithm; files missing from the
+    layer (e.g. docs removed to slim an image) are not reported.
+    """
+    fs = as_layerfs(directory)
+    index = fs.index()
+
+    def is_regular(path: str) -> bool:
+        entry = index.get(normalize_member_name(path))
+        return entry is not None and entry.is_regular
+
+    tasks = sorted(set((digest.path, digest.algorithm) for digests in expected.values() for digest in digests if is_regular(digest.path)))
+
+    def compute(task: Tuple[str, str]) -> Tuple[Tuple[str, str], Optional[bytes]]:
+        try:
+            return task, file_digest(fs, *task)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Could not hash {task[0]}: {e}")
+            return task, None
+
+    if fs.concurrent_reads and len(tasks) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            actual = dict(executor.map(compute, tasks))
+    else:
+        # Archive-backed layers share a single file handle: members are read in archive order
+        members = getattr(fs, "members", {})
+        tasks.sort(key=lambda task: getattr(members.get(task[0]), "offset_data", 0))
+        actual = dict(map(compute, tasks))
+
+    layer_of = getattr(fs, "layer_of", None)
+    tampered: Dict[PackageInfo, List[TamperedFile]] = {}
+    for package, digests in expected.items():
+        for digest in digests:
+            found = actual.get((digest.path, digest.algorithm))
+            if found is None or found == digest.digest:
+                continue
+            layer = layer_of(digest.path) if layer_of is not None else None
+            replaced = layer is not None and layer != layer_of(digest.manifest)
+            tampered.setdefault(package, []).append(
+                TamperedFile(digest.path, digest.manifest, digest.algorithm, digest.digest.hex(), found.hex(), layer, replaced))
+    return tampered
+
+
+def verify_packages(directory, report: VulnerabilityReport, workers: int = VERIFY_WORKERS) -> Dict[PackageInfo, List[TamperedFile]]:
+    expected = expected_digests(directory, report)
+    logger.info(f"Verifying {sum(len(digests) for digests in expected.values())} files of {len(expected)} packages")
+    tampered = verify_digests(directory, expected, workers)
+    for package, files in tampered.items():
+        for file in files:
+            logger.warning(f"{package.name} {package.version}: {file.path} does not match its {file.algorithm} digest in {file.manifest}"
+                           + (f" (replaced by layer {file.layer})" if file.replaced else ""))
+    return tampered
+
+
+def tampered_to_json(report_by_layer: Dict[str, VulnerabilityReport]) -> Dict[str, Dict[str, List[dict]]]:
+    json_dict = {}
+    for layer, report in report_by_layer.items():
+        packages = {f"{k.name}_{k.version}_{k.author}": [vars(file) for file in files]
+                    for k, files in getattr(report, "tampered", {}).items()}
+        if len(packages):
+            json_dict[layer] = packages
+    return json_dict
@@ -1,22 +1,39 @@
 import argparse
 import datetime
+import io
 import json
 import shutil
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, List, Optional
 import docker
 import docker.errors
-from orca.find_cpes import scan_filesystem
+from orca.find_cpes import OS_INFOS, scan_filesystem
+from orca.lib.delta import PackageState
 from orca.lib.dockerfile import extract_cpes_from_dockerfile_with_validation
+from orca.lib.filecache import DEFAULT_FILE_CACHE_SIZE, FileCache, get_file_cache, set_file_cache
+from orca.lib.imagestream import IterStream, iter_layers, resolve_link
+from orca.lib.layercache import BLOB_DIGEST, CACHE_DIR, DEFAULT_CACHE_SIZE, LayerCache, layer_digests
+from orca.lib.layerfs import MergedLayerFS, TarLayerFS
 from orca.lib.logger import logger
+from orca.lib.pathtable import PathTable
+from orca.lib.oci import DECOMPRESS_WORKERS, OCILayout, blob_path, decompress_layers, is_oci_layout, iter_decompressed, read_image
 import tarfile
 import os
 
 from orca.lib.spdx import generateSPDXFromReportMap
-from orca.lib.types import VulnerabilityReport
+from orca.lib.types import PackageInfoType, VulnerabilityReport
 from orca.lib.utils import map_container_id
+from orca.lib.verify import tampered_to_json
 
 TMP_DIR = f"{os.getcwd()}/tmpdir"
 
+# Packages without files in the final filesystem are attributed to the layer of their database
+PACKAGE_DATABASES = {
+    PackageInfoType.DEBIAN: ["var/lib/dpkg/status"],
+    PackageInfoType.APK: ["lib/apk/db/installed"],
+    PackageInfoType.RPM: ["var/lib/rpm/rpmdb.sqlite","var/lib/rpm/Packages","var/lib/rpm/Packages.db","usr/lib/sysimage/rpm/rpmdb.sqlite"],
+}
+
 
 
 def tar_remove_links(file: tarfile.TarInfo,path):
@@ -25,7 +42,7 @@ def tar_remove_links(file: tarfile.TarInfo,path):
     return None
 
 
-def save_image(client:docker.DockerClient,container:str,filepath:str):
+def get_image(client:docker.DockerClient,container:str):
     try:
         image = client.images.get(container)
     except docker.errors.ImageNotFound as _:
@@ -34,7 +51,11 @@ def save_image(client:docker.DockerClient,container:str,filepath:str):
         image = client.images.pull(container)
     except Exception as e:
         print(e)
-    
+    return image
+
+
+def save_image(client:docker.DockerClient,container:str,filepath:str):
+    image = get_image(client,container)
     
     shutil.rmtree(TMP_DIR,ignore_errors=True)
     
@@ -49,8 +70,8 @@ def save_image(client:docker.DockerClient,container:str,filepath:str):
     return
 
 
-def extract_config(config_path: str):
-    config_file = json.load(open(config_path))
+def extract_config(config_fp):
+    config_file = json.load(config_fp)
     data = config_file['history']
     if len(data) > 1:
         return config_file
@@ -75,77 +96,299 @@ def extract_with_config_and_layers(image_location:str):
     tarf = tarfile.open(image_location)
     manifests = [x for x in tarf.getmembers() if x.name == "manifest.json"]
     assert len(manifests) == 1
-    manifest = manifests[0]
-    tarf.extract(manifest,path=f"{TMP_DIR}",set_attrs=False,filter=tar_remove_links)
-    manifestFile = json.load(open(f"{TMP_DIR}/manifest.json"))
+    manifestFile = json.load(tarf.extractfile(manifests[0]))
     layers = manifestFile[0]['Layers']
     config_path = manifestFile[0]['Config']
-    tarf.extract(config_path,path=f"{TMP_DIR}",set_attrs=False,filter=tar_remove_links)
-    config = extract_config(f"{TMP_DIR}/{config_path}")
+    config = extract_config(tarf.extractfile(config_path))
     return tarf,config,layers
 
-def scan_tar(image_tar:str,client:docker.DockerClient,binary_analysis:bool):
-    layers_archive,config,layers = extract_with_config_and_layers(image_tar)
+def open_layer(layers_archive: tarfile.TarFile,layer: str) -> Optional[TarLayerFS]:
+    """
+    Opens a layer of the image tarball in place, without extracting it to disk.
+    """
+    try:
+        layer_fp = layers_archive.extractfile(layer)
+    except KeyError:
+        layer_fp = None
+    if layer_fp is None:
+        return None
+    return TarLayerFS(tarfile.open(fileobj=layer_fp),layer)
+
+def scan_layer(layers_archive: tarfile.TarFile,layer: str,binary_analysis:bool,package_state:Optional[PackageState]=None,all_binaries:bool=False,verify:bool=False,table:Optional[PathTable]=None) -> Optional[VulnerabilityReport]:
+    layer_fs = open_layer(layers_archive,layer)
+    if layer_fs is None:
+        logger.error(f"Layer {layer} does not exist on container {layers_archive.name}")
+        return None
+    return scan_layer_fs(layer_fs,binary_analysis,package_state,all_binaries,verify,table)
+
+def scan_layer_fs(layer_fs: TarLayerFS,binary_analysis:bool,package_state:Optional[PackageState]=None,all_binaries:bool=False,verify:bool=False,table:Optional[PathTable]=None) -> VulnerabilityReport:
+    image_files = layer_fs.tar.getnames()
+    return scan_filesystem(layer_fs,image_files,binary_analysis,False,package_state,all_binaries,verify,table)
+
+def scan_layer_worker(image_tar:str,layer:str,binary_analysis:bool,all_binaries:bool=False,verify:bool=False) -> Optional[VulnerabilityReport]:
+    """
+    Entry point of the worker processes: every worker opens its own handle on the image tarball.
+    """
+    with tarfile.open(image_tar) as layers_archive:
+        return scan_layer(layers_archive,layer,binary_analysis,None,all_binaries,verify)
+
+def split_report(report:VulnerabilityReport,merged:MergedLayerFS) -> Dict[str,VulnerabilityReport]:
+    """
+    Splits the report of the final filesystem in one report per layer: every file
+    and package file is attributed to the layer it comes from.
+    """
+    layers = [name for name,_ in merged.layers]
+    paths_by_layer: Dict[str,set] = {layer: set() for layer in layers}
+    files_by_layer: Dict[str,set] = {layer: set() for layer in layers}
+    for path,member in merged.members.items():
+        layer = merged.layer_of(path)
+        files_by_layer[layer].add(path)
+        if member.isdir():
+            continue
+        # Like a layer scanned on its own, a layer also has the folders containing its files
+        parts = path.split("/")
+        paths_by_layer[layer].update("/".join(parts[:i]) for i in range(1,len(parts) + 1))
+    initial_files = report.initial_files
+    for layer in layers:
+        paths_by_layer[layer] = set(path for path in paths_by_layer[layer] if path in initial_files)
+
+    report_by_layer = {layer: VulnerabilityReport(paths_by_layer[layer],files_by_layer[layer],report.table) for layer in layers}
+    for package in dict.fromkeys(report.packages):
+        files = report.package_files.get(package,[])
+        owners = set(merged.layer_of(file) for file in files if file in merged.members and not merged.members[file].isdir())
+        if len(owners) == 0:
+            # No file left in the final filesystem, e.g. only found through the package database
+            databases = [merged.layer_of(path) for path in PACKAGE_DATABASES.get(package.type,[])]
+            owners = {next((layer for layer in databases if layer is not None),layers[-1])}
+        for layer in owners:
+            report_by_layer[layer].add_package_files({package: [file for file in files if file in paths_by_layer[layer]]})
+    for layer in layers:
+        report_by_layer[layer].digests = {path: report.digests[path] for path in files_by_layer[layer] if path in report.digests}
+    # Tampered files are reported by the layer that last wrote them
+    for package,tampered in report.tampered.items():
+        for file in tampered:
+            layer = file.layer if file.layer is not None else layers[-1]
+            report_by_layer[layer].tampered.setdefault(package,[]).append(file)
+    for layer,layer_report in report_by_layer.items():
+        if any(merged.layer_of(path) == layer for path in OS_INFOS):
+            layer_report.os = report.os
+        layer_report.history = {path: merged.history[path] for path in layer_report.initial_files if path in merged.history}
+    return report_by_layer
 
+def scan_merged(layer_fss:List[tuple[str,TarLayerFS]],binary_analysis:bool,all_binaries:bool=False,verify:bool=False) -> Dict[str,VulnerabilityReport]:
+    """
+    Scans the final filesystem of the image once, instead of every layer on its own:
+    files deleted or overwritten by an upper layer are not analyzed.
+    """
+    merged = MergedLayerFS(layer_fss)
+    logger.info(f"Analyzing final filesystem of {len(layer_fss)} layers")
+    report = scan_filesystem(merged,list(merged.members.keys()),binary_analysis,False,None,all_binaries,verify,PathTable())
+    return split_report(report,merged)
+
+def collect_reports(layers:List[str],digests:List[Optional[str]],cached:Dict[str,VulnerabilityReport],scanned:Dict[str,Optional[VulnerabilityReport]],binary_analysis:bool,cache:Optional[LayerCache]=None,all_binaries:bool=False,verify:bool=False,table:Optional[PathTable]=None) -> Dict[str,VulnerabilityReport]:
+    # Reports are collected in manifest order so the result is the same as a serial run
     report_by_layer: Dict[str,VulnerabilityReport] = {}
-    for layer in layers:
-        logger.info(f"Analyzing layer {layer}")
-        layers_archive.extract(layer,f"{TMP_DIR}",set_attrs=False,filter=tar_remove_links)
-        if not os.path.exists(f"{TMP_DIR}/{layer}"):
-            logger.error(f"Layer {layer} does not exist on container {image_tar}")
+    for layer,digest in zip(layers,digests):
+        if layer in cached:
+            report = cached[layer]
+        else:
+            report = scanned.get(layer)
+            if report is not None and cache is not None:
+                cache.put(digest,report,binary_analysis=binary_analysis,all_binaries=all_binaries,verify=verify)
+        if report is None:
             continue
-        image_layer = tarfile.open(f"{TMP_DIR}/{layer}")
-        image_layer.extractall(f"{TMP_DIR}/{layer}_layer",filter=tar_remove_links,numeric_owner=True)
-        image_files = image_layer.getnames()
-        report = scan_filesystem(f"{TMP_DIR}/{layer}_layer",image_files,binary_analysis,False)
+        if table is not None:
+            # Cached reports and the ones of worker processes come with their own paths
+            report.use_table(table)
         report_by_layer[layer] = report
-        # Add dockerfile:
         logger.info(report.summary())
+    return report_by_layer
 
+def add_dockerfile_report(report_by_layer:Dict[str,VulnerabilityReport],config) -> None:
     cpes = extract_cpes_from_dockerfile_with_validation(config)
     # FIXME: this is a hack to make the report work with the dockerfile. Obfiously Dockerfile commands are not files. 
     cpes.remaining_files = set()
     cpes.initial_files = set()
     cpes.original_files = set()
     report_by_layer["Dockerfile"] = cpes
-    report_by_layer["Dockerfile"] = cpes
+
+def scan_tar(image_tar:str,client:docker.DockerClient,binary_analysis:bool,jobs:int=1,cache:Optional[LayerCache]=None,merged:bool=False,delta:bool=False,all_binaries:bool=False,verify:bool=False):
+    layers_archive,config,layers = extract_with_config_and_layers(image_tar)
+    # One path table for the reports of all the layers
+    table = PathTable()
+    if delta and not merged:
+        # Every layer depends on the state of the lower ones: serial, without the layer cache
+        package_state = PackageState()
+        scanned = {}
+        for layer in layers:
+            logger.info(f"Analyzing changes of layer {layer}")
+            scanned[layer] = scan_layer(layers_archive,layer,binary_analysis,package_state,all_binaries,verify,table)
+        report_by_layer = collect_reports(layers,[None] * len(layers),{},scanned,binary_analysis,None,all_binaries,verify,table)
+        add_dockerfile_report(report_by_layer,config)
+        layers_archive.close()
+        shutil.rmtree(TMP_DIR,ignore_errors=True)
+        return report_by_layer
+    if merged:
+        layer_fss = []
+        for layer in layers:
+            layer_fs = open_layer(layers_archive,layer)
+            if layer_fs is None:
+                logger.error(f"Layer {layer} does not exist on container {layers_archive.name}")
+                continue
+            layer_fss.append((layer,layer_fs))
+        report_by_layer = scan_merged(layer_fss,binary_analysis,all_binaries,verify)
+        add_dockerfile_report(report_by_layer,config)
+        layers_archive.close()
+        shutil.rmtree(TMP_DIR,ignore_errors=True)
+        return report_by_layer
+
+    digests = layer_digests(layers,config)
+
+    cached: Dict[str,VulnerabilityReport] = {}
+    if cache is not None:
+        for layer,digest in zip(layers,digests):
+            report = cache.get(digest,binary_analysis=binary_analysis,all_binaries=all_binaries,verify=verify)
+            if report is not None:
+                logger.info(f"Layer {layer} found in cache")
+                cached[layer] = report
+    to_scan = [layer for layer in layers if layer not in cached]
+
+    if jobs > 1:
+        logger.info(f"Analyzing {len(to_scan)} layers with {jobs} workers")
+        with ProcessPoolExecutor(max_workers=jobs,initializer=set_file_cache,initargs=(get_file_cache(),)) as executor:
+            futures = [executor.submit(scan_layer_worker,image_tar,layer,binary_analysis,all_binaries,verify) for layer in to_scan]
+            scanned = dict(zip(to_scan,[future.result() for future in futures]))
+    else:
+        scanned = {}
+        for layer in to_scan:
+            logger.info(f"Analyzing layer {layer}")
+            scanned[layer] = scan_layer(layers_archive,layer,binary_analysis,None,all_binaries,verify,table)
+
+    report_by_layer = collect_reports(layers,digests,cached,scanned,binary_analysis,cache,all_binaries,verify,table)
+    add_dockerfile_report(report_by_layer,config)
 
     # Cleanup: TODO: probably should be done in a separate function
+    layers_archive.close()
     shutil.rmtree(TMP_DIR,ignore_errors=True)
     return report_by_layer
 
-def scan_image(container:str,client:docker.DockerClient,binary_analysis:bool):
-    image_tar = f'{TMP_DIR}/container.tar'
-    save_image(client,container,image_tar)
-    layers_archive,config,layers = extract_with_config_and_layers(image_tar)
+def scan_stream(fileobj:BinaryIO,binary_analysis:bool,cache:Optional[LayerCache]=None,all_binaries:bool=False,verify:bool=False) -> Dict[str,VulnerabilityReport]:
+    """
+    Scans an image archive read sequentially from `fileobj`: every layer is analyzed
+    as soon as it is received, so the whole image never needs to be stored on disk.
+    """
+    metadata: Dict[str,bytes] = {}
+    links: Dict[str,str] = {}
+    cached: Dict[str,VulnerabilityReport] = {}
+    scanned: Dict[str,Optional[VulnerabilityReport]] = {}
+    digest_by_layer: Dict[str,str] = {}
+    table = PathTable()
+
+    def should_read(name:str) -> bool:
+        # OCI layouts name blobs after their digest: cached layers are skipped without reading them
+        match = BLOB_DIGEST.search(name)
+        if cache is None or match is None:
+            return True
+        digest = f"{match.group(1)}:{match.group(2)}"
+        report = cache.get(digest,binary_analysis=binary_analysis,all_binaries=all_binaries,verify=verify)
+        if report is None:
+            return True
+        logger.info(f"Layer {name} found in cache")
+        digest_by_layer[name] = digest
+        cached[name] = report
+        return False
+
+    for name,layer_fp,digest in iter_layers(fileobj,metadata,links,should_read):
+        digest_by_layer.setdefault(name,digest)
+        match = BLOB_DIGEST.search(name)
+        if match is None and cache is not None:
+            report = cache.get(digest,binary_analysis=binary_analysis,all_binaries=all_binaries,verify=verify)
+            if report is not None:
+                logger.info(f"Layer {name} found in cache")
+                cached[name] = report
+                continue
+        logger.info(f"Analyzing layer {name}")
+        scanned[name] = scan_layer_fs(TarLayerFS(tarfile.open(fileobj=layer_fp),name),binary_analysis,None,all_binaries,verify,table)
 
-    report_by_layer: Dict[str,VulnerabilityReport] = {}
-    for layer in layers:
-        logger.info(f"Analyzing layer {layer}")
-        layers_archive.extract(layer,f"{TMP_DIR}",set_attrs=False,filter=tar_remove_links)
-        if not os.path.exists(f"{TMP_DIR}/{layer}"):
-            logger.error(f"Layer {layer} does not exist on container {container}")
-            continue
-        image_layer = tarfile.open(f"{TMP_DIR}/{layer}")
-        image_layer.extractall(f"{TMP_DIR}/{layer}_layer",filter=tar_remove_links)
-        image_files = image_layer.getnames()
-        report = scan_filesystem(f"{TMP_DIR}/{layer}_layer",image_files, binary_analysis,False)
-        report_by_layer[layer] = report
+    manifestFile = json.loads(metadata["manifest.json"])
+    layers = manifestFile[0]['Layers']
+    config = extract_config(io.BytesIO(metadata[resolve_link(manifestFile[0]['Config'],links)]))
+
+    # Layers deduplicated by docker are links to the archive member that was actually scanned
+    members = [resolve_link(layer,links) for layer in layers]
+    for layer,member in zip(layers,members):
+        if member in cached:
+            cached[layer] = cached[member]
+        elif member in scanned:
+            scanned[layer] = scanned[member]
+        else:
+            logger.error(f"Layer {layer} does not exist in the image archive")
+    digests = [digest_by_layer.get(member) for member in members]
 
-        logger.info(report.summary())
+    report_by_layer = collect_reports(layers,digests,cached,scanned,binary_analysis,cache,all_binaries,verify,table)
+    add_dockerfile_report(report_by_layer,config)
+    return report_by_layer
 
-    cpes = extract_cpes_from_dockerfile_with_validation(config)
-    report_by_layer["Dockerfile"] = cpes
-    # FIXME: this is a hack to make the report work with the dockerfile. Obfiously Dockerfile commands are not files. 
-    cpes.remaining_files = set()
-    cpes.initial_files = set()
-    cpes.original_files = set()
-    report_by_layer["Dockerfile"] = cpes
-    # Cleanup: TODO: probably should be done in a separate function
-    shutil.rmtree(TMP_DIR,ignore_errors=True)
+def scan_oci(path:str,binary_analysis:bool,cache:Optional[LayerCache]=None,platform:Optional[str]=None,workers:int=DECOMPRESS_WORKERS,merged:bool=False,delta:bool=False,all_binaries:bool=False,verify:bool=False) -> Dict[str,VulnerabilityReport]:
+    """
+    Scans an OCI image layout (directory or tar archive) without going through the docker daemon.
+    Compressed layers are inflated on worker threads while the previous layers are analyzed.
+    """
+    layout = OCILayout(path)
+    config,descriptors = read_image(layout,platform)
+    digests = [descriptor["digest"] for descriptor in descriptors]
+    layers = [blob_path(digest) for digest in digests]
+
+    if merged:
+        layer_fps = decompress_layers(layout,digests,workers)
+        try:
+            report_by_layer = scan_merged([(layer,TarLayerFS(tarfile.open(fileobj=fp),layer)) for layer,fp in zip(layers,layer_fps)],binary_analysis,all_binaries,verify)
+        finally:
+            for fp in layer_fps:
+                fp.close()
+        add_dockerfile_report(report_by_layer,config)
+        return report_by_layer
+
+    package_state = PackageState() if delta else None
+    cached: Dict[str,VulnerabilityReport] = {}
+    if cache is not None and package_state is None:
+        for layer,digest in zip(layers,digests):
+            report = cache.get(digest,binary_analysis=binary_analysis,all_binaries=all_binaries,verify=verify)
+            if report is not None:
+                logger.info(f"Layer {layer} found in cache")
+                cached[layer] = report
+    to_scan = list(dict.fromkeys(digest for layer,digest in zip(layers,digests) if layer not in cached))
+
+    scanned: Dict[str,Optional[VulnerabilityReport]] = {}
+    table = PathTable()
+    for digest,layer_fp in iter_decompressed(layout,to_scan,workers):
+        layer = blob_path(digest)
+        logger.info(f"Analyzing layer {layer}")
+        scanned[layer] = scan_layer_fs(TarLayerFS(tarfile.open(fileobj=layer_fp),layer),binary_analysis,package_state,all_binaries,verify,table)
+
+    # Incremental reports depend on the lower layers, they cannot be cached by layer digest
+    report_by_layer = collect_reports(layers,digests,cached,scanned,binary_analysis,cache if package_state is None else None,all_binaries,verify,table)
+    add_dockerfile_report(report_by_layer,config)
     return report_by_layer
 
-def write_logfile(report_by_layer: dict[str, VulnerabilityReport],container:str,container_name:str,elapsed:int)->None:
+def scan_image(container:str,client:docker.DockerClient,binary_analysis:bool,jobs:int=1,cache:Optional[LayerCache]=None,stream:bool=False,merged:bool=False,delta:bool=False,all_binaries:bool=False,verify:bool=False):
+    if stream and (merged or delta):
+        logger.warning("Layers must be analyzed together and in order, the image is saved to disk instead of streamed")
+    elif stream:
+        if jobs > 1:
+            logger.warning("Layers are analyzed one at a time when streaming, --jobs is ignored")
+        image = get_image(client,container)
+        logger.info(f"Streaming image {container}")
+        image_stream = IterStream(image.save(named=False))
+        try:
+            return scan_stream(io.BufferedReader(image_stream),binary_analysis,cache,all_binaries,verify)
+        finally:
+            image_stream.close()
+    image_tar = f'{TMP_DIR}/container.tar'
+    save_image(client,container,image_tar)
+    return scan_tar(image_tar,client,binary_analysis,jobs,cache,merged,delta,all_binaries,verify)
+
+def write_logfile(report_by_layer: dict[str, VulnerabilityReport],container:str,container_name:str,elapsed:int,cache_stats:Optional[Dict[str,int]]=None)->None:
     total_files = set()
     total_files_duplicates = []
     analyzed_files = set()
@@ -165,12 +408,26 @@ def write_logfile(report_by_layer: dict[str, VulnerabilityReport],container:str,
         "total_files_duplicates": len(total_files_duplicates),
         "elapsed_time":elapsed
     }
+    if cache_stats is not None:
+        loginfo["layer_cache"] = cache_stats
     with open(f"logs/orca-{container_name}_logs.json","w") as fp:
             json.dump(loginfo,fp)
 
 
-def orca(client: docker.DockerClient,output_folder: str,csv:bool,binary_analysis:bool,with_complete_report:bool,containers: List[str]):
- 
+def is_oci_path(container:str) -> bool:
+    if not os.path.isdir(container) and not (container.endswith(".tar") and os.path.isfile(container)):
+        return False
+    return is_oci_layout(container)
+
+def orca(client: docker.DockerClient,output_folder: str,csv:bool,binary_analysis:bool,with_complete_report:bool,containers: List[str],jobs:int=1,cache:Optional[LayerCache]=None,stream:bool=False,platform:Optional[str]=None,merged:bool=False,delta:bool=False,all_binaries:bool=False,verify:bool=False):
+
+ def get_client() -> docker.DockerClient:
+    # Docker is only needed for images that are not available locally
+    nonlocal client
+    if client is None:
+        client = docker.from_env(timeout=900)
+    return client
+
  if not os.path.exists("logs/"):
     os.mkdir("logs",mode=0o755)
  if output_folder == "results" and not os.path.exists("results"):
@@ -179,11 +436,18 @@ def orca(client: docker.DockerClient,output_folder: str,csv:bool,binary_analysis
  for container in containers: 
         start = datetime.datetime.now()
         container_usable_name = map_container_id(container)
-
-        if not container.endswith(".tar"):
-            report_by_layer = scan_image(container,client,binary_analysis)
+        if cache is not None:
+            cache.reset_stats()
+
+        if is_oci_path(container):
+            report_by_layer = scan_oci(container,binary_analysis,cache,platform,max(jobs,DECOMPRESS_WORKERS),merged,delta,all_binaries,verify)
+        elif not container.endswith(".tar"):
+            report_by_layer = scan_image(container,get_client(),binary_analysis,jobs,cache,stream,merged,delta,all_binaries,verify)
+        elif stream and not merged and not delta:
+            with open(container,"rb") as fp:
+                report_by_layer = scan_stream(fp,binary_analysis,cache,all_binaries,verify)
         else:
-            report_by_layer = scan_tar(container,client,binary_analysis) 
+            report_by_layer = scan_tar(container,client,binary_analysis,jobs,cache,merged,delta,all_binaries,verify)
             
         end = datetime.datetime.now()
 
@@ -197,7 +461,13 @@ def orca(client: docker.DockerClient,output_folder: str,csv:bool,binary_analysis
 
         print(f"[{container}] Total packages identified {len(total_cpe)}")
         logger.info(f"Elapsed time: {elapsed} ms")
-        write_logfile(report_by_layer,container,container_usable_name,elapsed)
+        write_logfile(report_by_layer,container,container_usable_name,elapsed,cache.stats() if cache is not None else None)
+
+        if verify:
+            tampered = tampered_to_json(report_by_layer)
+            print(f"[{container}] Tampered files {sum(len(files) for packages in tampered.values() for files in packages.values())}")
+            with open(f"{output_folder}/orca-{container_usable_name}_verify.json","w") as fp:
+                json.dump(tampered,fp,indent="\t")
 
         if len(total_cpe) == 0:
             continue
@@ -225,22 +495,58 @@ def main():
         "--csv", action='store_true', help="Store also a csv file with package information",default=False)
     
     parser.add_argument(
-       "-b","--with-binaries", action='store_true', help="Analyze every binary file (slower). Go binaries are always analyzed",default=False)
+       "-b","--with-binaries", action='store_true', help="Analyze the binary files not owned by a package manager (slower). Go binaries are always analyzed",default=False)
+
+    parser.add_argument(
+        "--all-binaries", action='store_true', help="Analyze also the binaries already owned by a package manager (Go binaries and, with -b, every binary)",default=False)
+    
+    parser.add_argument(
+        "--verify", action='store_true', help="Check the files of the packages against the digests of their package manager (dpkg, rpm, apk, Python RECORD) and list the tampered ones. Use with --final-fs to catch files replaced by upper layers",default=False)
     
     parser.add_argument(
         "-c","--complete", action='store_true', help="Generate complete SPDX report with relationships (>200MB file is generated)", default=False)
     
     parser.add_argument(
-        "containers", type=str, help="Comma separated list of containers to analyze")
+        "-j","--jobs", type=int, help="Number of layers analyzed in parallel by worker processes", default=1)
+
+    parser.add_argument(
+        "--stream", action='store_true', help="Analyze layers while the image is received from docker, without saving it to disk", default=False)
+
+    parser.add_argument(
+        "--final-fs", action='store_true', help="Analyze only the final filesystem of the image (whiteouts and overwritten files applied), files are still attributed to their layer", default=False)
+
+    parser.add_argument(
+        "--incremental", action='store_true', help="Analyze only what every layer changes: new files and package database differences with the lower layers", default=False)
+
+    parser.add_argument(
+        "--platform", type=str, help="Platform to analyze for multi-arch OCI images, as os/arch[/variant] (default: host platform)", default=None)
+
+    parser.add_argument(
+        "--no-cache", action='store_true', help="Do not use the layer and file caches", default=False)
+
+    parser.add_argument(
+        "--cache-dir", type=str, help="Folder of the layer and file caches", default=CACHE_DIR)
+
+    parser.add_argument(
+        "--cache-size", type=int, help="Maximum size of the layer cache in MB", default=DEFAULT_CACHE_SIZE // (1024 * 1024))
+
+    parser.add_argument(
+        "--file-cache-size", type=int, help="Maximum size of the cache of per-file analyzer results (binaries, jars, lockfiles) in MB", default=DEFAULT_FILE_CACHE_SIZE // (1024 * 1024))
+
+    parser.add_argument(
+        "containers", type=str, help="Comma separated list of containers to analyze: image names, docker save archives or OCI layouts (folder or tar)")
 
     args = parser.parse_args()
-    client = docker.from_env(timeout=900) # TODO: if scanning a tar there is no reason to access the docker engine
     output = args.dir
     csv = args.csv
     with_bin = args.with_binaries
     with_complete_report = args.complete
     containers = args.containers.split(",")
-    orca(client,output,csv,with_bin,with_complete_report,containers)
+    cache = None if args.no_cache else LayerCache(args.cache_dir,args.cache_size * 1024 * 1024)
+    if not args.no_cache:
+        set_file_cache(FileCache(os.path.join(args.cache_dir,"files.sqlite"),args.file_cache_size * 1024 * 1024))
+    orca(None,output,csv,with_bin,with_complete_report,containers,args.jobs,cache,args.stream,args.platform,args.final_fs,args.incremental,args.all_binaries,args.verify)
+    get_file_cache().close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,10 +1,14 @@
 package main
 
 import (
+	"bufio"
 	"encoding/json"
 	"flag"
 	"fmt"
+	"io"
 	"log"
+	"os"
+	"strings"
 
 	rpmdb "github.com/knqyf263/go-rpmdb/pkg"
 	_ "github.com/mattn/go-sqlite3"
@@ -19,22 +23,46 @@ type PackageInfo struct {
 	SourceRpm string   `json:"rpm"`
 }
 
+// EndOfRequest is the last line written for a database in server mode
+type EndOfRequest struct {
+	End   bool   `json:"end"`
+	Count int    `json:"count"`
+	Error string `json:"error,omitempty"`
+}
+
 func main() {
+	// Define flags for the database path and the server mode
+	dbPath := flag.String("dbpath", "", "Path to the RPM database")
+	server := flag.Bool("server", false, "Read database paths on stdin, one per line, and write one package per line (NDJSON)")
+	flag.Parse()
 
-	if len(flag.Args()) == 0 {
+	if *server {
+		if err := serve(os.Stdin, os.Stdout); err != nil {
+			log.Fatal(err)
+		}
+		return
+	}
+	if *dbPath == "" {
 		fmt.Println("Usage: rpm_checker -dbpath=<path_to_rpm_database>")
+		fmt.Println("       rpm_checker -server")
 		fmt.Println("Example: rpm_checker -dbpath=./Packages")
 		return
 	}
-	// Define flags for the database path and package names
-	dbPath := flag.String("dbpath", "./Packages", "Path to the RPM database")
-	flag.Parse()
-
 	if err := run(*dbPath); err != nil {
 		log.Fatal(err)
 	}
 }
 
+func packageInfo(pkg *rpmdb.PackageInfo) PackageInfo {
+	files := []string{}
+	fileinfo, _ := pkg.InstalledFiles()
+
+	for _, f := range fileinfo {
+		files = append(files, f.Path[1:])
+	}
+	return PackageInfo{pkg.Name, pkg.Version, pkg.Vendor, files, pkg.SourceRpm}
+}
+
 func run(dbPath string) error {
 	db, err := rpmdb.Open(dbPath)
 	if err != nil {
@@ -49,16 +77,57 @@ func run(dbPath string) error {
 	}
 
 	for _, pkg := range pkgList {
-		files := []string{}
-		fileinfo, _ := pkg.InstalledFiles()
-
-		for _, f := range fileinfo {
-			files = append(files, f.Path[1:])
-		}
-
-		packages = append(packages, PackageInfo{pkg.Name, pkg.Version, pkg.Vendor, files, pkg.SourceRpm})
+		packages = append(packages, packageInfo(pkg))
 	}
 	res, _ := json.Marshal(packages)
 	fmt.Println(string(res))
 	return nil
 }
+
+// serve answers every database path read from `in` with one JSON line per
+// package followed by an EndOfRequest line, until `in` is closed.
+func serve(in io.Reader, out io.Writer) error {
+	scanner := bufio.NewScanner(in)
+	writer := bufio.NewWriter(out)
+	encoder := json.NewEncoder(writer)
+	for scanner.Scan() {
+		dbPath := strings.TrimSpace(scanner.Text())
+		if dbPath == "" {
+			continue
+		}
+		count, err := stream(dbPath, encoder)
+		end := EndOfRequest{End: true, Count: count}
+		if err != nil {
+			end.Error = err.Error()
+		}
+		if err := encoder.Encode(end); err != nil {
+			return err
+		}
+		if err := writer.Flush(); err != nil {
+			return err
+		}
+	}
+	return scanner.Err()
+}
+
+// stream writes one JSON line per package of the database at `dbPath`. Only
+// the output is streamed: go-rpmdb does not export its entry iterator, so the
+// whole package list is decoded by ListPackages before the first line.
+func stream(dbPath string, encoder *json.Encoder) (int, error) {
+	db, err := rpmdb.Open(dbPath)
+	if err != nil {
+		return 0, err
+	}
+	defer db.Close()
+
+	pkgList, err := db.ListPackages()
+	if err != nil {
+		return 0, err
+	}
+	for idx, pkg := range pkgList {
+		if err := encoder.Encode(packageInfo(pkg)); err != nil {
+			return idx, err
+		}
+	}
+	return len(pkgList), nil
+}
@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import io
+import json
+import tarfile
+
+import pytest
+
+from orca.lib.layercache import LayerCache
+from orca.main import scan_oci, scan_stream, scan_tar
+
+
+def add_file(tar: tarfile.TarFile, name: str, content: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(content))
+
+def build_layer(files) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            add_file(tar, name, content)
+    return buffer.getvalue()
+
+def build_image(path, layers):
+    blobs = [build_layer(files) for files in layers]
+    config = {
+        "config": {"Env": ["PATH=/usr/bin"]},
+        "history": [{"created_by": "RUN true"} for _ in layers],
+        "rootfs": {"type": "layers", "diff_ids": [f"sha256:{hashlib.sha256(blob).hexdigest()}" for blob in blobs]},
+    }
+    names = [f"layer{idx}/layer.tar" for idx in range(len(layers))]
+    with tarfile.open(path, "w") as tar:
+        for name, blob in zip(names, blobs):
+            add_file(tar, name, blob)
+        add_file(tar, "config.json", json.dumps(config).encode())
+        add_file(tar, "manifest.json", json.dumps([{"Config": "config.json", "Layers": names}]).encode())
+    return names
+
+@pytest.fixture
+def image_tar(tmp_path, monkeypatch):
+    monkeypatch.setattr("orca.main.TMP_DIR", str(tmp_path / "tmpdir"))
+    path = tmp_path / "image.tar"
+    names = build_image(path, [
+        {"var/lib/dpkg/status": b"Package: zlib1g\nArchitecture: amd64\nVersion: 1.2.13\n\n",
+         "etc/os-release": b'NAME="Debian GNU/Linux"\nVERSION_ID="12"\n'},
+        {"app/package.json": b'{"name": "app", "version": "1.0.0"}'},
+        {"usr/lib/python3/dist-packages/requests-2.31.0.dist-info/METADATA": b"Name: requests\nVersion: 2.31.0\n",
+         "usr/lib/python3/dist-packages/requests-2.31.0.dist-info/RECORD": b"requests/__init__.py,,\n"},
+    ])
+    return str(path), names
+
+def test_scan_tar_layers_in_manifest_order(image_tar):
+    path, names = image_tar
+    report_by_layer = scan_tar(path, None, False)
+    assert list(report_by_layer.keys()) == [*names, "Dockerfile"]
+    assert [p.name for p in report_by_layer[names[1]].packages] == ["app"]
+
+def test_scan_tar_parallel_matches_serial(image_tar):
+    path, names = image_tar
+    serial = scan_tar(path, None, False)
+    parallel = scan_tar(path, None, False, jobs=2)
+    assert list(parallel.keys()) == list(serial.keys())
+    for layer in names:
+        assert parallel[layer].packages == serial[layer].packages
+        assert parallel[layer].remaining_files == serial[layer].remaining_files
+        assert parallel[layer].package_files == serial[layer].package_files
+    # Reports of worker processes join the path table of the image
+    assert len(set(id(parallel[layer].table) for layer in names)) == 1
+
+def test_scan_tar_layer_cache(image_tar, tmp_path, monkeypatch):
+    path, names = image_tar
+    cache = LayerCache(str(tmp_path / "cache"))
+    first = scan_tar(path, None, False, cache=cache)
+    assert cache.stats() == {"hits": 0, "misses": len(names)}
+
+    def fail(*args):
+        raise AssertionError("cached layers must not be scanned again")
+    monkeypatch.setattr("orca.main.scan_layer", fail)
+    cache.reset_stats()
+    second = scan_tar(path, None, False, cache=cache)
+    assert cache.stats() == {"hits": len(names), "misses": 0}
+    assert list(second.keys()) == list(first.keys())
+    for layer in names:
+        assert second[layer].packages == first[layer].packages
+
+def test_scan_stream_matches_tar(image_tar):
+    path, names = image_tar
+    from_tar = scan_tar(path, None, False)
+    with open(path, "rb") as fp:
+        from_stream = scan_stream(fp, False)
+    assert list(from_stream.keys()) == list(from_tar.keys())
+    for layer in names:
+        assert from_stream[layer].packages == from_tar[layer].packages
+        assert from_stream[layer].remaining_files == from_tar[layer].remaining_files
+
+def test_scan_stream_shares_layer_cache(image_tar, tmp_path, monkeypatch):
+    path, names = image_tar
+    cache = LayerCache(str(tmp_path / "cache"))
+    scan_tar(path, None, False, cache=cache)
+
+    def fail(*args):
+        raise AssertionError("cached layers must not be scanned again")
+    monkeypatch.setattr("orca.main.scan_layer_fs", fail)
+    cache.reset_stats()
+    with open(path, "rb") as fp:
+        report_by_layer = scan_stream(fp, False, cache)
+    assert cache.stats() == {"hits": len(names), "misses": 0}
+    assert list(report_by_layer.keys()) == [*names, "Dockerfile"]
+
+def test_scan_oci_matches_tar(image_tar, tmp_path):
+    path, names = image_tar
+    from_tar = scan_tar(path, None, False)
+
+    # Same image as an OCI layout with gzip layers
+    root = tmp_path / "layout"
+    (root / "blobs" / "sha256").mkdir(parents=True)
+    def write_blob(content: bytes):
+        digest = hashlib.sha256(content).hexdigest()
+        (root / "blobs" / "sha256" / digest).write_bytes(content)
+        return {"digest": f"sha256:{digest}", "size": len(content)}
+    with tarfile.open(path) as tar:
+        manifest = json.load(tar.extractfile("manifest.json"))[0]
+        layers = [write_blob(gzip.compress(tar.extractfile(layer).read())) for layer in manifest["Layers"]]
+        config = write_blob(tar.extractfile(manifest["Config"]).read())
+    image_manifest = write_blob(json.dumps({"schemaVersion": 2, "config": config, "layers": layers}).encode())
+    (root / "index.json").write_text(json.dumps({"schemaVersion": 2, "manifests": [image_manifest]}))
+
+    from_oci = scan_oci(str(root), False)
+    assert list(from_oci.keys()) == [f"blobs/sha256/{layer['digest'][7:]}" for layer in layers] + ["Dockerfile"]
+    for tar_layer, oci_layer in zip(names, from_oci.keys()):
+        assert from_oci[oci_layer].packages == from_tar[tar_layer].packages
+        assert from_oci[oci_layer].remaining_files == from_tar[tar_layer].remaining_files
+
+def test_scan_tar_final_filesystem(tmp_path, monkeypatch):
+    monkeypatch.setattr("orca.main.TMP_DIR", str(tmp_path / "tmpdir"))
+    path = tmp_path / "image.tar"
+    names = build_image(path, [
+        {"var/lib/dpkg/status": b"Package: zlib1g\nArchitecture: amd64\nVersion: 1.2.13\n\n",
+         "etc/os-release": b'NAME="Debian GNU/Linux"\nVERSION_ID="12"\n',
+         "app/package.json": b'{"name": "app", "version": "1.0.0"}'},
+        {"app/.wh.package.json": b"",
+         "srv/package.json": b'{"name": "srv", "version": "2.0.0"}'},
+    ])
+    per_layer = scan_tar(str(path), None, False)
+    final = scan_tar(str(path), None, False, merged=True)
+    assert list(final.keys()) == [*names, "Dockerfile"]
+    assert "app" in [p.name for p in per_layer[names[0]].packages]
+    assert [p.name for p in final[names[0]].packages] == ["zlib1g"]
+    assert [p.name for p in final[names[1]].packages] == ["srv"]
+    assert final[names[0]].os == per_layer[names[0]].os
+    assert "app/package.json" not in final[names[0]].initial_files
+    assert "srv/package.json" in final[names[1]].analyzed_files
+
+def test_scan_tar_incremental(image_tar):
+    path, names = image_tar
+    per_layer = scan_tar(path, None, False)
+    incremental = scan_tar(path, None, False, delta=True)
+    assert list(incremental.keys()) == list(per_layer.keys())
+    for layer in names:
+        assert set(incremental[layer].packages) == set(per_layer[layer].packages)
+    assert len(incremental[names[0]].package_changes) == 1